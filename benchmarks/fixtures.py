@@ -0,0 +1,96 @@
+from __future__ import annotations
+from typing import List, Tuple, Type
+import os
+import sys
+
+# the game runs from src/ (assets are loaded relative to it), so do the same
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, SRC)
+os.chdir(SRC)
+
+import numpy as np
+import pygame
+
+from grid import TileGrid, EMPTY
+from tiles import TileMap
+from entities import DynamicEntity
+from utils import tmAsset, AssetType, ART_SCALE
+
+'''
+procedural fixtures for the benchmarks, everything is seeded so runs are comparable
+
+- BenchTileMap: TileMap with generated tile art, so benchmarks dont depend on which pngs are checked in
+- make_map: n tiles over `layers` layers in a square around the origin + boundary tiles at `boundary_density`
+- make_swarm: DynamicEntities scattered over the map with random velocities
+- Wanderer: swarm entity with a real update(), steers a little every tick and moves through update_physics
+  so Game.update pays for it like it would for an enemy
+'''
+
+SCREEN_SIZE = (1280, 720)
+TILE_SIZE = 32
+N_TILE_IDS = 4
+
+def init_display() -> pygame.Surface:
+  pygame.init()
+  return pygame.display.set_mode(SCREEN_SIZE)
+
+class BenchTileMap(TileMap):
+  def load_assets(self):
+    px = round(TILE_SIZE * ART_SCALE)
+    self.tileIDtoTile = {}
+    for tile_id in range(1, N_TILE_IDS + 1):
+      surface = pygame.Surface((px, px), pygame.SRCALPHA)
+      surface.fill((40 * tile_id, 255 - 40 * tile_id, 120, 255))
+      pygame.draw.rect(surface, (0, 0, 0, 255), surface.get_rect(), 1)
+      self.tileIDtoTile[tile_id] = tmAsset(surface, AssetType.TileRend, tile_id)
+
+# degrees the velocity turns per tick, a full circle every ~2s at 60 ticks
+WANDER_DEGREES = 3.0
+
+class Wanderer(DynamicEntity):
+  def update(self, dt: float, collision):
+    self.velocity = self.velocity.rotate(WANDER_DEGREES)
+    self.update_physics(dt, collision)
+
+def map_side(n_tiles: int) -> int: return int(np.ceil(np.sqrt(n_tiles)))
+
+def make_map(n_tiles: int, layers: int = 1, boundary_density: float = 0.05, seed: int = 0) -> BenchTileMap:
+  rng = np.random.default_rng(seed)
+  tm = BenchTileMap(tile_size=TILE_SIZE, map_name=None)
+  side = map_side(n_tiles)
+  origin = -(side // 2)
+
+  for layer in range(1, layers + 1):
+    tiles = rng.integers(1, N_TILE_IDS + 1, size=(side, side)).astype(np.int16)
+    # upper layers are sparse decoration over the base layer
+    if layer > 1: tiles[rng.random((side, side)) > 0.2] = EMPTY
+    grid = TileGrid()
+    grid.set_window(origin, origin, tiles)
+    tm.maps[f'layer_{layer}'] = grid
+
+  boundary = np.where(rng.random((side, side)) < boundary_density, 0, EMPTY).astype(np.int16)
+  # keep the middle clear so the player / swarm dont spawn inside walls
+  mid = side // 2
+  boundary[mid - 4:mid + 4, mid - 4:mid + 4] = EMPTY
+  tm.maps['boundary'].set_window(origin, origin, boundary)
+
+  tm.layers = list(tm.maps.keys())
+  tm.chunk_cache.clear()
+  return tm
+
+def make_swarm(n: int, tm: TileMap, spread_tiles: int = 40, seed: int = 0, cls: Type[DynamicEntity] = DynamicEntity) -> List[DynamicEntity]:
+  rng = np.random.default_rng(seed)
+  swarm = []
+  for x, y, v_x, v_y in zip(rng.uniform(-spread_tiles, spread_tiles, n) * tm.tile_size,
+                            rng.uniform(-spread_tiles, spread_tiles, n) * tm.tile_size,
+                            rng.uniform(-150, 150, n), rng.uniform(-150, 150, n)):
+    e = cls((float(x), float(y)), (32, 32))
+    e.velocity.update(float(v_x), float(v_y))
+    swarm.append(e)
+  return swarm
+
+# camera pans diagonally from the middle of the map at `speed` px per frame (~player speed at 60fps)
+def camera_path(frames: int, speed: float = 4.0) -> List[Tuple[float, float]]:
+  return [(-SCREEN_SIZE[0] / 2 + speed * i, -SCREEN_SIZE[1] / 2 + speed * 0.5 * i) for i in range(frames)]
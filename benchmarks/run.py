@@ -0,0 +1,302 @@
+from __future__ import annotations
+from typing import Callable, Dict, List
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# fixtures chdirs into src/, resolve our own paths first
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LAUNCH_DIR = os.getcwd()
+sys.path.insert(0, BENCH_DIR)
+from fixtures import init_display, make_map, make_swarm, camera_path, SCREEN_SIZE, Wanderer
+
+import numpy as np
+import pygame
+
+'''
+headless benchmark suite, runs with SDL_VIDEODRIVER=dummy on a box with no display
+
+  python benchmarks/run.py                      # full sizes (10k -> 1M tiles)
+  python benchmarks/run.py --quick              # small sizes, for a quick check
+  python benchmarks/run.py --only tilemap_render physics
+  python benchmarks/run.py --save-baseline      # write benchmarks/baseline.json
+  python benchmarks/run.py --tolerance 0.15     # fail (exit 1) when a case is >15% slower than the baseline
+
+results are {case: {"median_ms", "p95_ms", "samples"}} per frame / call, see --out
+'''
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+Results = Dict[str, Dict[str, float]]
+BENCHMARKS: Dict[str, Callable[[bool], Results]] = {}
+
+def benchmark(name: str):
+  def register(fn):
+    BENCHMARKS[name] = fn
+    return fn
+  return register
+
+def stats(samples: List[float]) -> Dict[str, float]:
+  ms = np.asarray(samples) * 1000
+  return {'median_ms': float(np.median(ms)), 'p95_ms': float(np.percentile(ms, 95)), 'samples': len(samples)}
+
+# time fn() `repeat` times after `warmup` untimed calls
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 2) -> Dict[str, float]:
+  for _ in range(warmup): fn()
+  samples = []
+  for _ in range(repeat):
+    t = time.perf_counter()
+    fn()
+    samples.append(time.perf_counter() - t)
+  return stats(samples)
+
+
+@benchmark('tilemap_render')
+def bench_tilemap_render(quick: bool) -> Results:
+  from utils import GameState
+  out = {}
+  frames = 60 if quick else 240
+  for n_tiles in ([10_000, 100_000] if quick else [10_000, 100_000, 1_000_000]):
+    for layers in (1, 3):
+      tm = make_map(n_tiles, layers)
+      for state in (GameState.PLAYING, GameState.MAP_EDITOR):
+        tm.game_state = state
+        path = iter(camera_path(frames + 2))
+        out[f'tilemap_render/{n_tiles}/{layers}L/{state.name}'] = measure(lambda: tm.render(next(path), *SCREEN_SIZE), frames)
+  return out
+
+@benchmark('physics')
+def bench_physics(quick: bool) -> Results:
+  from main import Game
+  from physics import PhysicsWorld
+  from utils import FIXED_DT
+  out = {}
+  frames = 60 if quick else 240
+  tm = make_map(10_000, 1, boundary_density=0.05)
+
+  for n in ([100, 500] if quick else [100, 500, 2000]):
+    game = Game(tilemap=tm)
+    swarm = make_swarm(n, tm)
+    for e in swarm: game.add_entity(e)
+    def step():
+      for e in swarm: e.update_physics(FIXED_DT, game.collision)
+    out[f'physics/update_physics/{n}'] = measure(step, frames)
+
+    for e in swarm: e.tile_collision = True
+    out[f'physics/swept_tiles/{n}'] = measure(step, frames)
+    for e in swarm: e.tile_collision = False
+
+    world = PhysicsWorld(tm.tile_size, broadphase=game.spatial)
+    for e in swarm: world.add(e)
+    boundary = tm.get_boundary_tiles()
+    out[f'physics/batch_world/{n}'] = measure(lambda: world.step(FIXED_DT, boundary), frames)
+  return out
+
+@benchmark('animation')
+def bench_animation(quick: bool) -> Results:
+  from animation import Animation
+  anims = [
+    Animation("../assets/player/Sword_2_Template_Run_Down-Sheet.png", 1, 6, frame_duration=15),
+    Animation("../assets/player/Sword_10_Template_Special_Attack_Down-Sheet.png", 1, 24, st=7, ed=18, total_animation_time=50),
+  ]
+  # one sample = update + get_img on 1000 animated entities
+  def frame():
+    for _ in range(500):
+      for anim in anims:
+        anim.update()
+        anim.get_img()
+  return {'animation/get_img/1000': measure(frame, 30 if quick else 120)}
+
+@benchmark('map_io')
+def bench_map_io(quick: bool) -> Results:
+  from mapio import read_json_map
+  from utils import MAP_TO_BIN
+  out = {}
+  repeat = 5 if quick else 10
+  with tempfile.TemporaryDirectory() as tmp:
+    MAP_TO_BIN['bench'] = os.path.join(tmp, 'bench.mrsp')
+    for n_tiles in ([10_000, 100_000] if quick else [10_000, 100_000, 1_000_000]):
+      tm = make_map(n_tiles, 3)
+      tm.map_name = 'bench'
+      out[f'map_io/save_current_map/{n_tiles}'] = measure(tm.save_current_map, repeat, warmup=1)
+      out[f'map_io/load_map_binary/{n_tiles}'] = measure(lambda: tm.load_map(MAP_TO_BIN['bench']), repeat, warmup=1)
+
+      # the old json format, only at sizes where it finishes in reasonable time
+      if n_tiles <= (10_000 if quick else 100_000):
+        json_path = os.path.join(tmp, 'bench.json')
+        with open(json_path, 'w') as f:
+          json.dump({name: {str(k): v for k, v in layer.items()} for name, layer in tm.maps.items() if name != 'offgrid'}, f)
+        out[f'map_io/load_map_json/{n_tiles}'] = measure(lambda: read_json_map(json_path), 3, warmup=0)
+    del MAP_TO_BIN['bench']
+  return out
+
+@benchmark('game_frame')
+def bench_game_frame(quick: bool) -> Results:
+  from main import Game
+  from utils import FIXED_DT
+  out = {}
+  frames = 60 if quick else 240
+  tm = make_map(100_000, 3)
+  for n in ([0, 200] if quick else [0, 200, 1000]):
+    game = Game(tilemap=tm)
+    game.dt = FIXED_DT
+    # entities near the camera so they are ticked, drawn and collide instead of sleeping off screen
+    for e in make_swarm(n, tm, spread_tiles=15, cls=Wanderer): game.add_entity(e)
+    def frame():
+      game.update(FIXED_DT)
+      game.render()
+    out[f'game_frame/{n}_entities'] = measure(frame, frames)
+  return out
+
+@benchmark('startup')
+def bench_startup(quick: bool) -> Results:
+  import animation
+  from main import Game
+  from utils import ASSET_CACHE, FIXED_DT
+  tm = make_map(10_000, 1)
+  # cold asset caches every sample, the tilemap fixture has generated art so only entity sheets load
+  def first_frame():
+    ASSET_CACHE.clear()
+    animation._FRAME_CACHE.clear()
+    game = Game(tilemap=tm)
+    game.update(FIXED_DT)
+    game.render()
+  return {'startup/first_frame': measure(first_frame, 5 if quick else 20, warmup=1)}
+
+@benchmark('pathfinding')
+def bench_pathfinding(quick: bool) -> Results:
+  from pathfinding import FlowField
+  out = {}
+  repeat = 30 if quick else 120
+  for density in (0.05, 0.3):
+    tm = make_map(10_000, 1, boundary_density=density)
+    field = FlowField(tm.tile_size)
+    targets = iter([(i % 7, i % 5) for i in range(repeat + 2)])
+    # a rebuild is what a player changing tile costs
+    def rebuild():
+      field.retarget(next(targets), tm.get_boundary_tiles(), 0)
+      field.build()
+    out[f'pathfinding/build/{density}'] = measure(rebuild, repeat)
+
+  rng = np.random.default_rng(0)
+  positions = [tuple(p) for p in rng.uniform(-20 * tm.tile_size, 20 * tm.tile_size, (1000, 2)).tolist()]
+  def lookups():
+    for pos in positions: field.direction(pos)
+  out['pathfinding/direction/1000'] = measure(lookups, repeat)
+  return out
+
+@benchmark('atlas')
+def bench_atlas(quick: bool) -> Results:
+  from atlas import TextureAtlas, default_sources
+  sources = default_sources()
+  repeat = 3 if quick else 10
+  with tempfile.TemporaryDirectory() as tmp:
+    # cold pack (decode + scale + trim + pack + save) vs a start that finds the cached pages
+    build = measure(lambda: TextureAtlas.build(sources).save(tmp), repeat, warmup=0)
+    load = measure(lambda: TextureAtlas.load(sources, tmp), repeat, warmup=1)
+  return {'atlas/build': build, 'atlas/load_cached': load}
+
+@benchmark('pools')
+def bench_pools(quick: bool) -> Results:
+  from entities import DynamicEntity, HitboxProc
+  from pool import ObjectPool
+  owner = DynamicEntity((0, 0), (32, 32))
+  repeat = 30 if quick else 120
+  n = 200
+  # a swing's worth of hitboxes, constructed fresh vs recycled through a pool
+  def construct():
+    for _ in range(n): HitboxProc(owner, (25, 25), 100)
+  pool = ObjectPool(HitboxProc)
+  def pooled():
+    for hitbox in [pool.acquire(owner, (25, 25), 100) for _ in range(n)]: pool.release(hitbox)
+  return {'pools/hitbox_construct/200': measure(construct, repeat), 'pools/hitbox_pooled/200': measure(pooled, repeat)}
+
+@benchmark('combat')
+def bench_combat(quick: bool) -> Results:
+  from spatial import SpatialHash
+  from combat import CombatResolver
+  from entities import HitboxProc
+  from utils import BASE_PIXEL_SCALE
+  out = {}
+  repeat = 30 if quick else 120
+  tm = make_map(10_000, 1)
+  for n in (200, 2000):
+    swarm = make_swarm(n, tm, spread_tiles=20)
+    index = SpatialHash(cell_size=32 * BASE_PIXEL_SCALE * 2)
+    for e in swarm: index.insert(e)
+    # every 10th entity mid swing, hits are forgotten each call so every overlap is reported again
+    attackers = swarm[::10]
+    for e in attackers: e.add_hitbox(HitboxProc, (96, 96), 10 ** 9)
+    resolver = CombatResolver(index)
+    def resolve():
+      resolver.resolve(attackers)
+      for e in attackers: e.active_hb[0].hits.clear()
+    # every hitbox against every entity, what the grid saves
+    def naive():
+      for e in attackers:
+        for hitbox in e.active_hb: [t for t in swarm if t is not e and hitbox.hb.colliderect(t.rect)]
+    out[f'combat/resolve/{n}'] = measure(resolve, repeat)
+    out[f'combat/naive/{n}'] = measure(naive, repeat)
+    for e in attackers: e.release_hitboxes()
+  return out
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+  regressions = []
+  print(f"\n{'case':<48}{'baseline':>12}{'current':>12}{'ratio':>8}")
+  for case, current in results.items():
+    base = baseline.get(case)
+    if base is None: continue
+    ratio = current['median_ms'] / base['median_ms'] if base['median_ms'] > 0 else float('inf')
+    flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+    print(f"{case:<48}{base['median_ms']:>10.3f}ms{current['median_ms']:>10.3f}ms{ratio:>8.2f}{flag}")
+    if flag: regressions.append(case)
+  return regressions
+
+def main(argv=None) -> int:
+  parser = argparse.ArgumentParser(description="mr-spinner headless benchmarks")
+  parser.add_argument('--quick', action='store_true', help="smaller maps / swarms and fewer samples")
+  parser.add_argument('--only', nargs='*', choices=sorted(BENCHMARKS), help="run a subset")
+  parser.add_argument('--out', default=None, help="write results json here")
+  parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+  parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+  parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown vs the baseline (0.2 = 20%%)")
+  args = parser.parse_args(argv)
+  if args.out: args.out = os.path.join(LAUNCH_DIR, args.out)
+  args.baseline = os.path.join(LAUNCH_DIR, args.baseline)
+
+  init_display()
+  results: Results = {}
+  for name in (args.only or BENCHMARKS):
+    t = time.perf_counter()
+    results.update(BENCHMARKS[name](args.quick))
+    print(f"{name}: {time.perf_counter() - t:.1f}s", file=sys.stderr)
+
+  report = {
+    'meta': {'python': platform.python_version(), 'pygame': pygame.version.ver, 'numpy': np.__version__,
+             'machine': platform.machine(), 'quick': args.quick},
+    'results': results,
+  }
+  for case, s in results.items(): print(f"{case:<48}{s['median_ms']:>10.3f}ms  p95 {s['p95_ms']:.3f}ms")
+
+  if args.out:
+    with open(args.out, 'w') as f: json.dump(report, f, indent=2)
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f: json.dump(report, f, indent=2)
+    return 0
+
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as f: baseline = json.load(f)
+    if baseline['meta'].get('quick') != args.quick: print("baseline was recorded with a different --quick setting", file=sys.stderr)
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+      print(f"\n{len(regressions)} regression(s) over {args.tolerance:.0%}", file=sys.stderr)
+      return 1
+  return 0
+
+if __name__ == "__main__":
+  sys.exit(main())
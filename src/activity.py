@@ -0,0 +1,124 @@
+from __future__ import annotations
+from typing import Dict, List, Set, Tuple
+from dataclasses import dataclass
+from enum import Enum, auto
+import pygame
+
+from spatial import SpatialHash
+
+'''
+ActivityManager: simulation LOD, decides which entities get ticked this update and with how much dt
+
+- ACTIVE: on screen (camera view + active_margin), ticked every update
+- NEAR: within near_margin of the view, ticked every policy.near_interval updates with the dt they missed
+- ASLEEP: everything else, never looked at, the spatial hash query only visits cells around the camera
+  so the per tick cost depends on what is near the player and not on how big the world is
+- entities wake up when the camera gets close again (or wake() is called), they dont catch up on time asleep
+- ActivityPolicy is a class attribute on the entity classes, statics are never ticked
+'''
+
+class ActivityTier(Enum): ACTIVE = auto(); NEAR = auto(); ASLEEP = auto();
+
+# past the view, in px. active covers anything that can still draw on screen (see RENDER_CULL_MARGIN)
+SIM_ACTIVE_MARGIN = 192
+SIM_NEAR_MARGIN = 1024
+
+@dataclass(frozen=True)
+class ActivityPolicy:
+  ticked: bool = True
+  always_active: bool = False
+  # updates between ticks in the NEAR tier
+  near_interval: int = 4
+  # False: stays in the NEAR tier however far away it gets
+  sleeps: bool = True
+
+class ActivityManager:
+  def __init__(self, index: SpatialHash, active_margin: int = SIM_ACTIVE_MARGIN, near_margin: int = SIM_NEAR_MARGIN):
+    self.index = index
+    self.active_margin = active_margin
+    self.near_margin = near_margin
+    self.ticks = 0
+
+    # registration order, keeps tick order deterministic and staggers NEAR entities over the interval
+    self.order: Dict[object, int] = {}
+    self.next_order = 0
+    # entities that have to be looked at wherever they are
+    self.pinned: Set = set()
+    # entity -> updates left awake, from wake()
+    self.woken: Dict[object, int] = {}
+
+    # tiers of everything that was awake last tick, and the dt NEAR entities are owed
+    self.tiers: Dict[object, ActivityTier] = {}
+    self.pending: Dict[object, float] = {}
+    # entity -> dt it was ticked with, this update
+    self.ticked: Dict[object, float] = {}
+
+  def add(self, entity):
+    if entity in self.order: return
+    self.order[entity] = self.next_order
+    self.next_order += 1
+    policy = entity.activity
+    if policy.ticked and (policy.always_active or not policy.sleeps): self.pinned.add(entity)
+
+  def remove(self, entity):
+    self.order.pop(entity, None)
+    self.pinned.discard(entity)
+    self.woken.pop(entity, None)
+    self.tiers.pop(entity, None)
+    self.pending.pop(entity, None)
+    self.ticked.pop(entity, None)
+
+  # keep an entity ACTIVE for the next `ticks` updates wherever it is (hit by something, scripted ...)
+  def wake(self, entity, ticks: int = 60):
+    if entity in self.order: self.woken[entity] = max(ticks, self.woken.get(entity, 0))
+
+  def tier(self, entity) -> ActivityTier: return self.tiers.get(entity, ActivityTier.ASLEEP)
+
+  def tier_counts(self) -> Dict[ActivityTier, int]:
+    counts = {tier: 0 for tier in ActivityTier}
+    for tier in self.tiers.values(): counts[tier] += 1
+    return counts
+
+  # (entity, dt) for everything due this update, in registration order
+  def tick(self, dt: float, view: pygame.FRect) -> List[Tuple[object, float]]:
+    self.ticks += 1
+    active_rect = view.inflate(2 * self.active_margin, 2 * self.active_margin)
+    near_rect = view.inflate(2 * self.near_margin, 2 * self.near_margin)
+
+    candidates = self.index.query(near_rect)
+    candidates |= self.pinned
+    candidates.update(self.woken)
+
+    tiers: Dict[object, ActivityTier] = {}
+    due: List[Tuple[object, float]] = []
+    for entity in candidates:
+      order = self.order.get(entity)
+      if order is None: continue
+      policy = entity.activity
+      if not policy.ticked: continue
+
+      if policy.always_active or entity in self.woken or active_rect.colliderect(entity.rect): tier = ActivityTier.ACTIVE
+      elif not policy.sleeps or near_rect.colliderect(entity.rect): tier = ActivityTier.NEAR
+      else: continue
+      tiers[entity] = tier
+
+      if tier == ActivityTier.ACTIVE:
+        due.append((entity, self.pending.pop(entity, 0.0) + dt))
+      else:
+        owed = self.pending.get(entity, 0.0) + dt
+        if (self.ticks + order) % policy.near_interval == 0:
+          self.pending.pop(entity, None)
+          due.append((entity, owed))
+        else: self.pending[entity] = owed
+
+    # fell asleep this tick, the time they were owed is dropped
+    for entity in self.tiers.keys() - tiers.keys(): self.pending.pop(entity, None)
+    self.tiers = tiers
+
+    for entity in list(self.woken):
+      self.woken[entity] -= 1
+      if self.woken[entity] <= 0: del self.woken[entity]
+
+    due.sort(key=lambda pair: self.order[pair[0]])
+    self.ticked = dict(due)
+    return due
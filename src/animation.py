@@ -1,6 +1,23 @@
 import pygame
+from typing import Dict, List, Tuple
 
-from utils import load_image, BASE_PIXEL_SCALE
+from utils import load_image, BASE_PIXEL_SCALE, ART_SCALE, RENDER_SCALE, ASSET_CACHE, TEXTURE_ATLAS
+from atlas import shared_atlas
+
+# (sheet path, rows, columns) -> frames sliced out of the sheet, shared by every Animation on that sheet
+_FRAME_CACHE: Dict[Tuple[str, int, int], List[pygame.Surface]] = {}
+
+def sliced_frames(sheet: pygame.Surface, path: str, rows: int, columns: int) -> List[pygame.Surface]:
+  key = (path, rows, columns)
+  frames = _FRAME_CACHE.get(key)
+  if frames is None:
+    frame_width, frame_height = sheet.get_width() // columns, sheet.get_height() // rows
+    # subsurfaces share the sheet pixels, slicing costs no copies
+    frames = _FRAME_CACHE[key] = [
+      sheet.subsurface((col * frame_width, row * frame_height, frame_width, frame_height))
+      for row in range(rows) for col in range(columns)
+    ]
+  return frames
 
 class Animation:
   def __init__(self, sprite_sheet_path, rows, columns, frame_duration = 5, hit_box_size=(32, 32), loop=False, st=1, ed=None, total_animation_time:int=None): 
@@ -15,24 +32,50 @@ class Animation:
     self.st, self.ed = st, ed if ed is not None else columns
     self.current_frame = st
 
-    self.sheet = load_image(self.sprite_sheet_path, BASE_PIXEL_SCALE)
-
     if total_animation_time is not None: 
       self.animation_frame_duration = total_animation_time / (self.ed - self.st) 
     
     else: self.animation_frame_duration = frame_duration
 
     self.game_frame = st * self.animation_frame_duration
-    
-    # frame dim
-    self.frame_width = self.sheet.get_width() // columns
-    self.frame_height = self.sheet.get_height() // rows
 
-    # Calculate offsets for centering the large animation around the hitbox
-    self.x_offset = (self.frame_width - self.hitbox_width) // 2
-    self.y_offset = (self.frame_height - self.hitbox_height) // 2
+    # lazy handle: the sheet decodes on the asset workers from now on, the first get_img picks it up
+    self.sheet: pygame.Surface = None
+    self.frames: List[pygame.Surface] = None
+    # (x, y) each frame is drawn back from the entity position
+    self.frame_offsets: List[Tuple[int, int]] = None
+    if not TEXTURE_ATLAS: ASSET_CACHE.prefetch([(self.sprite_sheet_path, ART_SCALE)])
+
+  @property
+  def resolved(self) -> bool: return self.frames is not None
+
+  def resolve(self):
+    rows, columns = self.sheet_rows, self.sheet_columns
+    packed = shared_atlas().sheet(self.sprite_sheet_path, ART_SCALE) if TEXTURE_ATLAS else None
+
+    if packed is not None and (packed.rows, packed.columns) == (rows, columns):
+      # trimmed frames out of the atlas, each one knows where it sat in the untrimmed frame
+      self.frame_width, self.frame_height = packed.frame_size
+      frames, trims = packed.surfaces, [region.offset for region in packed.regions]
+    else:
+      self.sheet = load_image(self.sprite_sheet_path, BASE_PIXEL_SCALE)
+      # frame dim
+      self.frame_width = self.sheet.get_width() // columns
+      self.frame_height = self.sheet.get_height() // rows
+      frames = sliced_frames(self.sheet, self.sprite_sheet_path, rows, columns)
+      trims = [(0, 0)] * len(frames)
+
+    # Calculate offsets for centering the large animation around the hitbox (frames are in render px, the hitbox in world px)
+    self.x_offset = (self.frame_width - round(self.hitbox_width * RENDER_SCALE)) // 2
+    self.y_offset = (self.frame_height - round(self.hitbox_height * RENDER_SCALE)) // 2
+
+    self.frames = frames
+    self.frame_offsets = [(self.x_offset - t_x, self.y_offset - t_y) for t_x, t_y in trims]
+    # frames past the end of the sheet used to come out as an empty surface
+    self.blank_frame = pygame.Surface((self.frame_width, self.frame_height), pygame.SRCALPHA)
   
   # TODO: handle non looping
+  # called once per fixed simulation tick, so frame durations are in ticks not rendered frames
   def update(self):
     relative_frame = ((self.game_frame - (self.st * self.animation_frame_duration) + 1) % (self.animation_frame_duration * (self.ed - self.st + 1)))
     self.game_frame = relative_frame + (self.st * self.animation_frame_duration)
@@ -41,14 +84,13 @@ class Animation:
     self.game_frame = self.st * self.animation_frame_duration
   
   def get_img(self): 
+    if self.frames is None: self.resolve()
     current_frame = int(self.game_frame // self.animation_frame_duration)
     self.current_frame = current_frame
     # all animations were offset by 1 since current_frame * self.frame_width would not start at 0 pixels
-    frame_x = (current_frame - 1) * self.frame_width
-    frame_y = 0  # TODO: update when we have more complicated sprite sheets
+    frame_col = current_frame - 1
+    frame_row = 0  # TODO: update when we have more complicated sprite sheets
 
-    # Create full-size surface for the animation frame
-    frame_surface = pygame.Surface((self.frame_width, self.frame_height), pygame.SRCALPHA)
-    frame_surface.blit(self.sheet, (0, 0), (frame_x, frame_y, self.frame_width, self.frame_height))
-    
-    return frame_surface, (self.x_offset, self.y_offset)
\ No newline at end of file
+    if not 0 <= frame_col < self.sheet_columns: return self.blank_frame, (self.x_offset, self.y_offset)
+    frame = frame_row * self.sheet_columns + frame_col
+    return self.frames[frame], self.frame_offsets[frame]
\ No newline at end of file
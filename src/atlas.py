@@ -0,0 +1,216 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import json
+import os
+import pygame
+
+from utils import AssetCache, BASE_PATH, BASE_PIXEL_SCALE, ART_SCALE, ASSET_WORKERS, art_scale, load_image
+
+'''
+TextureAtlas: TEXTURE_ATLAS=1, tiles and animation frames packed into a few big page surfaces
+
+- a source is a whole image (tiles) or a sprite sheet cut into a frame grid, sheet frames are trimmed
+  to their opaque bounding box (most of a 128px player frame is empty) and remember where the trim started
+- shelf packer, tallest first: rects go left to right along a shelf, a full shelf opens the next one
+  below it, a full page opens the next page
+- pages + index are written to ATLAS_DIR, later starts load those pngs instead of decoding, scaling and
+  packing every sheet again. the index carries a signature (source mtimes / sizes, packer settings),
+  anything changing there rebuilds it
+- lookups hand out subsurfaces of the pages, TileMap tiles and Animation frames blit straight out of the atlas
+'''
+
+# one cache per art scale, so LOW_RES and full res runs dont keep repacking over each other
+ATLAS_DIR = BASE_PATH + f'atlas/{ART_SCALE}x/'
+ATLAS_PAGE_SIZE = 2048
+# transparent gap between packed rects
+ATLAS_PADDING = 1
+# bump when the index layout changes
+ATLAS_VERSION = 1
+
+# (normalised path, scale), same spelling as the AssetCache keys
+SourceKey = Tuple[str, int]
+
+@dataclass(frozen=True)
+class AtlasSource:
+  path: str
+  # AssetCache scale, what the art is drawn at (see art_scale)
+  scale: float = ART_SCALE
+  # frame grid of a sprite sheet in source pixels (before scaling), None = the whole image is one region
+  frame_size: Optional[Tuple[int, int]] = None
+  trim: bool = False
+
+  @property
+  def key(self) -> SourceKey: return AssetCache.key(self.path, self.scale)[:2]
+
+@dataclass
+class AtlasRegion:
+  page: int
+  rect: pygame.Rect
+  # where the trimmed rect sat inside the untrimmed frame
+  offset: Tuple[int, int] = (0, 0)
+
+@dataclass
+class AtlasSheet:
+  # scaled, untrimmed frame size
+  frame_size: Tuple[int, int]
+  rows: int
+  columns: int
+  regions: List[AtlasRegion]
+  # subsurfaces of the pages, one per region
+  surfaces: List[pygame.Surface] = field(default_factory=list)
+
+# tiles as TileMap.load_assets loads them + every player sheet (128px frames)
+def default_sources() -> List[AtlasSource]:
+  tiles = [AtlasSource('tilemaptest.png'), AtlasSource('redtile.png'), AtlasSource('danyaseethe.png', scale=art_scale(scale=False)), AtlasSource('passthrutest.png')]
+  sheets = [AtlasSource(os.path.relpath(path, BASE_PATH), frame_size=(128, 128), trim=True)
+            for path in sorted(glob.glob(BASE_PATH + 'player/*-Sheet.png'))]
+  return tiles + sheets
+
+# (page, x, y) per size in input order + the size each page ended up needing
+# rects bigger than a page get a page to themselves
+def shelf_pack(sizes: List[Tuple[int, int]], page_size: int = ATLAS_PAGE_SIZE, padding: int = ATLAS_PADDING):
+  placed: List[Optional[Tuple[int, int, int]]] = [None] * len(sizes)
+  pages: List[List[int]] = []
+  x = y = shelf_h = 0
+  for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+    w, h = sizes[i]
+    if w > page_size or h > page_size: continue
+    if not pages: pages.append([0, 0])
+    if x + w > page_size: x, y, shelf_h = 0, y + shelf_h + padding, 0
+    if y + h > page_size:
+      pages.append([0, 0])
+      x = y = shelf_h = 0
+    placed[i] = (len(pages) - 1, x, y)
+    x += w + padding
+    shelf_h = max(shelf_h, h)
+    pages[-1] = [max(pages[-1][0], x - padding), max(pages[-1][1], y + h)]
+
+  for i, (w, h) in enumerate(sizes):
+    if placed[i] is not None: continue
+    placed[i] = (len(pages), 0, 0)
+    pages.append([w, h])
+  return placed, [tuple(size) for size in pages]
+
+def signature(sources: List[AtlasSource], page_size: int, padding: int) -> list:
+  entries = []
+  for source in sources:
+    path, scale = source.key
+    stat = os.stat(path)
+    entries.append([path, scale, list(source.frame_size) if source.frame_size else None, source.trim, stat.st_mtime_ns, stat.st_size])
+  return [ATLAS_VERSION, page_size, padding, entries]
+
+class TextureAtlas:
+  def __init__(self, pages: List[pygame.Surface], sheets: Dict[SourceKey, AtlasSheet], signature: list):
+    self.pages = pages
+    self.sheets = sheets
+    self.signature = signature
+    for sheet in sheets.values():
+      sheet.surfaces = [pages[region.page].subsurface(region.rect) for region in sheet.regions]
+
+  def __len__(self) -> int: return sum(len(sheet.regions) for sheet in self.sheets.values())
+
+  def sheet(self, path: str, scale: float = ART_SCALE) -> Optional[AtlasSheet]:
+    return self.sheets.get(AssetCache.key(path, scale)[:2])
+
+  # id -> (page, rect), frame indexes count row by row like Animation does
+  def region(self, path: str, scale: float = ART_SCALE, frame: int = 0) -> Optional[AtlasRegion]:
+    sheet = self.sheet(path, scale)
+    return sheet.regions[frame] if sheet is not None else None
+
+  # whole image sources, as the page subsurface
+  def image(self, path: str, scale: float = ART_SCALE) -> Optional[pygame.Surface]:
+    sheet = self.sheet(path, scale)
+    return sheet.surfaces[0] if sheet is not None else None
+
+  def report(self) -> dict:
+    return {'pages': len(self.pages), 'regions': len(self), 'bytes': sum(AssetCache.surface_bytes(page) for page in self.pages)}
+
+  @classmethod
+  def build(cls, sources: List[AtlasSource], page_size: int = ATLAS_PAGE_SIZE, padding: int = ATLAS_PADDING) -> TextureAtlas:
+    # decoded outside the AssetCache, the sheets are dropped again once their frames are on the pages
+    with ThreadPoolExecutor(max_workers=ASSET_WORKERS, thread_name_prefix="atlas") as pool:
+      decoded = list(pool.map(AssetCache.decode, [AssetCache.key(source.path, source.scale) for source in sources]))
+
+    cut: List[Tuple[SourceKey, pygame.Surface, pygame.Rect]] = []
+    grids: Dict[SourceKey, Tuple[Tuple[int, int], int, int]] = {}
+    for source, (image, _) in zip(sources, decoded):
+      image = image.convert_alpha()
+      if source.frame_size is None: frame_w, frame_h = image.get_size()
+      else: frame_w, frame_h = round(source.frame_size[0] * source.scale), round(source.frame_size[1] * source.scale)
+      rows, columns = image.get_height() // frame_h, image.get_width() // frame_w
+      grids[source.key] = ((frame_w, frame_h), rows, columns)
+
+      for row in range(rows):
+        for col in range(columns):
+          rect = pygame.Rect(col * frame_w, row * frame_h, frame_w, frame_h)
+          if source.trim:
+            bounds = image.subsurface(rect).get_bounding_rect()
+            # blank frames still need a region, keep a transparent pixel
+            if bounds.width == 0 or bounds.height == 0: bounds = pygame.Rect(0, 0, 1, 1)
+            rect = bounds.move(rect.topleft)
+          cut.append((source.key, image, rect))
+
+    placed, page_sizes = shelf_pack([rect.size for _, _, rect in cut], page_size, padding)
+    pages = [pygame.Surface(size, pygame.SRCALPHA).convert_alpha() for size in page_sizes]
+    for page in pages: page.fill((0, 0, 0, 0))
+
+    sheets = {key: AtlasSheet(frame_size, rows, columns, []) for key, (frame_size, rows, columns) in grids.items()}
+    for (key, image, rect), (page, x, y) in zip(cut, placed):
+      frame_w, frame_h = sheets[key].frame_size
+      # RGBA_MAX onto the cleared page copies the pixels as they are, a normal blit would blend them
+      pages[page].blit(image, (x, y), rect, special_flags=pygame.BLEND_RGBA_MAX)
+      sheets[key].regions.append(AtlasRegion(page, pygame.Rect(x, y, rect.width, rect.height), (rect.x % frame_w, rect.y % frame_h)))
+    return cls(pages, sheets, signature(sources, page_size, padding))
+
+  def save(self, directory: str = ATLAS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    names = []
+    for i, page in enumerate(self.pages):
+      names.append(f'page_{i}.png')
+      pygame.image.save(page, os.path.join(directory, names[-1]))
+    sheets = [{'path': path, 'scale': scale, 'frame_size': list(sheet.frame_size), 'rows': sheet.rows, 'columns': sheet.columns,
+               'regions': [[r.page, *r.rect, *r.offset] for r in sheet.regions]} for (path, scale), sheet in self.sheets.items()]
+    # index last, a half written atlas never has a matching index
+    with open(os.path.join(directory, 'index.json'), 'w') as f:
+      json.dump({'signature': self.signature, 'pages': names, 'sheets': sheets}, f)
+
+  # None when there is no index or it was packed from different sources / settings
+  @classmethod
+  def load(cls, sources: List[AtlasSource], directory: str = ATLAS_DIR, page_size: int = ATLAS_PAGE_SIZE, padding: int = ATLAS_PADDING) -> Optional[TextureAtlas]:
+    try:
+      with open(os.path.join(directory, 'index.json'), 'r') as f: index = json.load(f)
+      expected = json.loads(json.dumps(signature(sources, page_size, padding)))
+      if index.get('signature') != expected: return None
+      pages = [pygame.image.load(os.path.join(directory, name)).convert_alpha() for name in index['pages']]
+    except (OSError, ValueError, pygame.error): return None
+
+    sheets = {}
+    for entry in index['sheets']:
+      regions = [AtlasRegion(page, pygame.Rect(x, y, w, h), (o_x, o_y)) for page, x, y, w, h, o_x, o_y in entry['regions']]
+      sheets[(entry['path'], entry['scale'])] = AtlasSheet(tuple(entry['frame_size']), entry['rows'], entry['columns'], regions)
+    return cls(pages, sheets, index['signature'])
+
+  @classmethod
+  def load_or_build(cls, sources: List[AtlasSource], directory: str = ATLAS_DIR) -> TextureAtlas:
+    atlas = cls.load(sources, directory)
+    if atlas is not None: return atlas
+    atlas = cls.build(sources)
+    # read only installs just pack on every start
+    try: atlas.save(directory)
+    except (OSError, pygame.error): pass
+    return atlas
+
+_SHARED: Optional[TextureAtlas] = None
+
+def shared_atlas() -> TextureAtlas:
+  global _SHARED
+  if _SHARED is None: _SHARED = TextureAtlas.load_or_build(default_sources())
+  return _SHARED
+
+# load_image, but out of the shared atlas when the image was packed into it
+def atlas_image(path: str, pixel_scale=BASE_PIXEL_SCALE, scale: bool = True) -> pygame.Surface:
+  surface = shared_atlas().image(path, art_scale(pixel_scale, scale))
+  return surface if surface is not None else load_image(path, pixel_scale, scale)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import math
+import numpy as np
+import pygame
+
+from grid import TileGrid, CHUNK_SIZE, EMPTY
+from spatial import SpatialHash
+
+'''
+CollisionGeometry: boundary layer as merged, rect only colliders
+
+- every TileGrid chunk is greedy meshed on its own: take the first run of wall tiles in a row,
+  grow it down while the rows below have the same run, emit one rect, clear it, repeat
+- rects never cross a chunk edge, so an editor edit only re-meshes the one chunk it touched
+- colliders live in a (non binding) SpatialHash, query(rect) hands CollisionProc the handful of
+  merged rects around an entity instead of a StaticEntity (+ Surface) per tile
+
+sweep_axis: TILE_COLLISION=1 path, moves a rect along one axis and stops it flush against the first
+boundary tile its leading edge sweeps into, reads the chunk arrays directly and builds no containers
+'''
+
+# a sub-step never moves further than this fraction of a tile, so corners cant be cut diagonally
+SUBSTEP_TILE_FRACTION = 0.5
+MAX_SUBSTEPS = 16
+
+Region = Tuple[int, int]
+
+# only a rect, CollisionProc just needs .rect to push against
+class Collider:
+  __slots__ = "rect",
+  def __init__(self, rect: pygame.FRect):
+    self.rect = rect
+
+# (x, y, w, h) in cells, greedy rectangle cover of a 2D bool mask indexed [y, x]
+def greedy_rects(mask: np.ndarray) -> List[Tuple[int, int, int, int]]:
+  mask = mask.copy()
+  height = mask.shape[0]
+  rects = []
+  for y in range(height):
+    while mask[y].any():
+      x0 = int(np.argmax(mask[y]))
+      # run ends at the first empty cell after x0
+      gaps = np.flatnonzero(~mask[y, x0:])
+      x1 = x0 + int(gaps[0]) if gaps.size else mask.shape[1]
+      y1 = y + 1
+      while y1 < height and mask[y1, x0:x1].all(): y1 += 1
+      mask[y:y1, x0:x1] = False
+      rects.append((x0, y, x1 - x0, y1 - y))
+  return rects
+
+class CollisionGeometry:
+  def __init__(self, tile_size: int, cell_size: int = 0):
+    self.tile_size = tile_size
+    self.index = SpatialHash(cell_size or tile_size * 2, bind=False)
+    self.regions: Dict[Region, List[Collider]] = {}
+    self.boundary: Optional[TileGrid] = None
+    # bumped on every (re)build, entities holding on to colliders check it
+    self.revision = 0
+
+  def __len__(self) -> int: return sum(len(colliders) for colliders in self.regions.values())
+
+  def build(self, boundary: TileGrid):
+    self.clear()
+    self.boundary = boundary
+    for region in list(boundary.chunks): self.rebuild_region(region)
+
+  def clear(self):
+    self.index = SpatialHash(self.index.cell_size, bind=False)
+    self.regions = {}
+
+  def rebuild_region(self, region: Region):
+    arr = self.boundary.chunk(*region) if self.boundary is not None else None
+    self.install_region(region, greedy_rects(arr != EMPTY) if arr is not None else [])
+
+  # swap in already meshed rects (tiles, relative to the chunk), the streaming worker meshes off the main thread
+  # rects=None re-meshes from the boundary grid
+  def install_region(self, region: Region, rects: Optional[List[Tuple[int, int, int, int]]]):
+    if rects is None: return self.rebuild_region(region)
+    self.revision += 1
+    for collider in self.regions.pop(region, ()): self.index.remove(collider)
+    if not rects: return
+
+    ts = self.tile_size
+    o_x, o_y = region[0] * CHUNK_SIZE, region[1] * CHUNK_SIZE
+    colliders = []
+    for x, y, w, h in rects:
+      collider = Collider(pygame.FRect((o_x + x) * ts, (o_y + y) * ts, w * ts, h * ts))
+      self.index.insert(collider)
+      colliders.append(collider)
+    self.regions[region] = colliders
+
+  # re-mesh the chunks holding the edited tiles
+  def rebuild_tiles(self, coords: Iterable[Tuple[int, int]]):
+    for region in {TileGrid.split(coord)[0] for coord in coords}: self.rebuild_region(region)
+
+  def query(self, rect: pygame.FRect) -> Set[Collider]: return self.index.query(rect)
+
+
+def is_solid(chunks: Dict[Tuple[int, int], np.ndarray], x: int, y: int) -> bool:
+  arr = chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+  return arr is not None and arr.item(y % CHUNK_SIZE, x % CHUNK_SIZE) != EMPTY
+
+# sub-steps needed so no single step moves more than SUBSTEP_TILE_FRACTION of a tile
+def substeps(d_x: float, d_y: float, tile_size: int) -> int:
+  return max(1, min(MAX_SUBSTEPS, math.ceil(max(abs(d_x), abs(d_y)) / (tile_size * SUBSTEP_TILE_FRACTION))))
+
+# axis 0 = x, 1 = y, returns True when a tile stopped us
+def sweep_axis(rect: pygame.FRect, delta: float, axis: int, boundary: TileGrid, tile_size: int) -> bool:
+  if delta == 0: return False
+  ts, chunks = tile_size, boundary.chunks
+  if axis == 0: lead_lo, lead_hi, side_lo, side_hi = rect.left, rect.right, rect.top, rect.bottom
+  else: lead_lo, lead_hi, side_lo, side_hi = rect.top, rect.bottom, rect.left, rect.right
+
+  # tiles spanned on the other axis, edges that only touch dont count (same as FRect.colliderect)
+  span_lo, span_hi = math.floor(side_lo / ts), math.ceil(side_hi / ts) - 1
+
+  if delta > 0:
+    # tiles from the first one past the leading edge to the one it ends up in
+    for t in range(math.ceil(lead_hi / ts), math.ceil((lead_hi + delta) / ts)):
+      for s in range(span_lo, span_hi + 1):
+        if is_solid(chunks, t, s) if axis == 0 else is_solid(chunks, s, t):
+          if axis == 0: rect.right = t * ts
+          else: rect.bottom = t * ts
+          return True
+  else:
+    # same going back: from the first tile wholly past the leading edge, the one we overlap already doesnt count
+    for t in range(math.floor(lead_lo / ts) - 1, math.floor((lead_lo + delta) / ts) - 1, -1):
+      for s in range(span_lo, span_hi + 1):
+        if is_solid(chunks, t, s) if axis == 0 else is_solid(chunks, s, t):
+          if axis == 0: rect.left = (t + 1) * ts
+          else: rect.top = (t + 1) * ts
+          return True
+
+  if axis == 0: rect.x += delta
+  else: rect.y += delta
+  return False
@@ -0,0 +1,58 @@
+from __future__ import annotations
+from typing import Iterable, List, Tuple, TYPE_CHECKING
+from dataclasses import dataclass
+import pygame
+
+from spatial import SpatialHash
+from profiler import PROFILER
+
+if TYPE_CHECKING:
+  from entities import DynamicEntity, HitboxProc
+
+'''
+CombatResolver: hitboxes vs hurtboxes, once per simulation tick after physics
+
+- hurtboxes are entity rects of anything with hurtbox = True, looked up in the SpatialHash the game
+  already keeps in step with movement, so a hitbox only looks at the cells it overlaps instead of every entity
+- every active hitbox of the ticked DynamicEntities is gathered first, then tested against its candidates
+  with one collidelistall per hitbox (the overlap loop runs in C), the owner never hits itself
+- a hitbox remembers who it hit and at which lifetime (HitboxProc.hits), a target is hit once per swing,
+  or again every rehit_interval ticks for hitboxes that set one, a recycled hitbox starts a new swing
+- resolve() returns the HitEvents of the tick, the game hands them to the targets (DynamicEntity.on_hit)
+  after every hitbox was tested, so reactions (knockback, despawning) never change what else got hit
+'''
+
+@dataclass
+class HitEvent:
+  attacker: DynamicEntity
+  target: DynamicEntity
+  hitbox: HitboxProc
+  # centre of the hitbox / hurtbox overlap, world px
+  point: Tuple[float, float]
+
+class CombatResolver:
+  def __init__(self, index: SpatialHash):
+    self.index = index
+    # last tick's hits
+    self.events: List[HitEvent] = []
+
+  def resolve(self, attackers: Iterable[DynamicEntity]) -> List[HitEvent]:
+    swings = [(attacker, hitbox) for attacker in attackers for hitbox in getattr(attacker, 'active_hb', ())]
+    self.events = events = []
+    if not swings: return events
+
+    tests = 0
+    for attacker, hitbox in swings:
+      area = pygame.FRect(hitbox.hb)
+      targets = [e for e in self.index.query(area) if e.hurtbox and e is not attacker and hitbox.can_hit(e)]
+      if not targets: continue
+      tests += len(targets)
+      for i in area.collidelistall([target.rect for target in targets]):
+        target = targets[i]
+        hitbox.hits[target] = hitbox.lifetime
+        events.append(HitEvent(attacker, target, hitbox, area.clip(target.rect).center))
+
+    if PROFILER.enabled:
+      PROFILER.count('hit_tests', tests)
+      PROFILER.count('hits', len(events))
+    return events
@@ -1,12 +1,21 @@
 from __future__ import annotations
-from typing import Tuple, Optional, List, Dict
-from utils import load_image, tmAsset, DEBUG
+from typing import Tuple, Optional, List, Dict, TYPE_CHECKING
+from utils import load_image, tmAsset, DEBUG, TILE_COLLISION, RENDER_SCALE, world_size
 import pygame
 
 from animation import Animation
+from spatial import SpatialHash
+from activity import ActivityPolicy
+from collision import sweep_axis, substeps
+from profiler import PROFILER
+from pool import pool_for
 from enum import Enum, auto
 import math
 
+if TYPE_CHECKING:
+  from collision import CollisionGeometry
+  from render import RenderQueue
+  from combat import HitEvent
 
 class CollisionAxis(Enum): HORIZONTAL = auto(); VERTICAL = auto();
 class EntityState(Enum): IDLE = auto(); MOVING = auto();
@@ -30,18 +39,28 @@ class CollisionProc:
     self.entity = entity
   
   def check_collision(self, entity_groups, axis: CollisionAxis):
+    if PROFILER.enabled: PROFILER.count('collision_pairs', sum(len(group) for group in entity_groups))
     for group in entity_groups:
       for sprite in group:
         if sprite.rect.colliderect(self.entity.rect) and sprite != self.entity:
           self.handle_collision(sprite, axis)
+
+  # one flat candidate list without the entity itself (DynamicEntity.nearby_entities)
+  def collide(self, candidates: List[Entity], axis: CollisionAxis):
+    if PROFILER.enabled: PROFILER.count('collision_pairs', len(candidates))
+    rect = self.entity.rect
+    for sprite in candidates:
+      if sprite.rect.colliderect(rect): self.handle_collision(sprite, axis)
   
   def handle_collision(self, other, axis: CollisionAxis):
+    # one read, in a PhysicsWorld every read copies out of its buffer
+    velocity = self.entity.velocity
     if axis == CollisionAxis.HORIZONTAL:
-      if self.entity.velocity.x > 0: self.entity.rect.right = other.rect.left
-      if self.entity.velocity.x < 0: self.entity.rect.left = other.rect.right
+      if velocity.x > 0: self.entity.rect.right = other.rect.left
+      if velocity.x < 0: self.entity.rect.left = other.rect.right
     elif axis == CollisionAxis.VERTICAL:
-      if self.entity.velocity.y > 0: self.entity.rect.bottom = other.rect.top
-      if self.entity.velocity.y < 0: self.entity.rect.top = other.rect.bottom
+      if velocity.y > 0: self.entity.rect.bottom = other.rect.top
+      if velocity.y < 0: self.entity.rect.top = other.rect.bottom
 
 class RenderProc:
   __slots__ = "image", "anim_offset", "display_surface"
@@ -50,29 +69,72 @@ class RenderProc:
     self.anim_offset = anim_offset
     self.display_surface = pygame.display.get_surface()
   
-  def render(self, position: Tuple[float, float], camera_scroll: pygame.Vector2):
-    screen_pos = (
-      position[0] - camera_scroll.x - self.anim_offset[0],
-      position[1] - camera_scroll.y - self.anim_offset[1]
+  # position / scroll are world px, the image and anim_offset are render px (same thing unless LOW_RES)
+  def screen_pos(self, position: Tuple[float, float], camera_scroll: pygame.Vector2) -> Tuple[float, float]:
+    return (
+      (position[0] - camera_scroll.x) * RENDER_SCALE - self.anim_offset[0],
+      (position[1] - camera_scroll.y) * RENDER_SCALE - self.anim_offset[1]
     )
-    self.display_surface.blit(self.image, screen_pos)
+
+  # queue: batch into a RenderQueue (y = draw order key) instead of blitting straight away
+  def render(self, position: Tuple[float, float], camera_scroll: pygame.Vector2, queue: Optional[RenderQueue] = None, y: Optional[float] = None):
+    if queue is not None: queue.push(self.image, self.screen_pos(position, camera_scroll), y=y)
+    else: self.display_surface.blit(self.image, self.screen_pos(position, camera_scroll))
+
+  # area render() will touch, padded a pixel for float positions
+  def screen_rect(self, position: Tuple[float, float], camera_scroll: pygame.Vector2) -> pygame.Rect:
+    x, y = self.screen_pos(position, camera_scroll)
+    return pygame.Rect(math.floor(x), math.floor(y), self.image.get_width() + 1, self.image.get_height() + 1)
 
 # HITBOXES HAVE TO BE SURFACES SO WE CAN ROTATE THEM
 # TODO: refactor more, take the spinny parts and put it in the SpinningHBProc in player
 # make more general so we can use these for enemies n shit too
 # I dont think for spinning the hitbox needs to rotate, I think it can just 'orbit' the player at an offset
 
+# nothing draws onto these, every hitbox / placeholder entity of the same size and colour shares one
+DEBUG_SURFACES: Dict[Tuple[int, int, Tuple[int, ...], int], pygame.Surface] = {}
+
+# size in world px, the surface is in render px
+def debug_surface(size: Tuple[int, int], color: Tuple[int, ...], flags: int = 0) -> pygame.Surface:
+  key = (round(size[0] * RENDER_SCALE), round(size[1] * RENDER_SCALE), tuple(color), flags)
+  surface = DEBUG_SURFACES.get(key)
+  if surface is None:
+    surface = DEBUG_SURFACES[key] = pygame.Surface(key[:2], flags)
+    surface.fill(color)
+    PROFILER.count('surfaces_allocated')
+  return surface
+
+# hitboxes are pooled (see pool.py), go through DynamicEntity.add_hitbox / remove_hitbox instead of constructing them
 class HitboxProc: 
-  __slots__ = "owner", "lifetime" 
+  __slots__ = "owner", "lifetime", "surface_hb", "hb", "hits"
+  # anim frame -> hitbox offset from the owner, subclasses override
+  anim_schedule: Dict[int, Tuple[int, int]] = {}
+  # ticks before the same target can be hit again, None = once per swing (see combat.py)
+  rehit_interval: Optional[int] = None
+
   def __init__(self, owner: Entity, size: Tuple[int, int], lifetime: int): 
-    self.owner, self.lifetime = owner, lifetime
+    self.hb, self.surface_hb = pygame.Rect(0, 0, 0, 0), None
+    # target -> lifetime left when we hit it
+    self.hits: Dict[Entity, int] = {}
+    self.reset(owner, size, lifetime)
 
-    self.surface_hb = pygame.Surface(size, pygame.SRCALPHA)
-    self.surface_hb.fill((255, 0, 0, 128))
-    self.hb = self.surface_hb.get_rect()
+  # same arguments as __init__, a recycled hitbox keeps its Rect
+  def reset(self, owner: Entity, size: Tuple[int, int], lifetime: int):
+    self.owner, self.lifetime = owner, lifetime
+    if self.surface_hb is None or self.hb.size != tuple(size):
+      self.surface_hb = debug_surface(size, (255, 0, 0, 128), pygame.SRCALPHA)
+      self.hb.size = size
     self.hb.center = owner.rect.center
+    self.hits.clear()
+
+  def on_release(self):
+    self.owner = None
+    self.hits.clear()
 
-    self.anim_schedule:Dict[int, Tuple[int, int]]
+  def can_hit(self, target: Entity) -> bool:
+    hit_at = self.hits.get(target)
+    if hit_at is None: return True
+    return self.rehit_interval is not None and hit_at - self.lifetime >= self.rehit_interval
 
   @property
   def x(self): return self.hb.x
@@ -90,13 +152,34 @@ class HitboxProc:
 
 
 class Entity(pygame.sprite.Sprite): 
+  # how the ActivityManager ticks this class, override per subclass
+  activity = ActivityPolicy()
+  # CombatResolver only tests hitboxes against entities that have one
+  hurtbox = False
+
   def __init__(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]]=None, asset:Optional[tmAsset]=None): 
     super().__init__()  
     self.display_surface = pygame.display.get_surface()
+    self.place(pos, size, asset)
+
+    # set by SpatialHash.insert, entities outside a hash fall back to scanning their groups
+    self.broadphase: Optional[SpatialHash] = None
+
+  # image / rect from scratch, shared by __init__ and pooled reuse (reset)
+  def place(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
     self.asset = asset 
     self.image = asset.asset if asset else self._create_default_surface(size)
 
-    self.rect = self.image.get_frect(topleft=pos)
+    self.rect = pygame.FRect(pos, world_size(self.image) if asset else size)
+    # position at the previous simulation tick, for render interpolation
+    self.prev_pos: Tuple[float, float] = (self.rect.x, self.rect.y)
+
+  # pooled reuse (Game.spawn), same arguments as __init__, the entity is out of every group / hash by now
+  def reset(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
+    self.place(pos, size, asset)
+
+  # handed back to its pool, subclasses drop what they hold on to
+  def on_release(self): pass
 
   @property
   def get_pos(self): return (self.rect.x, self.rect.y)
@@ -116,16 +199,20 @@ class Entity(pygame.sprite.Sprite):
   @property
   def center_y(self): return self.rect.y + (self.rect.height / 2)
 
-  def _create_default_surface(self, size: Tuple[int, int]) -> pygame.Surface:
-    surface = pygame.Surface(size)
-    surface.fill((255, 0, 0))
-    return surface
+  def _create_default_surface(self, size: Tuple[int, int]) -> pygame.Surface: return debug_surface(size, (255, 0, 0))
 
   def set_state(self, new_state:Enum) -> str:
     if self.state != new_state:
       if self.anim: self.anim.reset()
       self.state = new_state
   
+  def store_previous_position(self): self.prev_pos = (self.rect.x, self.rect.y)
+
+  # where to draw between the last two ticks, alpha = 1 is the current position
+  def interpolated_pos(self, alpha: float) -> Tuple[float, float]:
+    return (self.prev_pos[0] + (self.rect.x - self.prev_pos[0]) * alpha,
+            self.prev_pos[1] + (self.rect.y - self.prev_pos[1]) * alpha)
+
   # tile size = 32, pixel scaling = 3
   def tile_position(self):
     p_tile_x = int(self.rect.centerx // (32 * 2))
@@ -136,6 +223,7 @@ class Entity(pygame.sprite.Sprite):
 class StaticEntity(Entity):
   phys: CollisionProc
   renderer: RenderProc
+  activity = ActivityPolicy(ticked=False)
   def __init__(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
     super().__init__(pos, size, asset)
     self.state = None
@@ -147,15 +235,31 @@ class StaticEntity(Entity):
     self.phys = CollisionProc(self)
     self.renderer = RenderProc(self.image, self.anim_offset)
 
-  def render(self, camera_scroll:pygame.Vector2): 
-    self.renderer.render(self.get_pos, camera_scroll)
+  def reset(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
+    super().reset(pos, size, asset)
+    self.state = None
+    self.anim = None
+    self.anim_offset = [0, 0]
+    self.renderer.image, self.renderer.anim_offset = self.image, self.anim_offset
+
+  def render(self, camera_scroll:pygame.Vector2, alpha: float = 1.0, queue: Optional[RenderQueue] = None): 
+    self.renderer.render(self.get_pos, camera_scroll, queue, self.rect.bottom)
+
+  def screen_rect(self, camera_scroll:pygame.Vector2, alpha: float = 1.0) -> pygame.Rect:
+    return self.renderer.screen_rect(self.get_pos, camera_scroll)
 
 class DynamicEntity(Entity):
   phys: CollisionProc
   renderer: RenderProc
+  # swept tile collision against the boundary grid instead of the merged colliders, see collision.py
+  tile_collision = bool(TILE_COLLISION)
+  hurtbox = True
   def __init__(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
     super().__init__(pos, size, asset)
-    self.velocity = pygame.math.Vector2(0, 0)
+    # set by PhysicsWorld.add, the world integrates us in bulk instead of update_physics
+    self.physics_world = None
+
+    self._velocity = pygame.math.Vector2(0, 0)
     self.direction = pygame.math.Vector2(0, 1)
     self.state = None
 
@@ -170,54 +274,153 @@ class DynamicEntity(Entity):
     self.renderer = RenderProc(self.image, self.anim_offset)
 
     self.boundary = ()
+    # CollisionGeometry.revision self.boundary was gathered at, editor edits re-mesh the colliders
+    self.boundary_revision = -1
+
+    # reused by nearby_entities, so moving builds no containers
+    self.neighbours: List[Entity] = []
+    self.sweep_rect = pygame.FRect(self.rect)
+
+  # in a PhysicsWorld its vel buffer is the velocity, reads refresh _velocity from it, assign to change it
+  # (in place edits are lost there, the next read overwrites them)
+  @property
+  def velocity(self) -> pygame.Vector2:
+    if self.physics_world is not None: return self.physics_world.velocity(self, self._velocity)
+    return self._velocity
+
+  @velocity.setter
+  def velocity(self, value):
+    if self.physics_world is not None: self.physics_world.set_velocity(self, value)
+    else: self._velocity.update(value)
+
+  def reset(self, pos: Tuple[int, int], size: Optional[Tuple[int, int]] = None, asset: Optional[tmAsset] = None):
+    super().reset(pos, size, asset)
+    self.velocity = (0, 0)
+    self.direction.update(0, 1)
+    self.state = None
+    self.anim = None
+    self.anim_offset = [0, 0]
+    self.renderer.image, self.renderer.anim_offset = self.image, self.anim_offset
+    self.release_hitboxes()
+    self.boundary = ()
+    self.boundary_revision = -1
+
+  def on_release(self):
+    self.release_hitboxes()
+    self.boundary = ()
+
+  # hitboxes come from the per class pool, handed back on remove / expiry
+  def add_hitbox(self, cls: type, size: Tuple[int, int], lifetime: int) -> HitboxProc:
+    hitbox = pool_for(cls).acquire(self, size, lifetime)
+    self.active_hb.append(hitbox)
+    return hitbox
+
+  def remove_hitbox(self, hitbox: HitboxProc):
+    if hitbox not in self.active_hb: return
+    self.active_hb.remove(hitbox)
+    pool_for(type(hitbox)).release(hitbox)
+
+  def release_hitboxes(self):
+    for hitbox in self.active_hb[:]: self.remove_hitbox(hitbox)
+
+  # a hitbox of someone else's overlapped us this tick, override per subclass (damage, knockback)
+  def on_hit(self, event: HitEvent): pass
+
+  # lifetimes are in simulation ticks, NEAR tier entities get the ticks they skipped in one go (see Game.update)
+  def tick_hitboxes(self, ticks: float = 1.0):
+    for hitbox in self.active_hb[:]:
+      hitbox.lifetime -= ticks
+      if hitbox.lifetime <= 0: self.remove_hitbox(hitbox)
   
   def tile_pos(self, px_pos): return int(px_pos // (32 * 2))
   
   # TODO: add spatial partitioning for static entities
-  # idk what we're gonna do about dynamic entities like moving mobs ect.
-  def update_physics(self, dt: float, boundary_dict):
+  # dynamic entities go through the Game owned SpatialHash (see collision_groups)
+  def update_physics(self, dt: float, collision: CollisionGeometry):
+    if self.physics_world is not None: return
+    if self.tile_collision: return self.update_physics_swept(dt, collision)
 
     old_x = self.rect.centerx
     self.rect.x += self.velocity.x * dt
-    if self.tile_pos(old_x) != self.tile_pos(self.rect.centerx):
-      self.boundary =self.get_nearby_tiles_for_CProc(boundary_dict, 2)
+    if self.tile_pos(old_x) != self.tile_pos(self.rect.centerx) or self.boundary_revision != collision.revision:
+      self.boundary = self.get_nearby_tiles_for_CProc(collision, 2)
 
-    self.phys.check_collision([list(self.boundary), *self.groups()], CollisionAxis.HORIZONTAL)
+    self.phys.check_collision([self.boundary, *self.collision_groups()], CollisionAxis.HORIZONTAL)
     
     old_y = self.rect.centery
     self.rect.y += self.velocity.y * dt
     if self.tile_pos(old_y) != self.tile_pos(self.rect.centery):
-      self.boundary = self.get_nearby_tiles_for_CProc(boundary_dict, 2)
-
-    self.phys.check_collision([list(self.boundary), *self.groups()], CollisionAxis.VERTICAL)
+      self.boundary = self.get_nearby_tiles_for_CProc(collision, 2)
+
+    self.phys.check_collision([self.boundary, *self.collision_groups()], CollisionAxis.VERTICAL)
+    if self.broadphase is not None: self.broadphase.move(self)
+
+  # swept against the grid one axis at a time, fast movers (spin dashes, knockback, dt spikes) get sub-stepped
+  def update_physics_swept(self, dt: float, collision: CollisionGeometry):
+    boundary, ts = collision.boundary, collision.tile_size
+    d_x, d_y = self.velocity.x * dt, self.velocity.y * dt
+    # one broadphase lookup over the whole move, most sub-steps then have nobody to test against
+    neighbours = self.nearby_entities(d_x, d_y)
+    n = substeps(d_x, d_y, ts)
+    d_x, d_y = d_x / n, d_y / n
+
+    for _ in range(n):
+      if boundary is not None: sweep_axis(self.rect, d_x, 0, boundary, ts)
+      else: self.rect.x += d_x
+      if neighbours: self.phys.collide(neighbours, CollisionAxis.HORIZONTAL)
+
+      if boundary is not None: sweep_axis(self.rect, d_y, 1, boundary, ts)
+      else: self.rect.y += d_y
+      if neighbours: self.phys.collide(neighbours, CollisionAxis.VERTICAL)
+    if self.broadphase is not None: self.broadphase.move(self)
+
+  # candidate entities for collision, only the neighbouring cells when we're in a broadphase
+  def collision_groups(self):
+    if self.broadphase is not None: return (self.broadphase.query(self.rect),)
+    return self.groups()
+
+  # everything the rect could touch moving (d_x, d_y) this frame, without us, in the reused self.neighbours
+  def nearby_entities(self, d_x: float, d_y: float) -> List[Entity]:
+    rect, sweep, out = self.rect, self.sweep_rect, self.neighbours
+    sweep.update(rect.x + min(d_x, 0), rect.y + min(d_y, 0), rect.width + abs(d_x), rect.height + abs(d_y))
+    if self.broadphase is not None: return self.broadphase.gather(sweep, out, self)
+    out.clear()
+    for group in self.groups():
+      for sprite in group:
+        if sprite is not self and sprite not in out: out.append(sprite)
+    return out
 
-  # tile area around the player
+  # merged boundary rects within rad tiles of the entity
   # should only be called when the player changes tile position
-  def get_nearby_tiles_for_CProc(self, boundary_dict, rad): 
-    p_x, p_y = self.tile_position()
-    boundary = set()
-    for i in range(p_x - rad, p_x + rad, 1): 
-      for j in range(p_y - rad, p_y + rad, 1): 
-        if (i,j) in boundary_dict.keys():
-          boundary.add(boundary_dict[(i,j)])
-    return boundary
-    
-    # loop through each tile coordinate round player
-    # if that coordinate exists in the tilemap boundary dict
-    # add to entities collision group
-    # collision group gets called on update_physics
+  def get_nearby_tiles_for_CProc(self, collision: CollisionGeometry, rad): 
+    reach = 2 * rad * 32 * 2
+    self.boundary_revision = collision.revision
+    return collision.query(self.rect.inflate(reach, reach))
 
-  def render(self, camera_scroll:pygame.Vector2): 
-    self.renderer.render(self.get_pos, camera_scroll)
+  def render(self, camera_scroll:pygame.Vector2, alpha: float = 1.0, queue: Optional[RenderQueue] = None): 
+    pos = self.interpolated_pos(alpha)
+    self.renderer.render(pos, camera_scroll, queue, self.rect.bottom)
 
     # if you want to render the hitboxes
-    if len(self.active_hb) > 0: 
-      for hitbox in self.active_hb: 
-        screen_pos = (
-          hitbox.x - camera_scroll[0] - self.anim_offset[0],
-          hitbox.y - camera_scroll[1] - self.anim_offset[1]
-        )
-        self.display_surface.blit(hitbox.surface_hb, screen_pos)
+    for hitbox, screen_pos in self.hitbox_screen_positions(pos, camera_scroll):
+      if queue is not None: queue.push(hitbox.surface_hb, screen_pos)
+      else: self.display_surface.blit(hitbox.surface_hb, screen_pos)
+
+  def hitbox_screen_positions(self, pos: Tuple[float, float], camera_scroll:pygame.Vector2):
+    # hitboxes follow the same interpolation as their owner
+    d_x, d_y = pos[0] - self.rect.x, pos[1] - self.rect.y
+    for hitbox in self.active_hb: 
+      yield hitbox, (
+        (hitbox.x + d_x - camera_scroll[0]) * RENDER_SCALE - self.anim_offset[0],
+        (hitbox.y + d_y - camera_scroll[1]) * RENDER_SCALE - self.anim_offset[1]
+      )
+
+  def screen_rect(self, camera_scroll:pygame.Vector2, alpha: float = 1.0) -> pygame.Rect:
+    pos = self.interpolated_pos(alpha)
+    rect = self.renderer.screen_rect(pos, camera_scroll)
+    for hitbox, (x, y) in self.hitbox_screen_positions(pos, camera_scroll):
+      rect.union_ip(pygame.Rect(math.floor(x), math.floor(y), hitbox.surface_hb.get_width() + 1, hitbox.surface_hb.get_height() + 1))
+    return rect
 
 
 
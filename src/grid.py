@@ -0,0 +1,174 @@
+from __future__ import annotations
+from typing import Dict, Iterator, Iterable, Tuple, Optional
+from collections.abc import MutableMapping
+import numpy as np
+
+# tiles per side of a storage chunk, one chunk is CHUNK_SIZE^2 int16 = 2KB
+CHUNK_SIZE = 32
+# tile ids are >= 0 (boundary tiles store 0), so empty cells are -1
+EMPTY = -1
+
+'''
+TileGrid: one map layer stored as CHUNK_SIZE x CHUNK_SIZE int16 numpy chunks
+
+- chunks are allocated on first write, so the grid grows in any direction (negative coords too)
+- arrays are indexed [y, x] like an image, window() returns the same layout
+- behaves like the old {(x, y): tile_id} dict so the editor / save code keeps working
+'''
+
+class TileGrid(MutableMapping):
+  __slots__ = "chunks", "counts", "_len"
+  def __init__(self, tiles: Optional[Iterable[Tuple[Tuple[int, int], int]]] = None):
+    self.chunks: Dict[Tuple[int, int], np.ndarray] = {}
+    self.counts: Dict[Tuple[int, int], int] = {}
+    self._len = 0
+    if tiles is not None:
+      for coord, tile_id in tiles: self[coord] = tile_id
+
+  # wrap existing chunk arrays (e.g. views into a memory mapped map file) without copying
+  @classmethod
+  def from_chunks(cls, chunks: Dict[Tuple[int, int], np.ndarray], counts: Dict[Tuple[int, int], int]) -> TileGrid:
+    grid = cls()
+    grid.chunks, grid.counts = dict(chunks), dict(counts)
+    grid._len = sum(counts.values())
+    return grid
+
+  @staticmethod
+  def split(coord: Tuple[int, int]) -> Tuple[Tuple[int, int], int, int]:
+    c_x, l_x = divmod(int(coord[0]), CHUNK_SIZE)
+    c_y, l_y = divmod(int(coord[1]), CHUNK_SIZE)
+    return (c_x, c_y), l_x, l_y
+
+  def chunk(self, c_x: int, c_y: int) -> Optional[np.ndarray]: return self.chunks.get((c_x, c_y))
+
+  # swap a whole chunk in (streaming / save), None or a zero count drops it
+  def set_chunk(self, key: Tuple[int, int], arr: Optional[np.ndarray], count: int):
+    self._len -= self.counts.pop(key, 0)
+    self.chunks.pop(key, None)
+    if arr is None or count == 0: return
+    self.chunks[key], self.counts[key] = arr, count
+    self._len += count
+
+  def __getitem__(self, coord: Tuple[int, int]) -> int:
+    key, l_x, l_y = self.split(coord)
+    arr = self.chunks.get(key)
+    if arr is None or arr[l_y, l_x] == EMPTY: raise KeyError(coord)
+    return int(arr[l_y, l_x])
+
+  def get(self, coord: Tuple[int, int], default: Optional[int] = None) -> Optional[int]:
+    key, l_x, l_y = self.split(coord)
+    arr = self.chunks.get(key)
+    if arr is None or arr[l_y, l_x] == EMPTY: return default
+    return int(arr[l_y, l_x])
+
+  def __setitem__(self, coord: Tuple[int, int], tile_id: int):
+    key, l_x, l_y = self.split(coord)
+    arr = self.chunks.get(key)
+    if arr is None:
+      arr = self.chunks[key] = np.full((CHUNK_SIZE, CHUNK_SIZE), EMPTY, dtype=np.int16)
+      self.counts[key] = 0
+    if arr[l_y, l_x] == EMPTY:
+      self.counts[key] += 1
+      self._len += 1
+    arr[l_y, l_x] = tile_id
+
+  def __delitem__(self, coord: Tuple[int, int]):
+    key, l_x, l_y = self.split(coord)
+    arr = self.chunks.get(key)
+    if arr is None or arr[l_y, l_x] == EMPTY: raise KeyError(coord)
+    arr[l_y, l_x] = EMPTY
+    self._len -= 1
+    self.counts[key] -= 1
+    # drop chunks that emptied out so sparse edits dont leak memory
+    if self.counts[key] == 0:
+      del self.chunks[key], self.counts[key]
+
+  def __contains__(self, coord) -> bool:
+    key, l_x, l_y = self.split(coord)
+    arr = self.chunks.get(key)
+    return arr is not None and arr[l_y, l_x] != EMPTY
+
+  def __len__(self) -> int: return self._len
+
+  def __iter__(self) -> Iterator[Tuple[int, int]]:
+    for coord, _ in self.items(): yield coord
+
+  # vectorized per chunk instead of a __getitem__ per key
+  def items(self) -> Iterator[Tuple[Tuple[int, int], int]]:
+    for (c_x, c_y), arr in list(self.chunks.items()):
+      ys, xs = np.nonzero(arr != EMPTY)
+      o_x, o_y = c_x * CHUNK_SIZE, c_y * CHUNK_SIZE
+      for x, y, tile_id in zip((xs + o_x).tolist(), (ys + o_y).tolist(), arr[ys, xs].tolist()):
+        yield (x, y), tile_id
+
+  def values(self) -> Iterator[int]:
+    for _, tile_id in self.items(): yield tile_id
+
+  # dense [y, x] copy of tiles in [x0, x1) x [y0, y1), EMPTY where there is nothing
+  def window(self, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+    out = np.full((max(y1 - y0, 0), max(x1 - x0, 0)), EMPTY, dtype=np.int16)
+    if out.size == 0: return out
+
+    for c_y in range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1):
+      for c_x in range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1):
+        arr = self.chunks.get((c_x, c_y))
+        if arr is None: continue
+        o_x, o_y = c_x * CHUNK_SIZE, c_y * CHUNK_SIZE
+        s_x, e_x = max(x0, o_x), min(x1, o_x + CHUNK_SIZE)
+        s_y, e_y = max(y0, o_y), min(y1, o_y + CHUNK_SIZE)
+        out[s_y - y0:e_y - y0, s_x - x0:e_x - x0] = arr[s_y - o_y:e_y - o_y, s_x - o_x:e_x - o_x]
+    return out
+
+  # bulk write of a dense [y, x] block at (x0, y0), EMPTY cells in `tiles` clear what was there
+  def set_window(self, x0: int, y0: int, tiles: np.ndarray):
+    h, w = tiles.shape
+    if h == 0 or w == 0: return
+    x1, y1 = x0 + w, y0 + h
+
+    for c_y in range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1):
+      for c_x in range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1):
+        o_x, o_y = c_x * CHUNK_SIZE, c_y * CHUNK_SIZE
+        s_x, e_x = max(x0, o_x), min(x1, o_x + CHUNK_SIZE)
+        s_y, e_y = max(y0, o_y), min(y1, o_y + CHUNK_SIZE)
+        block = tiles[s_y - y0:e_y - y0, s_x - x0:e_x - x0]
+
+        key = (c_x, c_y)
+        arr = self.chunks.get(key)
+        if arr is None:
+          if not (block != EMPTY).any(): continue
+          arr = self.chunks[key] = np.full((CHUNK_SIZE, CHUNK_SIZE), EMPTY, dtype=np.int16)
+          self.counts[key] = 0
+        arr[s_y - o_y:e_y - o_y, s_x - o_x:e_x - o_x] = block
+
+        count = int(np.count_nonzero(arr != EMPTY))
+        self._len += count - self.counts[key]
+        if count: self.counts[key] = count
+        else: del self.chunks[key], self.counts[key]
+
+  # (xs, ys, ids) of every tile inside the window
+  def window_tiles(self, x0: int, y0: int, x1: int, y1: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    win = self.window(x0, y0, x1, y1)
+    ys, xs = np.nonzero(win != EMPTY)
+    return xs + x0, ys + y0, win[ys, xs]
+
+  # tile ids at arbitrary (xs[i], ys[i]), one numpy gather per distinct chunk touched
+  def lookup(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+    out = np.full(xs.shape, EMPTY, dtype=np.int16)
+    if xs.size == 0 or not self.chunks: return out
+
+    c_xs, l_xs = np.divmod(xs, CHUNK_SIZE)
+    c_ys, l_ys = np.divmod(ys, CHUNK_SIZE)
+    # one int64 per chunk (chunks within +-2**20 of the origin), a flat unique sorts far faster than unique(axis=0)
+    keys = ((c_xs.ravel() + (1 << 20)) << 21) + (c_ys.ravel() + (1 << 20))
+    uniq, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(xs.shape)
+
+    for i, key in enumerate(uniq.tolist()):
+      arr = self.chunks.get(((key >> 21) - (1 << 20), (key & ((1 << 21) - 1)) - (1 << 20)))
+      if arr is None: continue
+      sel = inverse == i
+      out[sel] = arr[l_ys[sel], l_xs[sel]]
+    return out
+
+  def nbytes(self) -> int: return sum(arr.nbytes for arr in self.chunks.values())
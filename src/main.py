@@ -1,15 +1,25 @@
 from __future__ import annotations
-from typing import Dict, List
+from typing import Dict, List, Optional
 import pygame
 import sys
 import time
 
 from player import Player
 from tiles import TileMap
-from utils import Camera, MAP_TO_JSON, GameState, BASE_PIXEL_SCALE
+from utils import ASSET_CACHE, Camera, MAP_TO_JSON, GameState, BASE_PIXEL_SCALE, BATCH_PHYSICS, FIXED_DT, MAX_FRAME_TIME, FPS_CAP, VSYNC, DIRTY_RECTS, LOW_RES, NATIVE_SIZE, WINDOW_SCALE
 from enum import Enum, auto
 
-from entities import StaticEntity
+from entities import StaticEntity, DynamicEntity, Entity
+from spatial import SpatialHash
+from physics import PhysicsWorld
+from activity import ActivityManager
+from collision import CollisionGeometry
+from pathfinding import FlowField
+from pool import pool_for
+from combat import CombatResolver
+from render import DirtyRectRenderer, EntityRenderPass, RenderQueue, LowResTarget, LAYER_UI
+from ui import HUD
+from profiler import PROFILER, STARTUP
 
 
 
@@ -18,23 +28,45 @@ class CollisionType(Enum):
   VERTICAL = auto()
 
 class Game:
-  def __init__(self):
-    pygame.init()
-    pygame.display.set_caption("Mr_Spinner")
-    self.width, self.height = 1280, 720
-    self.screen = pygame.display.set_mode((self.width, self.height))
+  # tilemap lets tools (benchmarks, level transitions) hand in a prepared map instead of the dev map
+  def __init__(self, tilemap: Optional[TileMap] = None):
+    with STARTUP.phase('display'):
+      pygame.init()
+      pygame.display.set_caption("Mr_Spinner")
+      self.width, self.height = (NATIVE_SIZE[0] * WINDOW_SCALE, NATIVE_SIZE[1] * WINDOW_SCALE) if LOW_RES and WINDOW_SCALE else (1280, 720)
+      # vsync needs a renderer backed window, SCALED gives us one without changing the resolution
+      self.screen = pygame.display.set_mode((self.width, self.height), pygame.SCALED if VSYNC else 0, vsync=VSYNC)
+    self.clock = pygame.time.Clock()
     self.running = True
     self.state = GameState.PLAYING
 
-    self.camera = Camera(self.width, self.height)
-    self.init_entity_groups()
-    self.init_entities()
+    # dt = wall time of the last frame, alpha = how far we are into the next simulation tick
+    self.dt = 0.0
+    self.alpha = 1.0
+
+    # LOW_RES: the world is drawn into a native resolution surface and scaled up once per frame
+    self.low_res = LowResTarget(self.screen, NATIVE_SIZE, WINDOW_SCALE) if LOW_RES else None
+    # the dirty rect renderer patches the window directly, LOW_RES always redraws + scales the whole frame
+    self.dirty_renderer = DirtyRectRenderer(self.screen) if DIRTY_RECTS and not LOW_RES else None
+    # full redraws collect every blit of the frame and submit them with fblits
+    self.world_target = self.low_res.surface if self.low_res is not None else self.screen
+    self.render_queue = RenderQueue(self.world_target)
+    with STARTUP.phase('hud'): self.hud = HUD()
+
+    # camera size is in world px, the same as the window unless LOW_RES
+    self.camera = Camera(*(self.low_res.view_size if self.low_res is not None else (self.width, self.height)))
+    # player animations only queue their sheets here, they decode while the tilemap loads
+    with STARTUP.phase('entities'):
+      self.init_entity_groups()
+      self.init_entities()
 
 
     self.mouse_position = None
 
     # init tilemap
-    self.load_level(TileMap(tile_size=32, map_name='dev'))
+    with STARTUP.phase('tilemap'):
+      if tilemap is None: tilemap = TileMap(tile_size=32, map_name='dev')
+    with STARTUP.phase('level'): self.load_level(tilemap)
     
 
     '''
@@ -44,35 +76,80 @@ class Game:
     '''
 
   # get offgrid entities
-  # create boundary dict
+  # mesh the boundary layer into merged collision rects
   # we should do the same for static_es in the future
   def load_level(self, map:TileMap): 
     self.current_map = map 
-    self.boundary_dict = {} 
+    self.current_map.viewport = self.low_res
     self.static_e_dict = {}
 
     for offgrid_entity in map.off_grid_assets:
-      self.entities.add(offgrid_entity)
-
-    for boundary_tile in self.current_map.get_boundary_tiles(): 
-      x_pos = boundary_tile[0] * self.current_map.tile_size - self.camera.scroll[0]
-      y_pos = boundary_tile[1] * self.current_map.tile_size - self.camera.scroll[1]
-
-      new_e = StaticEntity((x_pos, y_pos), (self.current_map.tile_size, self.current_map.tile_size), None)
-      self.boundaries.add(new_e)
-
-      self.boundary_dict[boundary_tile[0], boundary_tile[1]] = new_e
+      self.add_entity(offgrid_entity)
+
+    self.collision = CollisionGeometry(self.current_map.tile_size)
+    self.collision.build(self.current_map.get_boundary_tiles())
+    # shared path to the player for everything chasing it, see pathfinding.py
+    self.flow_field = FlowField(self.current_map.tile_size)
+    # streamed maps start empty, block on the chunks around the spawn once
+    self.stream_world(wait=True)
+
+  # STREAM_WORLD: keep entities / collision in step with the chunks the tilemap streams in and out
+  def stream_world(self, wait: bool = False) -> None:
+    tm = self.current_map
+    if tm.streamer is None: return
+    center = (self.camera.scroll.x + self.camera.width / 2, self.camera.scroll.y + self.camera.height / 2)
+    spawned, despawned, regions = tm.stream_update(center, wait)
+    for entity in despawned:
+      if entity in self.entities: self.remove_entity(entity)
+    for entity in spawned: self.add_entity(entity)
+    for region, rects in regions: self.collision.install_region(region, rects)
+    PROFILER.count('chunks_streamed', len(regions))
 
   def init_entity_groups(self) -> None:
     # player // collidable dynamic/static sprites
     self.entities = pygame.sprite.Group()
 
-    # player // collodable dynamic/static sprites (?) // boundary tiles
-    self.boundaries = pygame.sprite.Group()
-
     # player // collidable dynamic/static sprites // non collidable dynamic/static sprites
     # idk if we will ever use this
     self.all_sprites = pygame.sprite.Group()
+
+    # broadphase for entity vs entity collisions, cells are 2x2 tiles
+    self.spatial = SpatialHash(cell_size=32 * BASE_PIXEL_SCALE * 2)
+
+    # which entities get ticked, by distance from the camera
+    self.activity = ActivityManager(self.spatial)
+
+    # culled + y-sorted entity draw list
+    self.render_pass = EntityRenderPass(self.spatial)
+
+    # hitboxes vs entity rects through the same broadphase, after movement every tick
+    self.combat = CombatResolver(self.spatial)
+
+    # opt-in batch integration against the boundary grid
+    self.physics_world = PhysicsWorld(32 * BASE_PIXEL_SCALE, broadphase=self.spatial) if BATCH_PHYSICS else None
+
+  # keep the entities group, the broadphase and the activity tiers in sync
+  def add_entity(self, entity: Entity) -> None:
+    self.entities.add(entity)
+    self.spatial.insert(entity)
+    self.activity.add(entity)
+    if self.physics_world is not None and isinstance(entity, DynamicEntity): self.physics_world.add(entity)
+
+  def remove_entity(self, entity: Entity) -> None:
+    self.entities.remove(entity)
+    self.spatial.remove(entity)
+    self.activity.remove(entity)
+    if self.physics_world is not None: self.physics_world.remove(entity)
+
+  # short lived entities (projectiles, effects, spawned enemies) come out of a per class pool, see pool.py
+  def spawn(self, cls: type, *args) -> Entity:
+    entity = pool_for(cls).acquire(*args)
+    self.add_entity(entity)
+    return entity
+
+  def despawn(self, entity: Entity) -> None:
+    if entity in self.entities: self.remove_entity(entity)
+    pool_for(type(entity)).release(entity)
   
 
   def set_state(self, new_state: GameState) -> None:
@@ -83,8 +160,8 @@ class Game:
   def init_entities(self) -> None:
     self.player = Player((0, 0), (32, 32))
     self.box = StaticEntity((25, 25), (30, 30), None)
-    self.entities.add(self.player)
-    self.entities.add(self.box)
+    self.add_entity(self.player)
+    self.add_entity(self.box)
 
 
   def handle_events(self) -> None:
@@ -100,84 +177,127 @@ class Game:
         elif event.key == pygame.K_ESCAPE:
           if self.state == GameState.PAUSED: self.set_state(GameState.PLAYING)
           elif self.state == GameState.PLAYING: self.set_state(GameState.PAUSED)
+        # profiler on/off + graph, dump the ring buffer to profile_*.json / .csv
+        elif event.key == pygame.K_F3: PROFILER.toggle()
+        elif event.key == pygame.K_F4: PROFILER.dump()
 
       if self.state == GameState.MAP_EDITOR:
         tilemap_action = self.current_map.event_handler(event, self.camera.scroll)
         
         if tilemap_action and tilemap_action.get('spawned_entity'):
           new_entity = tilemap_action['spawned_entity']
-          self.entities.add(new_entity)
+          self.add_entity(new_entity)
 
         if tilemap_action and tilemap_action.get('removed_entity'):
           rm_entity = tilemap_action['removed_entity']
           if rm_entity in self.entities:
-            self.entities.remove(rm_entity)
+            self.remove_entity(rm_entity)
+
+        # only the chunks around the edited tiles get re-meshed
+        for key in ('added_boundary', 'removed_boundary'):
+          if tilemap_action and tilemap_action.get(key): self.collision.rebuild_tiles(tilemap_action[key])
 
+  # one fixed simulation tick
   def update(self, dt: float) -> None:
+    self.camera.prev_scroll.update(self.camera.scroll)
+
     if self.state == GameState.PLAYING:
-      self.entities.update(dt, self.boundary_dict)
+      view = pygame.FRect(self.camera.scroll.x, self.camera.scroll.y, self.camera.width, self.camera.height)
+      due = self.activity.tick(dt, view)
+      PROFILER.count('entities_updated', len(due))
+      for sprite, sprite_dt in due:
+        sprite.store_previous_position()
+        # hitboxes live `lifetime` ticks counting the one they were added in, by time so NEAR entities keep up
+        if isinstance(sprite, DynamicEntity) and sprite.active_hb: sprite.tick_hitboxes(sprite_dt / dt)
+        sprite.update(sprite_dt, self.collision)
+      if self.physics_world is not None: self.physics_world.step(dt, self.current_map.get_boundary_tiles(), self.activity.ticked)
+      # everything has moved, resolve the tick's hits before anyone reacts to them
+      for event in self.combat.resolve(self.activity.ticked):
+        event.target.on_hit(event)
+        self.activity.wake(event.target)
       self.camera.center_camera_on_target(self.player)
+      # only marks the field stale, chasers' first lookup after the player changes tile rebuilds it
+      self.flow_field.retarget(self.player.tile_position(), self.current_map.get_boundary_tiles(), self.collision.revision)
+    else:
+      # snapshot while paused so the interpolation collapses onto the current position
+      for sprite in self.activity.tiers: sprite.store_previous_position()
 
   def render(self) -> None:
-    self.screen.fill((0, 0, 0))
+    scroll = self.camera.interpolated_scroll(self.alpha)
+
+    if self.dirty_renderer is not None:
+      tm = self.current_map
+      sprites = self.render_pass.visible(scroll, self.camera.width, self.camera.height, tm.to_entity_renderer)
+      # anything that changes what the tilemap itself draws
+      bg_key = (tm, tm.revision, self.state, tm.selected_layer)
+      overlays = self.render_ui(scroll)
+      PROFILER.lap('hud')
+      self.dirty_renderer.render(tm, sprites, overlays, scroll, self.alpha, bg_key)
+      PROFILER.lap('dirty_render')
+      return
+
+    self.world_target.fill((0, 0, 0))
+    queue = self.render_queue
 
     # 1) Render Tilemap
-    e_from_tm = self.current_map.render([self.camera.scroll.x, self.camera.scroll.y], self.camera.width, self.camera.height)
-
-    # 2) Render y-sorted entities
-    # remove group thing
-    for sprite in sorted([*self.entities.sprites(), *e_from_tm], key=lambda s: s.rect.bottom):
-      sprite.render(self.camera.scroll)
-
-    # 3) Render UI
-    fps_t = 1 / self.dt if self.dt else 0
-    pygame.font.init()
-    my_font = pygame.font.SysFont('Times New Roman', 15)
-    mp_x, mp_y = pygame.mouse.get_pos()
-    text_surface = my_font.render(
-      f"FPS: <{int(fps_t)}>\n"
-      f"Mouse Tile Position: <{self.current_map.mouse_position_to_tile(self.camera.scroll)}>\n"
-      f"State: {self.player.state}\n"
-      f"Direction: {self.player.direction}\n"
-      f"Pixel Offset from Player:{mp_x + self.camera.scroll.x - self.player.x},{mp_y + self.camera.scroll.y - self.player.y}\n"
-      f"Tile Position:{self.player.tile_position()}\n"
-      f"Game State: {self.state}", 
-      False, (255, 255, 255)
-    )
-
-    fps_counter_position = (
-      self.player.rect.x - self.camera.scroll.x + 400,
-      self.player.rect.y - self.camera.scroll.y - 320
-    )
-    self.screen.blit(text_surface, fps_counter_position)
-
-    # If in MAP_EDITOR, show tile selection info
-    if self.state == GameState.MAP_EDITOR:
-      map_editor_ui = my_font.render(
-        f"CHANGE TILE: [A], CHANGE LAYER: [D], CHANGE OPERATION [F], BOUNDARY MODE [E]\n"
-        f"selected tile: {self.current_map.selected_tile_id}\n"
-        f"selected layer: {self.current_map.selected_layer}\n"
-        f"editor state: {self.current_map.state}",
-        False, (255, 255, 255)
-      )
-      map_editor_ui_pos = ( 
-        self.player.rect.x - self.camera.scroll.x - 600,
-        self.player.rect.y - self.camera.scroll.y - 320
-      )
-      self.screen.blit(map_editor_ui, map_editor_ui_pos)
+    e_from_tm = self.current_map.render([scroll.x, scroll.y], self.camera.width, self.camera.height, queue=queue)
+    PROFILER.lap('tilemap')
+
+    # 2) Render y-sorted entities, only the ones near the camera
+    for sprite in self.render_pass.visible(scroll, self.camera.width, self.camera.height, e_from_tm):
+      sprite.render(scroll, self.alpha, queue)
+    PROFILER.lap('entities')
+
+    # 3) Render UI, LOW_RES puts it on the window after the upscale so the text stays sharp
+    overlays = self.render_ui(scroll)
+    if self.low_res is None: queue.extend(overlays, LAYER_UI)
+    PROFILER.lap('hud')
+
+    queue.flush()
+    PROFILER.lap('flush')
+
+    if self.low_res is not None:
+      self.low_res.present()
+      self.screen.fblits(overlays)
+      PROFILER.lap('upscale')
 
     pygame.display.update()
+    PROFILER.lap('display_update')
+
+  # HUD / editor text as (surface, screen position) overlays, text is only re-rendered when it changes
+  def render_ui(self, scroll: pygame.Vector2) -> List:
+    self.hud.update(self, scroll)
+    return self.hud.overlays()
 
+  # fixed timestep: simulate in FIXED_DT ticks, render as often as we can and interpolate in between
   def run(self) -> None:
-    previous_time = time.time()
+    accumulator = 0.0
+    previous_time = time.perf_counter()
     while self.running:
-      self.dt = (time.time() - previous_time)
-      previous_time = time.time()
+      now = time.perf_counter()
+      self.dt = now - previous_time
+      previous_time = now
+      accumulator += min(self.dt, MAX_FRAME_TIME)
+      PROFILER.begin_frame()
 
       self.handle_events()
-      self.update(self.dt)
+      PROFILER.lap('handle_events')
+      while accumulator >= FIXED_DT:
+        self.update(FIXED_DT)
+        accumulator -= FIXED_DT
+      PROFILER.lap('update')
+      self.stream_world()
+      PROFILER.lap('streaming')
+
+      self.alpha = accumulator / FIXED_DT
       self.render()
+      PROFILER.end_frame()
+      if 'first_frame' not in STARTUP.marks:
+        STARTUP.mark('first_frame')
+        if STARTUP.enabled: print("\n".join(STARTUP.report(ASSET_CACHE.report())))
+      if FPS_CAP: self.clock.tick(FPS_CAP)
 
+    if self.current_map.streamer is not None: self.current_map.streamer.close()
     pygame.quit()
     sys.exit()
 
@@ -0,0 +1,205 @@
+from __future__ import annotations
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import ast
+import json
+import os
+import struct
+import sys
+import numpy as np
+
+from grid import TileGrid, CHUNK_SIZE, EMPTY
+
+'''
+.mrsp binary map format (little endian)
+
+HEADER        magic 'MRSP', version u16, chunk_size u16, layer_count u16, pad u16, entity_count u32, entity_offset u64
+per layer     name_len u16, name bytes, chunk_count u32, chunk_count * CHUNK_ENTRY
+CHUNK_ENTRY   chunk_x i32, chunk_y i32, tile_count u32, data_offset u64
+chunk data    chunk_size^2 int16 tile ids ([y, x], -1 = empty), 64 byte aligned
+entity table  entity_count * (x f32, y f32, tile_id i16) for offgrid StaticEntities
+
+loading maps the file copy-on-write, so chunks are only paged in when a window touches them
+and editor writes never go back to disk until save. saving over the mapped file moves the loaded
+grids' chunks into memory before the new file is swapped in
+
+read_map_index / read_chunk / write_chunk are for the streaming world (streaming.py): the directory is
+read up front, chunks are read one at a time and edited chunks are patched back in place
+'''
+
+MAP_MAGIC = b'MRSP'
+MAP_VERSION = 1
+
+HEADER = struct.Struct('<4sHHHHIQ')
+LAYER_NAME = struct.Struct('<H')
+CHUNK_COUNT = struct.Struct('<I')
+CHUNK_ENTRY = struct.Struct('<iiIQ')
+ENTITY_DTYPE = np.dtype([('x', '<f4'), ('y', '<f4'), ('tile_id', '<i2')])
+
+DATA_ALIGN = 64
+
+class MapFormatError(Exception): pass
+
+# layers -> {name: TileGrid}, offgrid -> [((x, y), tile_id)]
+MapData = Tuple[Dict[str, TileGrid], List[Tuple[Tuple[float, float], int]]]
+
+# (tile_count, data_offset, directory entry offset) per chunk
+ChunkEntry = Tuple[int, int, int]
+
+@dataclass
+class MapIndex:
+  path: str
+  chunk_size: int
+  layers: Dict[str, Dict[Tuple[int, int], ChunkEntry]]
+  entities: np.ndarray
+
+
+def _align(offset: int) -> int: return (offset + DATA_ALIGN - 1) // DATA_ALIGN * DATA_ALIGN
+
+# write next to the target and swap in
+def write_map(path: str, layers: Dict[str, TileGrid], offgrid: List[Tuple[Tuple[float, float], int]]):
+  tmp_path = _write_temp(path, layers, offgrid)
+  _unmap(path, layers)
+  os.replace(tmp_path, path)
+
+# the whole file at path + '.tmp', the chunk views it writes from are gone once it returns
+def _write_temp(path: str, layers: Dict[str, TileGrid], offgrid: List[Tuple[Tuple[float, float], int]]) -> str:
+  chunk_bytes = CHUNK_SIZE * CHUNK_SIZE * 2
+
+  # directory first so we know where the chunk data starts
+  directory_size = HEADER.size
+  layer_chunks = {}
+  for name, grid in layers.items():
+    layer_chunks[name] = [(key, arr, grid.counts[key]) for key, arr in grid.chunks.items() if grid.counts[key] > 0]
+    directory_size += LAYER_NAME.size + len(name.encode()) + CHUNK_COUNT.size + CHUNK_ENTRY.size * len(layer_chunks[name])
+
+  data_offset = _align(directory_size)
+  n_chunks = sum(len(chunks) for chunks in layer_chunks.values())
+  entity_offset = _align(data_offset + n_chunks * chunk_bytes)
+
+  directory, blobs, offset = [], [], data_offset
+  for name, chunks in layer_chunks.items():
+    directory += [LAYER_NAME.pack(len(name.encode())), name.encode(), CHUNK_COUNT.pack(len(chunks))]
+    for (c_x, c_y), arr, count in chunks:
+      directory.append(CHUNK_ENTRY.pack(c_x, c_y, count, offset))
+      # written straight out of the chunk, no bytes copy of the whole map
+      blobs.append(np.ascontiguousarray(arr, dtype='<i2'))
+      offset += chunk_bytes
+
+  entities = np.array([(pos[0], pos[1], tile_id) for pos, tile_id in offgrid], dtype=ENTITY_DTYPE)
+  header = HEADER.pack(MAP_MAGIC, MAP_VERSION, CHUNK_SIZE, len(layers), 0, len(entities), entity_offset)
+
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'wb') as f:
+    f.write(header)
+    f.write(b''.join(directory))
+    f.write(b'\0' * (data_offset - directory_size))
+    for blob in blobs: f.write(blob)
+    f.write(b'\0' * (entity_offset - offset))
+    f.write(entities.tobytes())
+  return tmp_path
+
+# grids from read_map still read their chunks out of a mapping of the file, which windows wont replace
+# while it's mapped: their chunks move to memory, the mapping goes with its last view
+def _unmap(path: str, layers: Dict[str, TileGrid]):
+  target = os.path.abspath(path)
+  for grid in layers.values():
+    for key, arr in list(grid.chunks.items()):
+      mapping = _mapping(arr)
+      if mapping is not None and mapping.filename == target: grid.chunks[key] = np.array(arr)
+
+# the np.memmap an array (or a view of a view) reads from, None for arrays with their own memory
+def _mapping(arr: np.ndarray) -> Optional[np.memmap]:
+  base = arr.base
+  while base is not None and not isinstance(base, np.memmap): base = getattr(base, 'base', None)
+  return base
+
+# header, chunk directory and entity table, the chunk data itself is not touched
+def read_map_index(path: str) -> MapIndex:
+  mm = np.memmap(path, dtype=np.uint8, mode='r')
+  if mm.size < HEADER.size: raise MapFormatError(f"{path}: truncated header")
+
+  magic, version, chunk_size, n_layers, _, n_entities, entity_offset = HEADER.unpack_from(mm, 0)
+  if magic != MAP_MAGIC: raise MapFormatError(f"{path}: not a .mrsp map")
+  if version > MAP_VERSION: raise MapFormatError(f"{path}: map version {version} is newer than {MAP_VERSION}")
+
+  layers, offset = {}, HEADER.size
+  for _ in range(n_layers):
+    (name_len,) = LAYER_NAME.unpack_from(mm, offset); offset += LAYER_NAME.size
+    name = bytes(mm[offset:offset + name_len]).decode(); offset += name_len
+    (n_chunks,) = CHUNK_COUNT.unpack_from(mm, offset); offset += CHUNK_COUNT.size
+
+    entries = layers[name] = {}
+    for _ in range(n_chunks):
+      c_x, c_y, count, data_offset = CHUNK_ENTRY.unpack_from(mm, offset)
+      entries[(c_x, c_y)] = (count, data_offset, offset)
+      offset += CHUNK_ENTRY.size
+
+  entities = np.array(np.ndarray((n_entities,), dtype=ENTITY_DTYPE, buffer=mm, offset=entity_offset))
+  return MapIndex(path, chunk_size, layers, entities)
+
+def read_map(path: str) -> MapData:
+  index = read_map_index(path)
+  mm = np.memmap(path, dtype=np.uint8, mode='c')
+  chunk_size = index.chunk_size
+
+  layers = {}
+  for name, entries in index.layers.items():
+    # views into the mapping, nothing is read from disk until the chunk is used
+    chunks = {key: np.ndarray((chunk_size, chunk_size), dtype='<i2', buffer=mm, offset=data_offset) for key, (_, data_offset, _) in entries.items()}
+    counts = {key: count for key, (count, _, _) in entries.items()}
+
+    if chunk_size == CHUNK_SIZE: layers[name] = TileGrid.from_chunks(chunks, counts)
+    else: layers[name] = _rechunk(chunks, chunk_size)
+
+  offgrid = [((x, y), tile_id) for x, y, tile_id in index.entities.tolist()]
+  return layers, offgrid
+
+# one chunk into a fresh (writable) array, f is opened 'rb' by the caller
+def read_chunk(f: BinaryIO, data_offset: int, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+  f.seek(data_offset)
+  arr = np.frombuffer(f.read(chunk_size * chunk_size * 2), dtype='<i2').reshape(chunk_size, chunk_size)
+  return arr.astype(np.int16)
+
+# overwrite a chunk that already has a slot in the file, the tile count in its directory entry too
+def write_chunk(path: str, entry: ChunkEntry, arr: np.ndarray, count: int):
+  _, data_offset, entry_offset = entry
+  with open(path, 'r+b') as f:
+    f.seek(data_offset)
+    f.write(np.ascontiguousarray(arr, dtype='<i2').tobytes())
+    # count sits after chunk_x / chunk_y in CHUNK_ENTRY
+    f.seek(entry_offset + 8)
+    f.write(struct.pack('<I', count))
+
+# maps written with a different chunk size get copied tile by tile
+def _rechunk(chunks: Dict[Tuple[int, int], np.ndarray], chunk_size: int) -> TileGrid:
+  grid = TileGrid()
+  for (c_x, c_y), arr in chunks.items():
+    ys, xs = np.nonzero(arr != EMPTY)
+    for x, y, tile_id in zip(xs.tolist(), ys.tolist(), arr[ys, xs].tolist()):
+      grid[(c_x * chunk_size + x, c_y * chunk_size + y)] = tile_id
+  return grid
+
+# fallback for the old map_data.json, keys are "(x, y)" strings
+def read_json_map(path: str) -> MapData:
+  with open(path, 'r') as f:
+    json_data = json.load(f)
+
+  layers, offgrid = {}, []
+  for map_name, map_data in json_data.items():
+    tiles = ((ast.literal_eval(key), value) for key, value in map_data.items())
+    if map_name == 'offgrid': offgrid = list(tiles)
+    else: layers[map_name] = TileGrid(tiles)
+  return layers, offgrid
+
+def read_any_map(path: str) -> MapData:
+  return read_json_map(path) if path.endswith('.json') else read_map(path)
+
+def convert_json_map(json_path: str, map_path: str):
+  write_map(map_path, *read_json_map(json_path))
+
+
+if __name__ == "__main__":
+  # python mapio.py ../assets/maps/map_data.json ../assets/maps/map_data.mrsp
+  if len(sys.argv) != 3: sys.exit("usage: mapio.py <map.json> <map.mrsp>")
+  convert_json_map(sys.argv[1], sys.argv[2])
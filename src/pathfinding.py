@@ -0,0 +1,135 @@
+from __future__ import annotations
+from typing import Optional, Tuple
+import math
+import numpy as np
+
+from grid import TileGrid, EMPTY
+from profiler import PROFILER
+
+'''
+FlowField: one BFS out from a target tile (the player) over the boundary grid, shared by everything chasing it
+
+- the boundary layer is read as a dense window of (2 * radius + 1)^2 tiles around the target (TileGrid.window)
+- the BFS is a numpy wavefront: each step ORs the frontier shifted one tile in the 4 directions, masks off
+  walls and visited tiles and stamps the step number, so a build is (path length) whole array ops instead
+  of a python loop per tile
+- every tile then points at its lowest distance neighbour (8 way, diagonals only when both sides are
+  open so nobody cuts a wall corner), direction(pos) is two array reads
+- retarget() is called every tick and only remembers what changed, the field is rebuilt on the first
+  lookup after the target changed tile or the boundary revision moved (editor edits, streamed chunks)
+  so nothing is paid while nobody is chasing
+'''
+
+# tiles around the target the field covers, the NEAR activity tier reaches ~16 tiles past the view
+FLOW_RADIUS = 32
+
+UNREACHABLE = np.iinfo(np.int32).max
+
+# (d_x, d_y), orthogonal first so ties go straight
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+# steps from start to every cell of the [y, x] open mask, UNREACHABLE for walls / cut off cells
+def bfs(passable: np.ndarray, start: Tuple[int, int]) -> np.ndarray:
+  dist = np.full(passable.shape, UNREACHABLE, dtype=np.int32)
+  dist[start] = 0
+  visited = np.zeros(passable.shape, dtype=bool)
+  visited[start] = True
+  frontier, grow = visited.copy(), np.empty_like(visited)
+
+  step = 0
+  while frontier.any():
+    step += 1
+    grow.fill(False)
+    grow[1:, :] |= frontier[:-1, :]
+    grow[:-1, :] |= frontier[1:, :]
+    grow[:, 1:] |= frontier[:, :-1]
+    grow[:, :-1] |= frontier[:, 1:]
+    grow &= passable
+    grow &= ~visited
+    dist[grow] = step
+    visited |= grow
+    frontier, grow = grow, frontier
+  return dist
+
+# unit (d_x, d_y) per cell towards its closest neighbour, (0, 0) where nothing is closer (the target, cut off cells)
+def descend(dist: np.ndarray, passable: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  h, w = dist.shape
+  dist_pad = np.full((h + 2, w + 2), UNREACHABLE, dtype=np.int32)
+  dist_pad[1:-1, 1:-1] = dist
+  open_pad = np.zeros((h + 2, w + 2), dtype=bool)
+  open_pad[1:-1, 1:-1] = passable
+
+  best = dist.copy()
+  dir_x = np.zeros((h, w), dtype=np.float32)
+  dir_y = np.zeros((h, w), dtype=np.float32)
+  for d_x, d_y in NEIGHBOURS:
+    neighbour = dist_pad[1 + d_y:1 + d_y + h, 1 + d_x:1 + d_x + w]
+    closer = neighbour < best
+    if d_x and d_y: closer &= open_pad[1 + d_y:1 + d_y + h, 1:1 + w] & open_pad[1:1 + h, 1 + d_x:1 + d_x + w]
+    np.copyto(best, neighbour, where=closer)
+    norm = math.hypot(d_x, d_y)
+    dir_x[closer], dir_y[closer] = d_x / norm, d_y / norm
+  return dir_x, dir_y
+
+class FlowField:
+  def __init__(self, tile_size: int, radius: int = FLOW_RADIUS):
+    self.tile_size = tile_size
+    self.radius = radius
+
+    self.target: Optional[Tuple[int, int]] = None
+    self.boundary: Optional[TileGrid] = None
+    self.revision = -1
+    self.stale = False
+
+    # tile coords of the window's [0, 0]
+    self.origin = (0, 0)
+    self.dist: Optional[np.ndarray] = None
+    self.dir_x: Optional[np.ndarray] = None
+    self.dir_y: Optional[np.ndarray] = None
+    self.builds = 0
+
+  # cheap, call every tick, revision = CollisionGeometry.revision
+  def retarget(self, target: Tuple[int, int], boundary: TileGrid, revision: int):
+    if target == self.target and revision == self.revision and boundary is self.boundary: return
+    self.target, self.boundary, self.revision = target, boundary, revision
+    self.stale = True
+
+  def build(self):
+    self.stale = False
+    if self.target is None or self.boundary is None: return
+    r = self.radius
+    x0, y0 = self.target[0] - r, self.target[1] - r
+    passable = self.boundary.window(x0, y0, x0 + 2 * r + 1, y0 + 2 * r + 1) == EMPTY
+    # standing in a wall (spawned / pushed into one) still seeds the search
+    passable[r, r] = True
+
+    self.origin = (x0, y0)
+    self.dist = bfs(passable, (r, r))
+    self.dir_x, self.dir_y = descend(self.dist, passable)
+    self.builds += 1
+    if PROFILER.enabled: PROFILER.count('flow_field_builds')
+
+  # window [y, x] index of a world px position, None outside the field
+  def cell(self, pos: Tuple[float, float]) -> Optional[Tuple[int, int]]:
+    if self.stale: self.build()
+    if self.dist is None: return None
+    col = int(pos[0] // self.tile_size) - self.origin[0]
+    row = int(pos[1] // self.tile_size) - self.origin[1]
+    size = 2 * self.radius + 1
+    if not (0 <= row < size and 0 <= col < size): return None
+    return row, col
+
+  # unit step towards the target, (0, 0) on the target tile, None outside the field or with no way through
+  def direction(self, pos: Tuple[float, float]) -> Optional[Tuple[float, float]]:
+    cell = self.cell(pos)
+    if cell is None: return None
+    d_x, d_y = self.dir_x.item(cell), self.dir_y.item(cell)
+    if d_x == 0 and d_y == 0 and self.dist.item(cell) != 0: return None
+    return d_x, d_y
+
+  # tiles to walk, None outside the field / unreachable
+  def distance(self, pos: Tuple[float, float]) -> Optional[int]:
+    cell = self.cell(pos)
+    if cell is None: return None
+    dist = self.dist.item(cell)
+    return None if dist == UNREACHABLE else dist
@@ -0,0 +1,255 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+import numpy as np
+import pygame
+
+from grid import TileGrid, EMPTY
+from collision import SUBSTEP_TILE_FRACTION, MAX_SUBSTEPS
+from entities import CollisionAxis
+from spatial import SpatialHash
+
+if TYPE_CHECKING:
+  from entities import DynamicEntity
+
+'''
+PhysicsWorld: opt-in batch integrator for DynamicEntities (BATCH_PHYSICS=1)
+
+- positions, velocities and rect sizes live in (N, 2) structure-of-arrays numpy buffers, the buffers are
+  the truth: DynamicEntity.velocity reads / writes vel, rects are only written, a body moved by hand
+  (teleports, editor) has to go through move_to
+- step() integrates every body in one pass and resolves x then y against the boundary grid in bulk,
+  sub-stepped like the TILE_COLLISION path so nothing moves more than half a tile between tile tests
+- bodies with anything nearby run CollisionProc against it after each axis, pushes are read back into pos.
+  with a broadphase the swept boxes of bodies sharing a cell are compared in numpy first and only bodies
+  touching someone gather their neighbours from the hash, the hash only hears about bodies that crossed
+  into another cell range
+- entities in a world skip their own update_physics
+- step(body_dt=...) only integrates the given bodies with their own dt (ActivityManager LOD), the rest stay put
+'''
+
+# SpatialHash.cell_range for (N, 2) top-left / bottom-right corners, (N, 4) x0 y0 x1 y1 rows
+def _cell_ranges(lo: np.ndarray, hi: np.ndarray, cell_size: int) -> np.ndarray:
+  # right / bottom are exclusive
+  return np.floor(np.hstack((lo, hi - 1)) / cell_size).astype(np.int64)
+
+# one int64 per cell so numpy can compare them, cells are within +-2**20 of the origin
+def _cell_keys(c_x: np.ndarray, c_y: np.ndarray) -> np.ndarray: return ((c_x + (1 << 20)) << 21) + (c_y + (1 << 20))
+
+# every (cell key, row) pair of (N, 4) cell ranges, rows span a cell or two at a time
+def _cell_pairs(cells: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+  lo, span = cells[:, :2], cells[:, 2:] - cells[:, :2]
+  keys, rows = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+  if len(cells):
+    for c_x in range(int(span[:, 0].max()) + 1):
+      for c_y in range(int(span[:, 1].max()) + 1):
+        inside = np.flatnonzero((span[:, 0] >= c_x) & (span[:, 1] >= c_y))
+        keys.append(_cell_keys(lo[inside, 0] + c_x, lo[inside, 1] + c_y))
+        rows.append(inside)
+  return np.concatenate(keys), np.concatenate(rows)
+
+class PhysicsWorld:
+  # broadphase: the SpatialHash the bodies are filed in, lets step() sort out who is alone in their cells in bulk
+  def __init__(self, tile_size: int, capacity: int = 64, broadphase: Optional[SpatialHash] = None):
+    self.tile_size = tile_size
+    self.broadphase = broadphase
+    # _statics cache, keyed on broadphase.revision
+    self.static_keys = np.zeros(0, dtype=np.int64)
+    self.static_boxes = np.zeros((0, 4), dtype=np.float64)
+    self.static_revision = -1
+    self.bodies: List[DynamicEntity] = []
+    self.index: Dict[DynamicEntity, int] = {}
+
+    self.pos = np.zeros((capacity, 2), dtype=np.float64)
+    self.vel = np.zeros((capacity, 2), dtype=np.float64)
+    self.size = np.zeros((capacity, 2), dtype=np.float64)
+
+  def __len__(self) -> int: return len(self.bodies)
+
+  def __contains__(self, entity) -> bool: return entity in self.index
+
+  def _grow(self):
+    capacity = self.pos.shape[0] * 2
+    for name in ("pos", "vel", "size"):
+      buf = np.zeros((capacity, 2), dtype=np.float64)
+      buf[:len(self.bodies)] = getattr(self, name)[:len(self.bodies)]
+      setattr(self, name, buf)
+
+  def add(self, entity: DynamicEntity):
+    if entity in self.index: return
+    if len(self.bodies) == self.pos.shape[0]: self._grow()
+
+    i = len(self.bodies)
+    self.bodies.append(entity)
+    self.index[entity] = i
+    self.pos[i] = entity.rect.x, entity.rect.y
+    self.size[i] = entity.rect.size
+    self.vel[i] = entity.velocity
+    entity.physics_world = self
+    self.static_revision = -1
+
+  # swap the last body into the hole so the buffers stay dense
+  def remove(self, entity: DynamicEntity):
+    i = self.index.pop(entity, None)
+    if i is None: return
+    velocity = self.vel[i].tolist()
+    last = len(self.bodies) - 1
+    if i != last:
+      moved = self.bodies[last]
+      self.bodies[i] = moved
+      self.index[moved] = i
+      for buf in (self.pos, self.vel, self.size): buf[i] = buf[last]
+    self.bodies.pop()
+    self.static_revision = -1
+    entity.physics_world = None
+    entity.velocity = velocity
+
+  # out: a Vector2 to fill instead of allocating one, DynamicEntity.velocity passes its own
+  def velocity(self, entity: DynamicEntity, out: Optional[pygame.Vector2] = None) -> pygame.Vector2:
+    value = self.vel[self.index[entity]].tolist()
+    if out is None: return pygame.Vector2(value)
+    out.update(value)
+    return out
+
+  def set_velocity(self, entity: DynamicEntity, value):
+    self.vel[self.index[entity]] = value
+
+  # place a body by hand, setting its rect directly would be overwritten by the next step
+  def move_to(self, entity: DynamicEntity, x: float, y: float):
+    entity.rect.x, entity.rect.y = x, y
+    self.pos[self.index[entity]] = x, y
+    if entity.broadphase is not None: entity.broadphase.move(entity)
+
+  def step(self, dt: float, boundary: TileGrid, body_dt: Optional[Dict[DynamicEntity, float]] = None):
+    n = len(self.bodies)
+    if n == 0: return
+    if body_dt is None:
+      bodies, sel = self.bodies, None
+      pos, vel, size = self.pos[:n], self.vel[:n], self.size[:n]
+      step = vel * dt
+    else:
+      bodies = [e for e in body_dt if e in self.index]
+      if not bodies: return
+      # gathered copies, pos is scattered back at the end
+      sel = np.fromiter((self.index[e] for e in bodies), dtype=np.int64, count=len(bodies))
+      pos, vel, size = self.pos[sel], self.vel[sel], self.size[sel]
+      step = vel * np.fromiter((body_dt[e] for e in bodies), dtype=np.float64, count=len(bodies))[:, None]
+    start = pos.copy()
+
+    # who has anything to bump into this step, gathered before moving over the whole displacement
+    # bodies standing still never push themselves out of anything (see CollisionProc.handle_collision)
+    if self.broadphase is not None: candidates = self._crowded(step, sel).tolist()
+    else: candidates = np.flatnonzero(step.any(axis=1)).tolist()
+    disp = step.tolist()
+    crowded = [(i, bodies[i]) for i in candidates if bodies[i].nearby_entities(*disp[i])]
+
+    # same sub-step rule as collision.substeps, for the fastest body
+    substeps = int(max(1, min(MAX_SUBSTEPS, np.ceil(np.abs(step).max() / (self.tile_size * SUBSTEP_TILE_FRACTION)))))
+    step /= substeps
+    for _ in range(substeps):
+      pos[:, 0] += step[:, 0]
+      self._resolve(pos, vel, size, boundary, 0)
+    # the entity pass needs everyones rects current between the axes, the y write-back covers both otherwise
+    if crowded:
+      for e, x in zip(bodies, pos[:, 0].tolist()): e.rect.x = x
+      for i, e in crowded:
+        e.phys.collide(e.neighbours, CollisionAxis.HORIZONTAL)
+        pos[i, 0] = e.rect.x
+
+    for _ in range(substeps):
+      pos[:, 1] += step[:, 1]
+      self._resolve(pos, vel, size, boundary, 1)
+    for e, xy in zip(bodies, pos.tolist()): e.rect.topleft = xy
+    for i, e in crowded:
+      e.phys.collide(e.neighbours, CollisionAxis.VERTICAL)
+      pos[i, 1] = e.rect.y
+
+    if sel is not None: self.pos[sel] = pos
+    # the hash only needs telling about bodies that crossed into another cell range
+    if self.broadphase is not None:
+      cs = self.broadphase.cell_size
+      moved = np.flatnonzero((_cell_ranges(start, start + size, cs) != _cell_ranges(pos, pos + size, cs)).any(axis=1)).tolist()
+    else: moved = range(len(bodies))
+    for i in moved:
+      e = bodies[i]
+      if e.broadphase is not None: e.broadphase.move(e)
+
+  # indices (into the stepped bodies) of moving bodies whose swept box touches another body's swept box or
+  # an entity's rect, only those gather their neighbours from the hash. boxes are only compared within a
+  # cell: every (box, cell) pair is keyed by its cell and sorted, runs of equal keys are the cell buckets.
+  # a body another body's push shoves into is left overlapping until the next step sees the two touching
+  def _crowded(self, step: np.ndarray, sel: Optional[np.ndarray]) -> np.ndarray:
+    n = len(self.bodies)
+    disp = step
+    if sel is not None:
+      disp = np.zeros((n, 2))
+      disp[sel] = step
+    pos = self.pos[:n]
+    boxes = np.hstack((pos + np.minimum(disp, 0), pos + self.size[:n] + np.maximum(disp, 0)))
+    keys, owners = _cell_pairs(_cell_ranges(boxes[:, :2], boxes[:, 2:], self.broadphase.cell_size))
+    static_keys, static_boxes = self._statics()
+
+    # statics are owner -1, they only ever crowd a body
+    keys = np.concatenate((keys, static_keys))
+    boxes = np.concatenate((boxes[owners], static_boxes))
+    owners = np.concatenate((owners, np.full(len(static_keys), -1, dtype=np.int64)))
+    order = np.argsort(keys, kind='stable')
+    keys, boxes, owners = keys[order], boxes[order], owners[order]
+
+    # pair every box with the ones `offset` places further down the same run until no run is that long
+    touching = np.zeros(len(keys), dtype=bool)
+    for offset in range(1, len(keys)):
+      a = np.flatnonzero(keys[offset:] == keys[:-offset])
+      if not len(a): break
+      b = a + offset
+      # inclusive, a rounding hair apart is close enough to gather
+      hit = (
+        (boxes[a, 0] <= boxes[b, 2]) & (boxes[b, 0] <= boxes[a, 2]) &
+        (boxes[a, 1] <= boxes[b, 3]) & (boxes[b, 1] <= boxes[a, 3])
+      )
+      touching[a[hit]] = True
+      touching[b[hit]] = True
+
+    crowded = np.zeros(n, dtype=bool)
+    crowded[owners[touching & (owners >= 0)]] = True
+    if sel is not None: crowded = crowded[sel]
+    return np.flatnonzero(crowded & step.any(axis=1))
+
+  # (cell keys, boxes) of everything in the hash that isnt one of our bodies, rebuilt when the hash or the
+  # world changes. assumes those dont move on their own (statics), under BATCH_PHYSICS every DynamicEntity is a body
+  def _statics(self) -> Tuple[np.ndarray, np.ndarray]:
+    if self.static_revision != self.broadphase.revision:
+      statics = [entity for entity in self.broadphase.entity_cells if entity not in self.index]
+      rects = np.array([entity.rect for entity in statics], dtype=np.float64).reshape(-1, 4)
+      boxes = np.hstack((rects[:, :2], rects[:, :2] + rects[:, 2:]))
+      cells = np.array([self.broadphase.entity_cells[entity] for entity in statics], dtype=np.int64).reshape(-1, 4)
+      keys, owners = _cell_pairs(cells)
+      self.static_keys, self.static_boxes = keys, boxes[owners]
+      self.static_revision = self.broadphase.revision
+    return self.static_keys, self.static_boxes
+
+  # push bodies back out of the leading edge tiles along one axis
+  def _resolve(self, pos: np.ndarray, vel: np.ndarray, size: np.ndarray, boundary: TileGrid, axis: int):
+    ts = self.tile_size
+    other = 1 - axis
+    v = vel[:, axis]
+    moving = v != 0
+    if not moving.any(): return
+
+    lo, hi = pos[:, axis], pos[:, axis] + size[:, axis]
+    # leading edge tile: the one our far side pokes into when moving forward, near side when moving back
+    lead = np.where(v > 0, np.ceil(hi / ts) - 1, np.floor(lo / ts)).astype(np.int64)
+
+    # tiles spanned on the other axis, FRect.colliderect ignores edges that only touch
+    span_lo = np.floor(pos[:, other] / ts).astype(np.int64)
+    span_hi = (np.ceil((pos[:, other] + size[:, other]) / ts) - 1).astype(np.int64)
+
+    hit = np.zeros(len(v), dtype=bool)
+    for k in range(int((span_hi - span_lo).max()) + 1):
+      cross = span_lo + k
+      valid = moving & (cross <= span_hi)
+      if not valid.any(): break
+      xs, ys = (lead, cross) if axis == 0 else (cross, lead)
+      hit |= valid & (boundary.lookup(xs, ys) != EMPTY)
+
+    if not hit.any(): return
+    pos[hit, axis] = np.where(v[hit] > 0, lead[hit] * ts - size[hit, axis], (lead[hit] + 1) * ts)
@@ -4,30 +4,32 @@ import pygame
 
 from entities import DynamicEntity, HitboxProc, Entity
 from animation import Animation
+from activity import ActivityPolicy
 from enum import Enum, auto
 import math
 
 class PlayerState(Enum): IDLE = auto(); MOVING = auto(); SPIN_STARTUP = auto(); SPINNING = auto(); SPIN_COOLDOWN = auto();
 
 class SpinningHBProc(HitboxProc): 
-  def __init__(self, owner: Entity, size: Tuple[int, int], lifetime: int): 
-    super().__init__(owner, size, lifetime)
-
-    self.anim_schedule: Dict[int, Tuple[float, float]] = { 
-      8 : (-5, 92),
-      9 : (89, 0),
-      10 : (-7, -78),
-      11 : (-57, 20),
-      12 : (-5, 92),
-      13 : (89, 0),
-      14 : (-7, -78),
-      15 : (-57, 20)
-    }
+  __slots__ = ()
+  anim_schedule: Dict[int, Tuple[float, float]] = { 
+    8 : (-5, 92),
+    9 : (89, 0),
+    10 : (-7, -78),
+    11 : (-57, 20),
+    12 : (-5, 92),
+    13 : (89, 0),
+    14 : (-7, -78),
+    15 : (-57, 20)
+  }
 
   @property
   def orbital_angle(self) -> float: return math.degrees(self.angle) % 360
 
 class Player(DynamicEntity): 
+  # the camera follows us, never throttle or sleep
+  activity = ActivityPolicy(always_active=True)
+
   def __init__(self, pos: Tuple[int, int], size: Tuple[int, int]):
     super().__init__(pos, size) 
     self.max_speed = 200
@@ -41,7 +43,6 @@ class Player(DynamicEntity):
     self.spin_frames = 50
     self.spin_cooldown_frames = 100
 
-    self.active_hb = []
     self.spin_hitbox = None
 
     self.current_frame = None
@@ -87,31 +88,30 @@ class Player(DynamicEntity):
     elif self.spin_startup_frames <= self.spin_frame_count < self.spin_startup_frames + self.spin_frames:
       self.set_state(PlayerState.SPINNING)
       if not self.spin_hitbox:
-        self.spin_hitbox = SpinningHBProc(self, (50, 50), self.spin_frames)
-        self.active_hb.append(self.spin_hitbox)
+        self.spin_hitbox = self.add_hitbox(SpinningHBProc, (50, 50), self.spin_frames)
     elif self.spin_startup_frames + self.spin_frames <= self.spin_frame_count < self.spin_startup_frames + self.spin_frames + self.spin_cooldown_frames:
       self.set_state(PlayerState.SPIN_COOLDOWN)
-      if self.spin_hitbox in self.active_hb:
-        self.active_hb.remove(self.spin_hitbox)
-        self.spin_hitbox = None
+      if self.spin_hitbox is not None: self.remove_hitbox(self.spin_hitbox)
     else:
       self.spin_frame_count = 0
       self.spinning = False
-      if self.spin_hitbox in self.active_hb:
-        self.active_hb.remove(self.spin_hitbox)
-        self.spin_hitbox = None
+      if self.spin_hitbox is not None: self.remove_hitbox(self.spin_hitbox)
 
     self.spin_frame_count += 1
   
   def create_hb(self): 
-    self.active_hb.append(HitboxProc(self, (0, 0), (25,25), 100))
+    return self.add_hitbox(HitboxProc, (25, 25), 100)
+
+  def remove_hitbox(self, hitbox: HitboxProc):
+    super().remove_hitbox(hitbox)
+    if hitbox is self.spin_hitbox: self.spin_hitbox = None
 
   def get_animation_direction(self, direction: pygame.Vector2) -> tuple:
     if abs(direction.x) > abs(direction.y): 
       return (1, 0) if direction.x > 0 else (-1, 0)
     else: return (0, 1) if direction.y > 0 else (0, -1)
   
-  def update(self, dt:float, boundary_dict):
+  def update(self, dt:float, collision):
 
     self.direction = self.get_input_direction()
     is_moving = self.direction.magnitude() > 0
@@ -139,7 +139,7 @@ class Player(DynamicEntity):
     # Update Animation
     self.anim.update()
     self.renderer.image, self.renderer.anim_offset = self.anim.get_img()
-    self.update_physics(dt, boundary_dict)
+    self.update_physics(dt, collision)
 
     # update hitboxes on animation schedule
     if self.current_frame != self.anim.current_frame:
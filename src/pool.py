@@ -0,0 +1,89 @@
+from __future__ import annotations
+from typing import Callable, Dict, Generic, List, Optional, Type, TypeVar
+from dataclasses import dataclass, asdict
+
+from profiler import PROFILER
+
+'''
+ObjectPool: recycles short lived objects (hitboxes, projectiles, effects, spawned mobs) so steady state
+combat allocates nothing and the GC has nothing new to chase
+
+- acquire(*args) hands back a released object re-initialised through its reset(*args), which takes the
+  same arguments as __init__, or constructs a new one when the pool is empty
+- release(obj) calls obj.on_release() when it has one (drop references to owners / targets) and keeps
+  it for the next acquire, up to max_free. only objects the pool handed out and that are still out count,
+  releasing twice or releasing something built with its constructor is a no-op
+- pool_for(cls) is the shared pool per class, pool_report() their stats
+'''
+
+T = TypeVar('T')
+
+@dataclass
+class PoolStats:
+  # objects constructed because nothing was free
+  created: int = 0
+  # acquires served from the free list
+  reused: int = 0
+  released: int = 0
+  # released while the free list was full, left to the GC
+  dropped: int = 0
+  active: int = 0
+  peak_active: int = 0
+
+class ObjectPool(Generic[T]):
+  def __init__(self, cls: Type[T], max_free: int = 256, factory: Optional[Callable[..., T]] = None):
+    self.cls = cls
+    self.factory = factory or cls
+    self.max_free = max_free
+    self.free: List[T] = []
+    # id -> object for everything handed out and not released yet, holding them keeps the ids unique
+    self.live: Dict[int, T] = {}
+    # looked up once per pool, acquire / release run per hitbox per swing
+    self.on_release = getattr(cls, 'on_release', None)
+    self.stats = PoolStats()
+
+  def __len__(self) -> int: return len(self.free)
+
+  def acquire(self, *args, **kwargs) -> T:
+    stats = self.stats
+    if self.free:
+      obj = self.free.pop()
+      obj.reset(*args, **kwargs)
+      stats.reused += 1
+    else:
+      obj = self.factory(*args, **kwargs)
+      stats.created += 1
+      if PROFILER.enabled: PROFILER.count('pool_allocations')
+    self.live[id(obj)] = obj
+    stats.active += 1
+    if stats.active > stats.peak_active: stats.peak_active = stats.active
+    return obj
+
+  def release(self, obj: T):
+    if self.live.pop(id(obj), None) is None: return
+    if self.on_release is not None: self.on_release(obj)
+    stats = self.stats
+    stats.released += 1
+    stats.active -= 1
+    if len(self.free) >= self.max_free:
+      stats.dropped += 1
+      return
+    self.free.append(obj)
+
+  # construct n objects up front (loading screens), they go straight to the free list
+  def prewarm(self, n: int, *args, **kwargs):
+    for _ in range(n): self.release(self.acquire(*args, **kwargs))
+
+  def report(self) -> dict: return {**asdict(self.stats), 'free': len(self.free)}
+
+POOLS: Dict[type, ObjectPool] = {}
+
+def pool_for(cls: type, max_free: int = 256) -> ObjectPool:
+  pool = POOLS.get(cls)
+  if pool is None:
+    # caught here rather than on the first reuse, a spawn or two into the game
+    if not callable(getattr(cls, 'reset', None)): raise TypeError(f"{cls.__name__} can't be pooled, it has no reset()")
+    pool = POOLS[cls] = ObjectPool(cls, max_free)
+  return pool
+
+def pool_report() -> Dict[str, dict]: return {cls.__name__: pool.report() for cls, pool in POOLS.items()}
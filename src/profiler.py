@@ -0,0 +1,144 @@
+from __future__ import annotations
+from typing import Dict, List, Optional
+from collections import deque
+from contextlib import contextmanager
+import csv
+import json
+import os
+import time
+import numpy as np
+
+'''
+FrameProfiler: per phase frame timings + per frame counters
+
+- Game.run calls begin_frame / lap(phase) / end_frame, lap times the span since the previous lap
+- anything can bump a counter with PROFILER.count(name, n) (tile blits, collision pairs, surfaces ...)
+- the last `window` frames are kept in ring buffers for p50/p95/p99, dump_json / dump_csv write them out
+- every hook returns straight away when disabled, hot loops should check PROFILER.enabled before
+  doing any work just to compute a count
+'''
+
+PROFILE_PERCENTILES = (50, 95, 99)
+
+class FrameProfiler:
+  def __init__(self, window: int = 600, enabled: bool = False):
+    self.window = window
+    self.enabled = enabled
+    # ring buffer of (frame seconds, {phase: seconds}, {counter: n})
+    self.frames: deque = deque(maxlen=window)
+
+    self.frame_start = 0.0
+    self.last_lap = 0.0
+    self.current_timings: Dict[str, float] = {}
+    self.current_counts: Dict[str, int] = {}
+
+  def toggle(self) -> bool:
+    self.enabled = not self.enabled
+    # wait for the next begin_frame before recording anything, laps / counts until then go to scratch
+    # dicts end_frame throws away (the old ones are still the last frame in the ring buffer)
+    self.frame_start = 0.0
+    self.last_lap = time.perf_counter()
+    self.current_timings, self.current_counts = {}, {}
+    return self.enabled
+
+  def begin_frame(self):
+    if not self.enabled: return
+    self.frame_start = self.last_lap = time.perf_counter()
+    self.current_timings, self.current_counts = {}, {}
+
+  # time since the previous lap (or frame start) goes to `phase`
+  def lap(self, phase: str):
+    if not self.enabled: return
+    now = time.perf_counter()
+    self.current_timings[phase] = self.current_timings.get(phase, 0.0) + now - self.last_lap
+    self.last_lap = now
+
+  def count(self, name: str, n: int = 1):
+    if not self.enabled: return
+    self.current_counts[name] = self.current_counts.get(name, 0) + n
+
+  def end_frame(self):
+    # toggled on halfway through a frame, nothing to record yet
+    if not self.enabled or self.frame_start == 0.0: return
+    self.frames.append((time.perf_counter() - self.frame_start, self.current_timings, self.current_counts))
+
+  def reset(self):
+    self.frames.clear()
+    self.frame_start = 0.0
+    self.current_timings, self.current_counts = {}, {}
+
+  def phase_names(self) -> List[str]: return list(dict.fromkeys(p for _, timings, _ in self.frames for p in timings))
+
+  def counter_names(self) -> List[str]: return list(dict.fromkeys(c for _, _, counts in self.frames for c in counts))
+
+  # seconds per recorded frame, frames that skipped the phase are left out
+  def phase_samples(self, phase: str) -> np.ndarray:
+    if phase == 'frame': return np.fromiter((f[0] for f in self.frames), dtype=np.float64)
+    return np.fromiter((f[1][phase] for f in self.frames if phase in f[1]), dtype=np.float64)
+
+  # {phase: {"p50": ms, "p95": ms, "p99": ms, "mean": ms}}, phase 'frame' is the whole frame
+  def summary(self) -> Dict[str, Dict[str, float]]:
+    out = {}
+    for phase in ['frame', *self.phase_names()]:
+      ms = self.phase_samples(phase) * 1000
+      if ms.size == 0: continue
+      out[phase] = {f"p{p}": float(v) for p, v in zip(PROFILE_PERCENTILES, np.percentile(ms, PROFILE_PERCENTILES))}
+      out[phase]['mean'] = float(ms.mean())
+    return out
+
+  # mean per frame, frames that never bumped a counter count as 0
+  def counter_summary(self) -> Dict[str, float]:
+    if not self.frames: return {}
+    return {name: sum(f[2].get(name, 0) for f in self.frames) / len(self.frames) for name in self.counter_names()}
+
+  def dump_json(self, path: str):
+    with open(path, 'w') as f:
+      json.dump({'frames': len(self.frames), 'phases_ms': self.summary(), 'counters_mean': self.counter_summary()}, f, indent=2)
+
+  # one row per recorded frame, ms for phases, raw values for counters
+  def dump_csv(self, path: str):
+    phases, counters = self.phase_names(), self.counter_names()
+    with open(path, 'w', newline='') as f:
+      writer = csv.writer(f)
+      writer.writerow(['frame_ms', *(p + '_ms' for p in phases), *counters])
+      for frame_seconds, timings, counts in self.frames:
+        writer.writerow([frame_seconds * 1000,
+                         *(timings[p] * 1000 if p in timings else '' for p in phases),
+                         *(counts.get(c, 0) for c in counters)])
+
+  def dump(self, directory: str = '.', stem: Optional[str] = None) -> List[str]:
+    stem = stem or time.strftime("profile_%Y%m%d_%H%M%S")
+    paths = [os.path.join(directory, stem + '.json'), os.path.join(directory, stem + '.csv')]
+    self.dump_json(paths[0]); self.dump_csv(paths[1])
+    return paths
+
+PROFILER = FrameProfiler(enabled=bool(int(os.getenv("PROFILE", 0))))
+
+
+# wall time per startup phase + time to the first presented frame, printed with STARTUP_REPORT=1
+class StartupTimer:
+  def __init__(self, enabled: bool = False):
+    self.enabled = enabled
+    self.start = time.perf_counter()
+    self.phases: Dict[str, float] = {}
+    self.marks: Dict[str, float] = {}
+
+  @contextmanager
+  def phase(self, name: str):
+    t = time.perf_counter()
+    try: yield
+    finally: self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t
+
+  # seconds since the timer started (process import), first one wins
+  def mark(self, name: str):
+    if name not in self.marks: self.marks[name] = time.perf_counter() - self.start
+
+  def report(self, assets: Optional[dict] = None) -> List[str]:
+    lines = [f"{name}: {seconds * 1000:.1f} ms" for name, seconds in self.phases.items()]
+    lines += [f"{name}: {seconds * 1000:.1f} ms after start" for name, seconds in self.marks.items()]
+    if assets:
+      lines.append(f"assets: {assets['entries']} images, decode {assets['decode_seconds'] * 1000:.1f} ms (workers), "
+                   f"convert {assets['convert_seconds'] * 1000:.1f} ms, waited {assets['wait_seconds'] * 1000:.1f} ms")
+    return lines
+
+STARTUP = StartupTimer(enabled=bool(int(os.getenv("STARTUP_REPORT", 0))))
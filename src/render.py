@@ -0,0 +1,291 @@
+from __future__ import annotations
+from typing import Dict, List, Tuple, Optional, Hashable
+from operator import attrgetter
+import math
+import weakref
+import pygame
+
+from spatial import SpatialHash
+from profiler import PROFILER
+from utils import NATIVE_SIZE, RENDER_SCALE
+
+'''
+DirtyRectRenderer: DIRTY_RECTS=1 render mode
+
+- the tilemap is drawn once into a cached background surface
+- every frame we only compare what each sprite / overlay would draw against last frame,
+  restore the background under the areas that changed, redraw what overlaps them (clipped)
+  and hand just those rects to display.update
+- camera scrolls up to scroll_threshold px shift the cached background and patch the exposed strips,
+  bigger jumps or tile edits / state changes rebuild it, either way that frame is presented in full
+'''
+
+# camera moves (px) we patch the background for instead of rebuilding it
+DIRTY_SCROLL_THRESHOLD = 64
+
+Overlay = Tuple[pygame.Surface, Tuple[float, float]]
+
+# surfaces that get redrawn in place (the profiler graph) bump a version here, the dirty renderer only
+# sees the same surface at the same rect otherwise and would never put the new pixels on screen
+SURFACE_VERSIONS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+def mark_redrawn(surface: pygame.Surface): SURFACE_VERSIONS[surface] = SURFACE_VERSIONS.get(surface, 0) + 1
+
+# RenderQueue layers, flushed low to high
+LAYER_TILES = 0
+LAYER_ENTITIES = 1
+LAYER_UI = 2
+
+'''
+RenderQueue: tiles, entities, hitboxes and HUD append (surface, position) during the frame,
+flush() hands each layer to Surface.fblits in one call instead of a Python level blit per item
+
+- a layer is drawn in push order, unless items were pushed with a y, then it is stably sorted by y first,
+  items pushed without one stick to the item before them (an entity's hitboxes follow its sprite)
+'''
+
+class RenderQueue:
+  def __init__(self, target: pygame.Surface):
+    self.target = target
+    self.items: Dict[int, List[Overlay]] = {}
+    self.ys: Dict[int, List[float]] = {}
+
+  def push(self, surface: pygame.Surface, pos: Tuple[float, float], layer: int = LAYER_ENTITIES, y: Optional[float] = None):
+    items = self.items.setdefault(layer, [])
+    items.append((surface, pos))
+    ys = self.ys.get(layer)
+    if y is None and ys is None: return
+    # first y in the layer, whatever was pushed before it without one is drawn first (underneath), as pushed
+    if ys is None: ys = self.ys[layer] = [-math.inf] * (len(items) - 1)
+    ys.append(y if y is not None else (ys[-1] if ys else -math.inf))
+
+  def extend(self, items: List[Overlay], layer: int):
+    self.items.setdefault(layer, []).extend(items)
+    ys = self.ys.get(layer)
+    if ys is not None: ys.extend([ys[-1] if ys else -math.inf] * len(items))
+
+  def __len__(self) -> int: return sum(len(items) for items in self.items.values())
+
+  def flush(self):
+    blits = 0
+    for layer in sorted(self.items):
+      items = self.items[layer]
+      ys = self.ys.get(layer)
+      if ys: items = [items[i] for i in sorted(range(len(items)), key=ys.__getitem__)]
+      self.target.fblits(items)
+      blits += len(items)
+    if PROFILER.enabled: PROFILER.count('queued_blits', blits)
+    self.items.clear()
+    self.ys.clear()
+
+'''
+LowResTarget: LOW_RES=1, the world is drawn at the art's own resolution into `surface` (NATIVE_SIZE)
+and present() scales it to the window in one transform.scale call, straight into the window pixels
+
+- the scale is an integer (nearest neighbour, every art pixel stays a crisp scale x scale block),
+  the largest one that fits unless asked for, whatever is left of the window is letterboxed
+- HUD text is drawn on the window after present(), at window resolution
+'''
+
+class LowResTarget:
+  def __init__(self, window: pygame.Surface, size: Tuple[int, int] = NATIVE_SIZE, scale: int = 0):
+    self.window = window
+    self.surface = pygame.Surface(size).convert()
+    self.scale = scale or max(1, min(window.get_width() // size[0], window.get_height() // size[1]))
+    scaled = (size[0] * self.scale, size[1] * self.scale)
+    self.dest = pygame.Rect((window.get_width() - scaled[0]) // 2, (window.get_height() - scaled[1]) // 2, *scaled)
+    self.dest = self.dest.clip(window.get_rect())
+    self.letterboxed = self.dest != window.get_rect()
+    # scale into the window through a subsurface, no intermediate full size surface
+    self.scaled = window.subsurface(self.dest) if self.dest.size == scaled else None
+
+  # view size in world px, what the camera covers
+  @property
+  def view_size(self) -> Tuple[int, int]:
+    return (round(self.surface.get_width() / RENDER_SCALE), round(self.surface.get_height() / RENDER_SCALE))
+
+  def present(self):
+    if self.letterboxed: self.window.fill((0, 0, 0))
+    # window smaller than one native frame: crop the bottom right off
+    if self.scaled is None: self.window.blit(self.surface, self.dest.topleft)
+    else: pygame.transform.scale(self.surface, self.dest.size, self.scaled)
+
+  # window px -> px from the view's top left, in world units
+  def window_to_view(self, pos: Tuple[int, int]) -> Tuple[float, float]:
+    return ((pos[0] - self.dest.x) / self.scale / RENDER_SCALE, (pos[1] - self.dest.y) / self.scale / RENDER_SCALE)
+
+class DirtyRectRenderer:
+  def __init__(self, screen: pygame.Surface, scroll_threshold: int = DIRTY_SCROLL_THRESHOLD, clear_color=(0, 0, 0)):
+    self.screen = screen
+    self.scroll_threshold = scroll_threshold
+    self.clear_color = clear_color
+    self.background = pygame.Surface(screen.get_size())
+
+    self.bg_key: Optional[Hashable] = None
+    self.bg_scroll: Optional[Tuple[int, int]] = None
+    # what was drawn last frame, sprite / overlay slot -> (screen rect, draw signature)
+    self.drawn: Dict[object, Tuple[pygame.Rect, Hashable]] = {}
+
+    self.full_redraws = 0
+    self.dirty_area = 0
+
+  def invalidate(self): self.bg_key = None
+
+  # sprites must already be in draw order, bg_key is anything that changes what the tilemap draws
+  def render(self, tilemap, sprites: List, overlays: List[Overlay], camera_scroll: pygame.Vector2, alpha: float, bg_key: Hashable):
+    # integer scroll so the cached background, the patches and the sprites all line up
+    scroll = pygame.Vector2(math.floor(camera_scroll.x), math.floor(camera_scroll.y))
+    int_scroll = (int(scroll.x), int(scroll.y))
+
+    if self.bg_key != bg_key or self.bg_scroll is None:
+      self.rebuild_background(tilemap, scroll)
+      self.present_full(sprites, overlays, scroll, alpha)
+    elif int_scroll != self.bg_scroll:
+      d_x, d_y = int_scroll[0] - self.bg_scroll[0], int_scroll[1] - self.bg_scroll[1]
+      if max(abs(d_x), abs(d_y)) > self.scroll_threshold: self.rebuild_background(tilemap, scroll)
+      else: self.shift_background(tilemap, scroll, d_x, d_y)
+      self.present_full(sprites, overlays, scroll, alpha)
+    else:
+      self.present_dirty(sprites, overlays, scroll, alpha)
+
+    self.bg_key, self.bg_scroll = bg_key, int_scroll
+
+  def rebuild_background(self, tilemap, scroll: pygame.Vector2):
+    self.background.fill(self.clear_color)
+    tilemap.render([scroll.x, scroll.y], *self.screen.get_size(), surface=self.background)
+
+  # move the cached background with the camera and only draw the strips that scrolled into view
+  def shift_background(self, tilemap, scroll: pygame.Vector2, d_x: int, d_y: int):
+    width, height = self.screen.get_size()
+    self.background.scroll(-d_x, -d_y)
+
+    strips = []
+    if d_x > 0: strips.append(pygame.Rect(width - d_x, 0, d_x, height))
+    elif d_x < 0: strips.append(pygame.Rect(0, 0, -d_x, height))
+    if d_y > 0: strips.append(pygame.Rect(0, height - d_y, width, d_y))
+    elif d_y < 0: strips.append(pygame.Rect(0, 0, width, -d_y))
+
+    for strip in strips:
+      self.background.set_clip(strip)
+      self.background.fill(self.clear_color)
+      tilemap.render([scroll.x, scroll.y], width, height, surface=self.background)
+    self.background.set_clip(None)
+
+  def present_full(self, sprites: List, overlays: List[Overlay], scroll: pygame.Vector2, alpha: float):
+    self.screen.blit(self.background, (0, 0))
+    self.drawn = {}
+    for sprite in sprites:
+      self.drawn[sprite] = self.sprite_state(sprite, scroll, alpha)
+      sprite.render(scroll, alpha)
+    for i, (surface, pos) in enumerate(overlays):
+      self.drawn[('overlay', i)] = self.overlay_state(surface, pos)
+      self.screen.blit(surface, pos)
+
+    self.full_redraws += 1
+    self.dirty_area = self.screen.get_width() * self.screen.get_height()
+    pygame.display.update()
+
+  def present_dirty(self, sprites: List, overlays: List[Overlay], scroll: pygame.Vector2, alpha: float):
+    drawn, dirty = {}, []
+    states = [(sprite, self.sprite_state(sprite, scroll, alpha)) for sprite in sprites]
+    states += [(('overlay', i), self.overlay_state(surface, pos)) for i, (surface, pos) in enumerate(overlays)]
+
+    for key, state in states:
+      drawn[key] = state
+      previous = self.drawn.get(key)
+      if previous == state: continue
+      if previous is not None: dirty.append(previous[0])
+      dirty.append(state[0])
+
+    # sprites / overlays that went away leave a hole to fill
+    for key, (rect, _) in self.drawn.items():
+      if key not in drawn: dirty.append(rect)
+    self.drawn = drawn
+
+    dirty = self.merge_rects([r.clip(self.screen.get_rect()) for r in dirty])
+    self.dirty_area = sum(r.width * r.height for r in dirty)
+    if not dirty: return
+
+    for rect in dirty:
+      self.screen.set_clip(rect)
+      self.screen.blit(self.background, rect.topleft, rect)
+      for sprite, (sprite_rect, _) in states[:len(sprites)]:
+        if sprite_rect.colliderect(rect): sprite.render(scroll, alpha)
+      for (surface, pos), (_, (overlay_rect, _)) in zip(overlays, states[len(sprites):]):
+        if overlay_rect.colliderect(rect): self.screen.blit(surface, pos)
+    self.screen.set_clip(None)
+
+    pygame.display.update(dirty)
+
+  @staticmethod
+  def sprite_state(sprite, scroll: pygame.Vector2, alpha: float) -> Tuple[pygame.Rect, Hashable]:
+    rect = sprite.screen_rect(scroll, alpha)
+    hitboxes = tuple((hb.x, hb.y) for hb in getattr(sprite, 'active_hb', ()))
+    # keep the image itself (not its id) so a freed surface cant alias a new one
+    return rect, (sprite.renderer.image, tuple(rect), hitboxes)
+
+  @staticmethod
+  def overlay_state(surface: pygame.Surface, pos: Tuple[float, float]) -> Tuple[pygame.Rect, Hashable]:
+    rect = pygame.Rect(math.floor(pos[0]), math.floor(pos[1]), surface.get_width() + 1, surface.get_height() + 1)
+    return rect, (surface, tuple(rect), SURFACE_VERSIONS.get(surface, 0))
+
+  # fold overlapping rects together so overlapping sprites are only redrawn once
+  @staticmethod
+  def merge_rects(rects: List[pygame.Rect]) -> List[pygame.Rect]:
+    merged: List[pygame.Rect] = []
+    for rect in rects:
+      if rect.width <= 0 or rect.height <= 0: continue
+      rect = rect.copy()
+      i = rect.collidelist(merged)
+      while i != -1:
+        rect.union_ip(merged.pop(i))
+        i = rect.collidelist(merged)
+      merged.append(rect)
+    return merged
+
+
+# how far past the camera a sprite's rect can be and still draw on screen (anim frames / orbiting hitboxes overhang the rect)
+RENDER_CULL_MARGIN = 192
+
+Y_SORT_KEY = attrgetter('rect.bottom')
+
+'''
+EntityRenderPass: which sprites to draw this frame, in y order
+
+- entities come out of the Game's SpatialHash (kept up to date by physics), tilemap EntityRend props
+  get their own static index, only the cells under the camera rect are looked at
+- the y-ordered list is kept between frames, sprites that left the view are dropped, new ones appended,
+  then it is re-sorted in place: Timsort on an almost sorted list is ~one comparison per sprite
+'''
+
+class EntityRenderPass:
+  def __init__(self, entity_index: SpatialHash, margin: int = RENDER_CULL_MARGIN, prop_cell_size: int = 256):
+    self.entity_index = entity_index
+    self.margin = margin
+    self.prop_index = SpatialHash(prop_cell_size, bind=False)
+    self.props: Optional[List] = None
+    self.props_indexed = 0
+    self.ordered: List = []
+
+  # props only ever get appended by the editor, index the new tail (or everything for a new tilemap)
+  def sync_props(self, props: List):
+    if props is not self.props or len(props) < self.props_indexed:
+      self.prop_index = SpatialHash(self.prop_index.cell_size, bind=False)
+      self.props, self.props_indexed = props, 0
+    for prop in props[self.props_indexed:]: self.prop_index.insert(prop)
+    self.props_indexed = len(props)
+
+  def visible(self, camera_scroll: pygame.Vector2, width: int, height: int, props: List) -> List:
+    self.sync_props(props)
+    m = self.margin
+    view = pygame.FRect(camera_scroll.x - m, camera_scroll.y - m, width + 2 * m, height + 2 * m)
+    in_view = self.entity_index.query(view)
+    in_view |= self.prop_index.query(view)
+
+    ordered = [sprite for sprite in self.ordered if sprite in in_view]
+    if len(ordered) != len(in_view):
+      kept = set(ordered)
+      ordered += [sprite for sprite in in_view if sprite not in kept]
+    ordered.sort(key=Y_SORT_KEY)
+    self.ordered = ordered
+    return ordered
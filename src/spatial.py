@@ -0,0 +1,95 @@
+from __future__ import annotations
+from typing import Dict, Set, Tuple
+import pygame
+
+'''
+SpatialHash: uniform grid broadphase for entity vs entity queries
+
+- every entity is filed under each cell its rect overlaps
+- move() only touches the cell dicts when the rect crosses into a different cell range
+- query(rect) returns the entities in the cells the rect overlaps, callers still do the colliderect
+'''
+
+CellRange = Tuple[int, int, int, int]
+
+class SpatialHash:
+  # bind: entities get a back reference (entity.broadphase) so they can query / move themselves,
+  # indexes that arent for collision (render culling) leave it alone
+  def __init__(self, cell_size: int, bind: bool = True):
+    self.cell_size = cell_size
+    self.bind = bind
+    self.cells: Dict[Tuple[int, int], Set] = {}
+    self.entity_cells: Dict[object, CellRange] = {}
+    # bumped when an entity comes or goes (not on move), caches of who is filed where key on it
+    self.revision = 0
+
+  def cell_range(self, rect: pygame.FRect) -> CellRange:
+    cs = self.cell_size
+    # right / bottom are exclusive, a rect flush with a cell edge doesnt spill into the next cell
+    return (int(rect.left // cs), int(rect.top // cs), int((rect.right - 1) // cs), int((rect.bottom - 1) // cs))
+
+  def _add(self, entity, cells: CellRange):
+    for c_x in range(cells[0], cells[2] + 1):
+      for c_y in range(cells[1], cells[3] + 1):
+        self.cells.setdefault((c_x, c_y), set()).add(entity)
+
+  def _discard(self, entity, cells: CellRange):
+    for c_x in range(cells[0], cells[2] + 1):
+      for c_y in range(cells[1], cells[3] + 1):
+        bucket = self.cells.get((c_x, c_y))
+        if bucket is None: continue
+        bucket.discard(entity)
+        if not bucket: del self.cells[(c_x, c_y)]
+
+  def insert(self, entity):
+    if entity in self.entity_cells: return self.move(entity)
+    cells = self.cell_range(entity.rect)
+    self.entity_cells[entity] = cells
+    self._add(entity, cells)
+    self.revision += 1
+    if self.bind: entity.broadphase = self
+
+  def remove(self, entity):
+    cells = self.entity_cells.pop(entity, None)
+    if cells is None: return
+    self._discard(entity, cells)
+    self.revision += 1
+    if self.bind: entity.broadphase = None
+
+  def move(self, entity):
+    old = self.entity_cells.get(entity)
+    if old is None: return
+    new = self.cell_range(entity.rect)
+    if new == old: return
+    self._discard(entity, old)
+    self._add(entity, new)
+    self.entity_cells[entity] = new
+
+  def query(self, rect: pygame.FRect) -> Set:
+    x0, y0, x1, y1 = self.cell_range(rect)
+    if x0 == x1 and y0 == y1: return set(self.cells.get((x0, y0), ()))
+
+    found = set()
+    for c_x in range(x0, x1 + 1):
+      for c_y in range(y0, y1 + 1):
+        bucket = self.cells.get((c_x, c_y))
+        if bucket: found |= bucket
+    return found
+
+  # query() into a list the caller keeps around, no set per call, `exclude` (whoever is asking) is left out
+  def gather(self, rect: pygame.FRect, out: list, exclude=None) -> list:
+    out.clear()
+    x0, y0, x1, y1 = self.cell_range(rect)
+    single = x0 == x1 and y0 == y1
+    for c_x in range(x0, x1 + 1):
+      for c_y in range(y0, y1 + 1):
+        bucket = self.cells.get((c_x, c_y))
+        if not bucket: continue
+        for entity in bucket:
+          # entities spanning several cells show up in each of them
+          if entity is not exclude and (single or entity not in out): out.append(entity)
+    return out
+
+  def __contains__(self, entity) -> bool: return entity in self.entity_cells
+
+  def __len__(self) -> int: return len(self.entity_cells)
@@ -0,0 +1,181 @@
+from __future__ import annotations
+from typing import Dict, List, Optional, Set, Tuple
+from dataclasses import dataclass, field
+import queue
+import threading
+import numpy as np
+
+from grid import TileGrid, CHUNK_SIZE, EMPTY
+from mapio import MapIndex, MapFormatError, read_map, read_map_index, read_chunk, write_chunk, write_map
+from collision import greedy_rects
+
+'''
+ChunkStreamer: STREAM_WORLD=1, keeps only the storage chunks around the camera resident
+
+- startup only reads the .mrsp directory + entity table (read_map_index), no tiles or entities are built
+- update(center) asks the worker thread for chunks within `radius` (Chebyshev, in storage chunks) of the camera,
+  the worker reads + decodes them and greedy meshes the boundary, results come back through a queue
+  and poll() hands at most `max_installs` of them per frame to the main thread (TileMap.stream_update)
+- chunks further than radius + 1 are evicted, edited chunks are written back on the way out:
+  chunks that have a slot in the file are patched in place, new chunks / offgrid entities wait in
+  memory until save(), which streams the whole file through a rewrite
+'''
+
+Key = Tuple[int, int]
+# (x, y, w, h) in tiles relative to the chunk origin
+RectList = List[Tuple[int, int, int, int]]
+
+@dataclass
+class LoadedChunk:
+  key: Key
+  # layer -> (tiles, tile count), only layers that have the chunk
+  layers: Dict[str, Tuple[np.ndarray, int]] = field(default_factory=dict)
+  # merged boundary rects, None when the boundary has to be re-meshed on the main thread
+  boundary_rects: Optional[RectList] = None
+  entities: List[Tuple[Tuple[float, float], int]] = field(default_factory=list)
+
+def chunk_key(x: float, y: float, tile_size: int) -> Key:
+  return (int(x // (tile_size * CHUNK_SIZE)), int(y // (tile_size * CHUNK_SIZE)))
+
+class ChunkStreamer:
+  def __init__(self, path: str, tile_size: int, radius: int = 2, max_installs: int = 4):
+    self.path = path
+    self.tile_size = tile_size
+    self.radius = radius
+    self.max_installs = max_installs
+
+    # bumped whenever the file is replaced, requests / results from before are stale
+    self.generation = -1
+    self.load_index()
+    self.center: Optional[Key] = None
+    self.resident: Set[Key] = set()
+    self.requested: Set[Key] = set()
+    self.dirty: Set[Tuple[str, Key]] = set()
+    # evicted edits that have no slot in the file yet, written by save()
+    self.write_back: Dict[Tuple[str, Key], Tuple[np.ndarray, int]] = {}
+    self.entity_overrides: Dict[Key, List[Tuple[Tuple[float, float], int]]] = {}
+
+    # held by the worker while it has the file open and by save() around replacing it,
+    # windows wont replace a file someone has open
+    self.file_lock = threading.Lock()
+    self.requests: queue.Queue = queue.Queue()
+    self.results: queue.Queue = queue.Queue()
+    self.worker = threading.Thread(target=self.work, name="chunk-streamer", daemon=True)
+    self.worker.start()
+
+  def load_index(self):
+    index = read_map_index(self.path)
+    if index.chunk_size != CHUNK_SIZE: raise MapFormatError(f"{self.path}: streaming needs chunk size {CHUNK_SIZE}, resave the map")
+    self.index: MapIndex = index
+    self.generation += 1
+
+    # entity table grouped by chunk, rows are (x, y, tile_id)
+    self.entities_by_chunk: Dict[Key, List[Tuple[Tuple[float, float], int]]] = {}
+    for x, y, tile_id in index.entities.tolist():
+      self.entities_by_chunk.setdefault(chunk_key(x, y, self.tile_size), []).append(((x, y), tile_id))
+
+  @property
+  def layer_names(self) -> List[str]: return list(self.index.layers)
+
+  def wanted(self, center: Key, radius: int) -> Set[Key]:
+    return {(center[0] + d_x, center[1] + d_y) for d_x in range(-radius, radius + 1) for d_y in range(-radius, radius + 1)}
+
+  # ask for chunks around the camera, returns the resident chunks that fell out of range
+  def update(self, center_px: Tuple[float, float]) -> List[Key]:
+    center = chunk_key(*center_px, self.tile_size)
+    if center == self.center: return []
+    self.center = center
+
+    for key in self.wanted(center, self.radius) - self.resident - self.requested:
+      self.requested.add(key)
+      self.requests.put((self.generation, key))
+
+    keep = self.wanted(center, self.radius + 1)
+    self.requested &= keep
+    # edits can land in chunks that were never streamed in, those go out the same way
+    return [key for key in self.resident | {key for _, key in self.dirty} if key not in keep]
+
+  # finished loads, oldest first, chunks that went out of range while loading are dropped
+  def poll(self, wait: bool = False) -> List[LoadedChunk]:
+    loaded = []
+    while len(loaded) < self.max_installs or wait:
+      if wait and not self.requested: break
+      try: generation, chunk = self.results.get(block=wait, timeout=1.0 if wait else None)
+      except queue.Empty: break
+      if generation != self.generation or chunk.key not in self.requested: continue
+      self.requested.discard(chunk.key)
+      self.restore_edits(chunk)
+      self.resident.add(chunk.key)
+      loaded.append(chunk)
+    return loaded
+
+  # edits that were evicted before they could be written in place win over the file
+  def restore_edits(self, chunk: LoadedChunk):
+    for layer, key in [k for k in self.write_back if k[1] == chunk.key]:
+      chunk.layers[layer] = self.write_back.pop((layer, key))
+      self.dirty.add((layer, chunk.key))
+      if layer == 'boundary': chunk.boundary_rects = None
+    if chunk.key in self.entity_overrides:
+      chunk.entities = self.entity_overrides.pop(chunk.key)
+      self.dirty.add(('offgrid', chunk.key))
+
+  def mark_dirty(self, layer: str, key: Key): self.dirty.add((layer, key))
+
+  # layers: the chunk's current arrays (None when the layer has no tiles there), entities: its offgrid records
+  def evict(self, key: Key, layers: Dict[str, Tuple[Optional[np.ndarray], int]], entities: List[Tuple[Tuple[float, float], int]]):
+    self.resident.discard(key)
+    for layer, (arr, count) in layers.items():
+      if (layer, key) not in self.dirty: continue
+      self.dirty.discard((layer, key))
+      entry = self.index.layers.get(layer, {}).get(key)
+      if arr is None: arr, count = np.full((CHUNK_SIZE, CHUNK_SIZE), EMPTY, dtype=np.int16), 0
+      if entry is not None: write_chunk(self.path, entry, arr, count)
+      else: self.write_back[(layer, key)] = (arr.copy(), count)
+    if ('offgrid', key) in self.dirty:
+      self.dirty.discard(('offgrid', key))
+      self.entity_overrides[key] = entities
+
+  # full rewrite: untouched chunks stream straight from the old file (memory mapped, write_map moves them
+  # to memory before the swap), resident + pending edits on top
+  def save(self, resident: Dict[str, TileGrid], resident_entities: List[Tuple[Tuple[float, float], int]]):
+    layers, offgrid = read_map(self.path)
+    for name in resident: layers.setdefault(name, TileGrid())
+
+    for (layer, key), (arr, count) in self.write_back.items(): layers.setdefault(layer, TileGrid()).set_chunk(key, arr, count)
+    for layer, grid in resident.items():
+      for key in self.resident | set(grid.chunks): layers[layer].set_chunk(key, grid.chunk(*key), grid.counts.get(key, 0))
+
+    replaced = self.resident | set(self.entity_overrides)
+    offgrid = [(pos, tile_id) for pos, tile_id in offgrid if chunk_key(*pos, self.tile_size) not in replaced]
+    for records in self.entity_overrides.values(): offgrid += records
+    offgrid += resident_entities
+
+    with self.file_lock: write_map(self.path, layers, offgrid)
+    self.write_back.clear()
+    self.entity_overrides.clear()
+    self.dirty.clear()
+    self.load_index()
+    # in flight loads read the old file, ask again
+    for key in self.requested: self.requests.put((self.generation, key))
+
+  def close(self): self.requests.put(None)
+
+  # worker thread: read, decode, mesh
+  def work(self):
+    while True:
+      request = self.requests.get()
+      if request is None: break
+      req_generation, key = request
+      if req_generation != self.generation: continue
+
+      chunk = LoadedChunk(key)
+      # open per request, an idle worker holding the file would keep save() from replacing it
+      with self.file_lock, open(self.path, 'rb') as f:
+        for layer, entries in self.index.layers.items():
+          entry = entries.get(key)
+          if entry is None or entry[0] == 0: continue
+          chunk.layers[layer] = (read_chunk(f, entry[1]), entry[0])
+      boundary = chunk.layers.get('boundary')
+      chunk.boundary_rects = greedy_rects(boundary[0] != EMPTY) if boundary is not None else []
+      chunk.entities = list(self.entities_by_chunk.get(key, ()))
+      self.results.put((req_generation, chunk))
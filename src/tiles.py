@@ -1,24 +1,139 @@
 import pygame
-import json
+import os
+from collections import OrderedDict
 from typing import Dict, List, Tuple, Optional
-from utils import load_image, BASE_PIXEL_SCALE, MAP_TO_JSON, GameState, tmAsset, AssetType
+from utils import load_image, ASSET_CACHE, BASE_PIXEL_SCALE, MAP_TO_JSON, MAP_TO_BIN, GameState, tmAsset, AssetType, STREAM_WORLD, STREAM_RADIUS, TEXTURE_ATLAS, RENDER_SCALE, art_scale
+from atlas import atlas_image
 from enum import Enum, auto
 from entities import StaticEntity
+from grid import TileGrid, CHUNK_SIZE
+from mapio import read_any_map, write_map
+from streaming import ChunkStreamer, chunk_key
+from profiler import PROFILER
+from render import RenderQueue, LowResTarget, LAYER_TILES
 
 MAX_LAYERS = 3
 
+# tiles per side of a baked render chunk, 8 * 64px -> 512x512 surface (~1MB)
+RENDER_CHUNK_SIZE = 8
+# LRU bound on baked chunk surfaces, a 1280x720 view touches at most 4x3 chunks per layer,
+# the editor adds a dimmed variant per unselected layer + the boundary overlay on top of those
+MAX_BAKED_CHUNKS = 128
+# alpha the editor draws every layer but the selected one with
+EDITOR_DIM_ALPHA = 128
+
 class TileMapState(Enum): DRAW_ON_GRID = auto(); DELETE = auto(); DRAW_OFF_GRID = auto();
 
 
+# bakes each layer into RENDER_CHUNK_SIZE^2 tile surfaces so a frame is a handful of chunk blits
+# chunks are keyed by (layer, chunk_x, chunk_y, alpha) and only re-baked after an edit invalidates them,
+# alpha < 255 is a translucent copy of the opaque bake (editor view of the unselected layers)
+# tiles that dont fit the grid cell (EntityRend props etc.) are kept aside as (tile id, position) and blitted on their own
+class TileChunkCache:
+  def __init__(self, tile_size: int, max_chunks: int = MAX_BAKED_CHUNKS):
+    self.tile_size = tile_size
+    # what a tile is drawn at, baked chunks are in render px
+    self.tile_px = round(tile_size * RENDER_SCALE)
+    self.chunk_px = self.tile_px * RENDER_CHUNK_SIZE
+    self.max_chunks = max_chunks
+    self.baked: OrderedDict[Tuple[str, int, int, int], Tuple[Optional[pygame.Surface], list]] = OrderedDict()
+    # (tile id, alpha) -> translucent copy of the tile, for oversized tiles on dimmed layers
+    self.variants: Dict[Tuple[int, int], pygame.Surface] = {}
+
+  @staticmethod
+  def chunk_of(coord: Tuple[int, int]) -> Tuple[int, int]:
+    return (int(coord[0]) // RENDER_CHUNK_SIZE, int(coord[1]) // RENDER_CHUNK_SIZE)
+
+  def get(self, layer: str, tile_grid: TileGrid, tileIDtoTile: Dict[int, tmAsset], chunk: Tuple[int, int], alpha: int = 255):
+    key = (layer, *chunk, alpha)
+    if key in self.baked:
+      self.baked.move_to_end(key)
+      return self.baked[key]
+
+    if alpha == 255: baked = self.bake(tile_grid, tileIDtoTile, chunk)
+    else: baked = self.dim(self.get(layer, tile_grid, tileIDtoTile, chunk), alpha)
+    self.baked[key] = baked
+    if len(self.baked) > self.max_chunks: self.baked.popitem(last=False)
+    return baked
+
+  def bake(self, tile_grid: TileGrid, tileIDtoTile: Dict[int, tmAsset], chunk: Tuple[int, int]):
+    o_x, o_y = chunk[0] * RENDER_CHUNK_SIZE, chunk[1] * RENDER_CHUNK_SIZE
+    surface, oversized = None, []
+
+    xs, ys, ids = tile_grid.window_tiles(o_x, o_y, o_x + RENDER_CHUNK_SIZE, o_y + RENDER_CHUNK_SIZE)
+    for x, y, tile_id in zip(xs.tolist(), ys.tolist(), ids.tolist()):
+      tile_surf = tileIDtoTile[tile_id].asset
+
+      if tile_surf.get_size() != (self.tile_px, self.tile_px):
+        oversized.append((tile_id, (x * self.tile_px, y * self.tile_px)))
+        continue
+
+      # empty chunks never allocate a surface
+      if surface is None: 
+        surface = pygame.Surface((self.chunk_px, self.chunk_px), pygame.SRCALPHA)
+        PROFILER.count('surfaces_allocated')
+      surface.blit(tile_surf, ((x - o_x) * self.tile_px, (y - o_y) * self.tile_px))
+
+    return surface, oversized
+
+  # tiles in a chunk never overlap, so one surface alpha over the whole bake matches dimming tile by tile
+  def dim(self, baked, alpha: int):
+    surface, oversized = baked
+    if surface is not None:
+      surface = surface.copy()
+      surface.set_alpha(alpha)
+      PROFILER.count('surfaces_allocated')
+    return surface, oversized
+
+  def variant(self, tileIDtoTile: Dict[int, tmAsset], tile_id: int, alpha: int = 255) -> pygame.Surface:
+    surface = tileIDtoTile[tile_id].asset
+    if alpha == 255: return surface
+    dimmed = self.variants.get((tile_id, alpha))
+    if dimmed is None:
+      dimmed = self.variants[(tile_id, alpha)] = surface.copy()
+      dimmed.set_alpha(alpha)
+      PROFILER.count('surfaces_allocated')
+    return dimmed
+
+  # every alpha of the chunk holding coord
+  def invalidate(self, layer: str, coord: Tuple[int, int]):
+    chunk = (layer, *self.chunk_of(coord))
+    for key in [k for k in self.baked if k[:3] == chunk]: del self.baked[key]
+
+  # every layer's baked chunks inside one TileGrid storage chunk (streamed in / out)
+  def invalidate_storage_chunk(self, key: Tuple[int, int]):
+    per_storage = CHUNK_SIZE // RENDER_CHUNK_SIZE
+    for baked_key in [k for k in self.baked if (k[1] // per_storage, k[2] // per_storage) == key]:
+      del self.baked[baked_key]
+
+  def clear(self):
+    self.baked.clear()
+    self.variants.clear()
+
+
+# id -> asset for the boundary layer, only occupancy matters there (older maps / edits saved other ids)
+class BoundaryOverlay(dict):
+  def __missing__(self, tile_id: int) -> tmAsset: return self[0]
+
+
 class TileMap:
   def __init__(self, tile_size=32, map_name: Optional[str]=None):
     self.load_assets()
+    self.map_name = map_name
+    self.tile_size = tile_size * BASE_PIXEL_SCALE
 
-
+    # STREAM_WORLD: maps start empty and fill in around the camera, see stream_update
+    self.streamer: Optional[ChunkStreamer] = None
     self.maps, self.off_grid_assets = self._init_map(map_name) 
 
-    self.tile_size = tile_size * BASE_PIXEL_SCALE
     self.display_surface = pygame.display.get_surface()
+    self.chunk_cache = TileChunkCache(self.tile_size)
+    # editor view of the boundary layer, every boundary tile is this one red surface whatever its id
+    boundary_tile = pygame.Surface((self.chunk_cache.tile_px, self.chunk_cache.tile_px))
+    boundary_tile.fill((255, 0, 0))
+    self.boundary_overlay = BoundaryOverlay({0: tmAsset(boundary_tile, AssetType.TileRend, 0)})
+    # LOW_RES: the LowResTarget the window is scaled from, maps the mouse back into the view
+    self.viewport: Optional[LowResTarget] = None
 
     self.layers = list(self.maps.keys()) 
 
@@ -30,9 +145,21 @@ class TileMap:
 
     self.to_entity_renderer = []
 
+    # bumped on every tile / offgrid edit that changed something, renderers caching the tilemap redraw on it
+    self.revision = 0
+    # boundary tiles edited since the last event_handler call, for the collision geometry
+    self.boundary_edits: List[Tuple[int, int]] = []
+
   def _init_map(self, map_name:Optional[str]=None) -> Tuple[Dict, List[StaticEntity]]: 
-    if map_name: return self.load_map(MAP_TO_JSON[map_name])
-    else: return ({'layer_1': {}, 'offgrid': {}, 'boundary': {}}, [])
+    if map_name: 
+      bin_path = MAP_TO_BIN.get(map_name)
+      if STREAM_WORLD and bin_path and os.path.exists(bin_path):
+        self.streamer = ChunkStreamer(bin_path, self.tile_size, STREAM_RADIUS)
+        maps = {'layer_1': TileGrid(), 'offgrid': {}, 'boundary': TileGrid()}
+        maps.update({name: TileGrid() for name in self.streamer.layer_names})
+        return maps, []
+      return self.load_map(bin_path if bin_path and os.path.exists(bin_path) else MAP_TO_JSON[map_name])
+    else: return ({'layer_1': TileGrid(), 'offgrid': {}, 'boundary': TileGrid()}, [])
   
   @property
   def selected_asset_type(self): return self.tileIDtoTile[self.selected_tile_id].type
@@ -47,11 +174,17 @@ class TileMap:
   # Off Grid -> All drawn asses will be Entities With Collisions
   # On Grid -> We need to place Collision boxes manually using the boundary layer
   def load_assets(self):
+    # TEXTURE_ATLAS: tiles are subsurfaces of the atlas pages, baked chunks / editor blits read from there
+    if TEXTURE_ATLAS: load = atlas_image
+    else:
+      load = load_image
+      # decode them side by side on the asset workers, load_image below just waits + converts
+      ASSET_CACHE.prefetch([(path, art_scale()) for path in ('tilemaptest.png', 'redtile.png', 'passthrutest.png')] + [('danyaseethe.png', art_scale(scale=False))])
     self.tileIDtoTile = {
-      1: tmAsset(load_image('tilemaptest.png'), AssetType.TileRend, 1),
-      2: tmAsset(load_image('redtile.png'), AssetType.TileRend, 2),
-      3: tmAsset(load_image('danyaseethe.png', scale=False), AssetType.EntityRend, 3),
-      4: tmAsset(load_image('passthrutest.png', scale=True), AssetType.EntityRend, 4)
+      1: tmAsset(load('tilemaptest.png'), AssetType.TileRend, 1),
+      2: tmAsset(load('redtile.png'), AssetType.TileRend, 2),
+      3: tmAsset(load('danyaseethe.png', scale=False), AssetType.EntityRend, 3),
+      4: tmAsset(load('passthrutest.png', scale=True), AssetType.EntityRend, 4)
     }
 
 
@@ -83,6 +216,10 @@ class TileMap:
         removed = self.delete_tile_at_mouse_position(camera_scroll)
         if removed: result['removed_entity'] = removed
 
+    if self.boundary_edits:
+      result['removed_boundary' if self.state == TileMapState.DELETE else 'added_boundary'] = self.boundary_edits
+      self.boundary_edits = []
+
     # return None if no entities were spaned
     if all(result.values()) is None: return None
     return result
@@ -96,47 +233,57 @@ class TileMap:
 
   def layer_k_to_layer(self, k_str: str) -> int: return int(k_str.replace("layer_", ""))
 
-  def render(self, camera_scroll, camera_width, camera_height):
+  # surface defaults to the display, the dirty rect renderer points this at its cached background
+  # queue: hand the tile blits to a RenderQueue instead of drawing them here
+  def render(self, camera_scroll, camera_width, camera_height, surface: Optional[pygame.Surface] = None, queue: Optional[RenderQueue] = None):
+    target = surface if surface is not None else self.display_surface
+    blits = []
+    # visible range is worked out in world px, blits are placed in render px (see RENDER_SCALE)
+    tile_px = self.chunk_cache.tile_px
+    scroll = (camera_scroll[0] * RENDER_SCALE, camera_scroll[1] * RENDER_SCALE)
     # Calculate the visible tile range
     start_x = int(camera_scroll[0] // self.tile_size)
     end_x   = int((camera_scroll[0] + camera_width) // self.tile_size) + 1
     start_y = int(camera_scroll[1] // self.tile_size)
     end_y   = int((camera_scroll[1] + camera_height) // self.tile_size) + 1
 
-    coordinates_to_render = [(x, y) for x in range(start_x, end_x) for y in range(start_y, end_y)]
-
-    # when in map editor, show boundary tiles
-    for layer, tile_dict in self.maps.items():
-      # skip offgrid / Boundary tiles layer in tile rendering
-      if 'layer' not in layer:
-        continue
-      for coord in coordinates_to_render:
-        if coord in tile_dict:
-          screen_x = coord[0] * self.tile_size - camera_scroll[0]
-          screen_y = coord[1] * self.tile_size - camera_scroll[1]
-          tile_id = tile_dict[coord]
-          tile_surf = self.tileIDtoTile[tile_id].asset
-
-          if self.game_state == GameState.MAP_EDITOR:
-            layer_num = self.layer_k_to_layer(layer)
-            temp = tile_surf.copy()
-            temp.set_alpha(255 if layer_num == self.selected_layer else 128)
-            self.display_surface.blit(temp, (screen_x, screen_y))
-          else:
-            self.display_surface.blit(tile_surf, (screen_x, screen_y))
+    # skip offgrid / Boundary tiles layer in tile rendering
+    layers = [(layer, tile_grid, self.tileIDtoTile, 255) for layer, tile_grid in self.maps.items() if 'layer' in layer]
 
+    # when in map editor, dim the layers we're not editing and show boundary tiles
+    # both come out of the chunk cache, so a frame allocates nothing until a tile or the selected layer changes
     if self.game_state == GameState.MAP_EDITOR:
-      for coord in coordinates_to_render:
-        if coord in self.maps['boundary']:
-          screen_x = coord[0] * self.tile_size - camera_scroll[0]
-          screen_y = coord[1] * self.tile_size - camera_scroll[1]
-          tile_surf = pygame.Surface((self.tile_size, self.tile_size))
-          tile_surf.fill((255, 0, 0))
-
-          self.display_surface.blit(tile_surf, (screen_x, screen_y))
-  
+      layers = [(layer, tile_grid, tiles, 255 if self.layer_k_to_layer(layer) == self.selected_layer else EDITOR_DIM_ALPHA)
+                for layer, tile_grid, tiles, _ in layers]
+      layers.append(('boundary', self.maps['boundary'], self.boundary_overlay, 255))
+
+    self.render_chunks(blits, scroll, start_x, end_x, start_y, end_y, layers)
+    self.submit(blits, target, queue)
     return self.to_entity_renderer
 
+  # one fblits call for the whole map instead of a blit per chunk / tile
+  @staticmethod
+  def submit(blits: List, target: pygame.Surface, queue: Optional[RenderQueue]):
+    if queue is not None: queue.extend(blits, LAYER_TILES)
+    else: target.fblits(blits)
+
+  # one blit per baked chunk per layer instead of one per tile, scroll in render px
+  # layers: (name, grid, tile id -> asset, alpha) in draw order
+  def render_chunks(self, blits: List, scroll, start_x, end_x, start_y, end_y, layers: List[Tuple[str, TileGrid, Dict[int, tmAsset], int]]):
+    start_cx, end_cx = start_x // RENDER_CHUNK_SIZE, (end_x - 1) // RENDER_CHUNK_SIZE + 1
+    start_cy, end_cy = start_y // RENDER_CHUNK_SIZE, (end_y - 1) // RENDER_CHUNK_SIZE + 1
+    chunk_px = self.chunk_cache.chunk_px
+
+    for layer, tile_grid, tiles, alpha in layers:
+      for c_x in range(start_cx, end_cx):
+        for c_y in range(start_cy, end_cy):
+          surface, oversized = self.chunk_cache.get(layer, tile_grid, tiles, (c_x, c_y), alpha)
+          if surface is not None:
+            blits.append((surface, (c_x * chunk_px - scroll[0], c_y * chunk_px - scroll[1])))
+          for tile_id, (p_x, p_y) in oversized:
+            blits.append((self.chunk_cache.variant(tiles, tile_id, alpha), (p_x - scroll[0], p_y - scroll[1])))
+          if PROFILER.enabled: PROFILER.count('tile_blits', (surface is not None) + len(oversized))
+
   def mouse_position_to_tile(self, camera_scroll):
     m_x, m_y = self.mouse_position(camera_scroll)
     m_tile_x = int(m_x // self.tile_size)
@@ -144,7 +291,7 @@ class TileMap:
     return (m_tile_x, m_tile_y)
 
   def mouse_position(self, camera_scroll):
-    m_x, m_y = pygame.mouse.get_pos()
+    m_x, m_y = pygame.mouse.get_pos() if self.viewport is None else self.viewport.window_to_view(pygame.mouse.get_pos())
     return (m_x + camera_scroll[0], m_y + camera_scroll[1])
 
   def cycle_tiles(self) -> int:
@@ -155,22 +302,46 @@ class TileMap:
     if self.selected_layer != 'Boundary':
       self.selected_layer = (self.selected_layer % MAX_LAYERS) + 1
       if self.selected_layer > len(self.layers):
-        self.maps[self.layer_k] = {}
+        self.maps[self.layer_k] = TileGrid()
       return self.selected_layer
 
   def set_state(self, state: TileMapState):
     if self.state != state: self.state = state
 
+  # every grid edit goes through these so baked chunks / collision geometry hear about it
+  # painting over a tile with the same id (mouse held down) is not an edit
+  def set_tile(self, layer: str, coord: Tuple[int, int], tile_id: int):
+    if self.maps[layer].get(coord) == tile_id: return
+    self.maps[layer][coord] = tile_id
+    self.revision += 1
+    self.chunk_cache.invalidate(layer, coord)
+    if layer == 'boundary': self.boundary_edits.append(coord)
+    if self.streamer is not None: self.streamer.mark_dirty(layer, TileGrid.split(coord)[0])
+
+  def delete_tile(self, layer: str, coord: Tuple[int, int]):
+    del self.maps[layer][coord]
+    self.revision += 1
+    self.chunk_cache.invalidate(layer, coord)
+    if layer == 'boundary': self.boundary_edits.append(coord)
+    if self.streamer is not None: self.streamer.mark_dirty(layer, TileGrid.split(coord)[0])
+
+  def mark_offgrid_dirty(self, pos: Tuple[float, float]):
+    if self.streamer is not None: self.streamer.mark_dirty('offgrid', chunk_key(*pos, self.tile_size))
+
   def place_tile_at_mouse_position(self, camera_scroll) -> Optional[StaticEntity]:
     m_p = self.mouse_position(camera_scroll) if self.state == TileMapState.DRAW_OFF_GRID else self.mouse_position_to_tile(camera_scroll)
 
-    if self.selected_layer == 'Boundary':
-      self.maps[self.layer_k][m_p] = 0
+    # the boundary layer only stores occupancy, a wall is id 0 whatever tile is selected
+    if self.selected_layer == 'Boundary' and self.state != TileMapState.DRAW_OFF_GRID:
+      self.set_tile(self.layer_k, m_p, 0)
+      return None
 
     if self.state == TileMapState.DRAW_OFF_GRID:
       new_e = StaticEntity(m_p, asset=self.selected_asset)
       self.off_grid_assets.append(new_e)
       self.maps['offgrid'][m_p] = self.selected_asset.id
+      self.mark_offgrid_dirty(m_p)
+      self.revision += 1
       return new_e
     
     if self.selected_asset_type == AssetType.EntityRend:
@@ -178,10 +349,10 @@ class TileMap:
       n_p = (m_p[0] * self.tile_size, m_p[1] * self.tile_size)
       new_e = StaticEntity(n_p, asset=self.selected_asset)
       self.to_entity_renderer.append(new_e)
-      self.maps[self.layer_k][n_p] = self.selected_tile_id if self.selected_layer != 'Boundary' else 0 
+      self.set_tile(self.layer_k, n_p, self.selected_tile_id)
     
     else:
-      self.maps[self.layer_k][m_p] = self.selected_tile_id
+      self.set_tile(self.layer_k, m_p, self.selected_tile_id)
 
     return None
     
@@ -194,50 +365,70 @@ class TileMap:
     for entity in self.off_grid_assets:
       if entity.rect.collidepoint(mp):
         self.off_grid_assets.remove(entity)
+        self.mark_offgrid_dirty(entity.get_pos)
+        self.revision += 1
         return entity 
 
     tile_position = self.mouse_position_to_tile(camera_scroll)
     layer_key = self.layer_k if self.selected_layer != 'Boundary' else 'boundary'
     if tile_position in self.maps[layer_key]:
-      del self.maps[layer_key][tile_position]
+      self.delete_tile(layer_key, tile_position)
     return None
 
+  # binary save, see mapio.py for the layout
   def save_current_map(self):
-    dict_to_save = {}
-
-    for map_name, map_data in self.maps.items():
-      if map_name != 'offgrid':
-        dict_to_save[map_name] = {
-          str(key): value
-          for key, value in map_data.items()
-        }
-      else:
-        for j in self.off_grid_assets: 
-          dict_to_save[map_name] = { 
-            str(j.get_pos): j.get_asset_id
-          }
-      
-    with open('../assets/maps/map_data.json', 'w') as f:
-      json.dump(dict_to_save, f, indent=2)
-
+    layers = {map_name: map_data for map_name, map_data in self.maps.items() if map_name != 'offgrid'}
+    offgrid = [(j.get_pos, j.get_asset_id) for j in self.off_grid_assets]
+    if self.streamer is not None: return self.streamer.save(layers, offgrid)
+    write_map(MAP_TO_BIN[self.map_name or 'dev'], layers, offgrid)
+
+  # STREAM_WORLD: evict chunks that left the radius, install the ones the worker finished
+  # returns (spawned offgrid entities, despawned ones, [(storage chunk, boundary rects or None)])
+  def stream_update(self, center_px: Tuple[float, float], wait: bool = False):
+    spawned, despawned, regions = [], [], []
+    for key in self.streamer.update(center_px):
+      grids = {name: grid for name, grid in self.maps.items() if name != 'offgrid'}
+      leaving = [e for e in self.off_grid_assets if chunk_key(*e.get_pos, self.tile_size) == key]
+      self.streamer.evict(key, {name: (grid.chunk(*key), grid.counts.get(key, 0)) for name, grid in grids.items()},
+                          [(e.get_pos, e.get_asset_id) for e in leaving])
+      for grid in grids.values(): grid.set_chunk(key, None, 0)
+      for e in leaving:
+        self.off_grid_assets.remove(e)
+        self.maps['offgrid'].pop(e.get_pos, None)
+      despawned += leaving
+      regions.append((key, []))
+      self.chunk_cache.invalidate_storage_chunk(key)
+
+    for chunk in self.streamer.poll(wait):
+      for name, (arr, count) in chunk.layers.items():
+        if name not in self.maps: self.maps[name] = TileGrid()
+        self.maps[name].set_chunk(chunk.key, arr, count)
+      for pos, tile_id in chunk.entities:
+        entity = StaticEntity(tuple(pos), asset=self.tileIDtoTile[tile_id])
+        self.off_grid_assets.append(entity)
+        self.maps['offgrid'][tuple(pos)] = tile_id
+        spawned.append(entity)
+      regions.append((chunk.key, chunk.boundary_rects))
+      self.chunk_cache.invalidate_storage_chunk(chunk.key)
+
+    if regions:
+      self.layers = list(self.maps.keys())
+      self.revision += 1
+    return spawned, despawned, regions
+
+  # .mrsp maps are memory mapped, .json maps go through the fallback reader
   def load_map(self, map_path):
     # TODO: pass AssetType.Entities on grid to the entity renderer
-    with open(map_path, 'r') as f:
-      json_data = json.load(f)
+    layers, offgrid = read_any_map(map_path)
 
     maps_dict, off_grid = self._init_map(None)
+    maps_dict.update(layers)
 
-    for map_name, map_data in json_data.items():
-      maps_dict[map_name] = {
-        eval(key): value
-        for key, value in map_data.items()
-      }
-
-    if 'offgrid' in maps_dict:
-      for pos, tile_id in maps_dict['offgrid'].items():
-        asset = self.tileIDtoTile[tile_id]
-        ent = StaticEntity(tuple(pos), asset=asset)
-        off_grid.append(ent)
+    for pos, tile_id in offgrid:
+      maps_dict['offgrid'][pos] = tile_id
+      asset = self.tileIDtoTile[tile_id]
+      ent = StaticEntity(tuple(pos), asset=asset)
+      off_grid.append(ent)
 
     return maps_dict, off_grid
 
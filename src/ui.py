@@ -1,7 +1,175 @@
-from typing import Tuple, Optional
-from utils import load_image
+from __future__ import annotations
+from typing import Tuple, Optional, List, Dict, TYPE_CHECKING
+from collections import deque
+from utils import load_image, GameState
+from profiler import PROFILER, FrameProfiler
+from pool import pool_report
+from render import mark_redrawn
 import pygame
 
+if TYPE_CHECKING:
+  from main import Game
 
-class UIElement(pygame.sprite.Sprite): 
-  pass
\ No newline at end of file
+'''
+UIElement: retained piece of UI, hands its cached surfaces to the renderer as (surface, position) overlays
+
+TextPanel: lines of text, a line is only re-rendered when its string changes
+ProfilerPanel: frame time graph + percentiles, shown while the profiler is on (F3)
+HUD: debug readout + map editor panel drawn by Game.render_ui
+'''
+
+Overlay = Tuple[pygame.Surface, Tuple[float, float]]
+
+EDITOR_HELP = "CHANGE TILE: [A], CHANGE LAYER: [D], CHANGE OPERATION [F], BOUNDARY MODE [E]"
+
+# SysFont does a system font lookup, only ever do it once per (name, size)
+_FONTS: Dict[Tuple[str, int], pygame.font.Font] = {}
+
+def load_font(name: str, size: int) -> pygame.font.Font:
+  font = _FONTS.get((name, size))
+  if font is None:
+    if not pygame.font.get_init(): pygame.font.init()
+    font = _FONTS[(name, size)] = pygame.font.SysFont(name, size)
+  return font
+
+
+class UIElement(pygame.sprite.Sprite):
+  def __init__(self, pos: Tuple[float, float] = (0, 0)):
+    super().__init__()
+    self.pos = pos
+    self.visible = True
+
+  def overlays(self) -> List[Overlay]: return []
+
+
+class TextPanel(UIElement):
+  def __init__(self, font: pygame.font.Font, color=(255, 255, 255), pos: Tuple[float, float] = (0, 0)):
+    super().__init__(pos)
+    self.font, self.color = font, color
+    self.lines: List[str] = []
+    self.surfaces: List[pygame.Surface] = []
+    # how many line renders we actually paid for
+    self.renders = 0
+
+  def set_lines(self, lines: List[str]):
+    for i, text in enumerate(lines):
+      if i < len(self.lines):
+        if self.lines[i] == text: continue
+        self.lines[i], self.surfaces[i] = text, self.font.render(text, False, self.color)
+      else:
+        self.lines.append(text)
+        self.surfaces.append(self.font.render(text, False, self.color))
+      self.renders += 1
+      PROFILER.count('surfaces_allocated')
+    del self.lines[len(lines):], self.surfaces[len(lines):]
+
+  def overlays(self) -> List[Overlay]:
+    if not self.visible: return []
+    x, y = self.pos
+    line_height = self.font.get_linesize()
+    return [(surface, (x, y + i * line_height)) for i, surface in enumerate(self.surfaces)]
+
+
+# frame rate averaged over the last `window` frames so the readout doesnt flicker every frame
+class FPSCounter:
+  def __init__(self, window: int = 60):
+    self.frame_times = deque(maxlen=window)
+    self.total = 0.0
+
+  def push(self, dt: float):
+    if len(self.frame_times) == self.frame_times.maxlen: self.total -= self.frame_times[0]
+    self.frame_times.append(dt)
+    self.total += dt
+
+  @property
+  def fps(self) -> float: return len(self.frame_times) / self.total if self.total > 0 else 0
+
+
+# stacked per phase frame times for the last `width` frames, the line is the 60fps budget
+PHASE_COLORS = [(230, 25, 75), (60, 180, 75), (255, 225, 25), (0, 130, 200), (245, 130, 48), (145, 30, 180), (70, 240, 240), (240, 50, 230)]
+
+class ProfilerPanel(UIElement):
+  def __init__(self, font: pygame.font.Font, profiler: FrameProfiler = PROFILER, size: Tuple[int, int] = (240, 80), max_ms: float = 33.3):
+    super().__init__()
+    self.profiler = profiler
+    self.graph = pygame.Surface(size, pygame.SRCALPHA)
+    self.max_ms = max_ms
+    self.text = TextPanel(font)
+    self.frames_since_text = 0
+
+  def update(self, pos: Tuple[float, float]):
+    self.visible = self.profiler.enabled
+    if not self.visible: return
+    self.pos = pos
+    frames = list(self.profiler.frames)[-self.graph.get_width():]
+    phases = self.profiler.phase_names()
+
+    width, height = self.graph.get_size()
+    self.graph.fill((0, 0, 0, 160))
+    for x, (_, timings, _) in enumerate(frames):
+      y = height
+      for i, phase in enumerate(phases):
+        bar = int(timings.get(phase, 0.0) * 1000 / self.max_ms * height)
+        if bar <= 0: continue
+        pygame.draw.line(self.graph, PHASE_COLORS[i % len(PHASE_COLORS)], (x, y - 1), (x, max(y - bar, 0)))
+        y -= bar
+    budget_y = height - int(16.7 / self.max_ms * height)
+    pygame.draw.line(self.graph, (255, 255, 255), (0, budget_y), (width, budget_y))
+    mark_redrawn(self.graph)
+
+    # percentiles over the whole ring buffer are not free, refresh them twice a second
+    self.frames_since_text += 1
+    if self.frames_since_text >= 30 or not self.text.lines:
+      self.frames_since_text = 0
+      summary = self.profiler.summary()
+      counters = self.profiler.counter_summary()
+      self.text.set_lines(
+        [f"{phase}: p50 {s['p50']:.2f} p95 {s['p95']:.2f} p99 {s['p99']:.2f} ms" for phase, s in summary.items()] +
+        [f"{name}: {n:.0f}/frame" for name, n in counters.items()] +
+        [f"pool {name}: {r['active']} active, {r['free']} free, {r['created']} created" for name, r in pool_report().items()]
+      )
+    self.text.pos = (pos[0], pos[1] + height + 4)
+
+  def overlays(self) -> List[Overlay]:
+    if not self.visible: return []
+    return [(self.graph, self.pos)] + self.text.overlays()
+
+
+class HUD:
+  def __init__(self, font_name: str = 'Times New Roman', font_size: int = 15):
+    font = load_font(font_name, font_size)
+    self.fps = FPSCounter()
+    self.debug_panel = TextPanel(font)
+    self.editor_panel = TextPanel(font)
+    self.profiler_panel = ProfilerPanel(font)
+
+  def update(self, game: Game, scroll: pygame.Vector2):
+    self.fps.push(game.dt)
+    player, tm = game.player, game.current_map
+    mp_x, mp_y = pygame.mouse.get_pos()
+
+    self.debug_panel.set_lines([
+      f"FPS: <{int(self.fps.fps)}>",
+      f"Mouse Tile Position: <{tm.mouse_position_to_tile(game.camera.scroll)}>",
+      f"State: {player.state}",
+      f"Direction: {player.direction}",
+      f"Pixel Offset from Player:{mp_x + game.camera.scroll.x - player.x},{mp_y + game.camera.scroll.y - player.y}",
+      f"Tile Position:{player.tile_position()}",
+      f"Game State: {game.state}",
+    ])
+    self.debug_panel.pos = (player.rect.x - scroll.x + 400, player.rect.y - scroll.y - 320)
+
+    self.editor_panel.visible = game.state == GameState.MAP_EDITOR
+    if self.editor_panel.visible:
+      self.editor_panel.set_lines([
+        EDITOR_HELP,
+        f"selected tile: {tm.selected_tile_id}",
+        f"selected layer: {tm.selected_layer}",
+        f"editor state: {tm.state}",
+      ])
+      self.editor_panel.pos = (player.rect.x - scroll.x - 600, player.rect.y - scroll.y - 320)
+
+    self.profiler_panel.update((player.rect.x - scroll.x + 400, player.rect.y - scroll.y - 180))
+
+  def overlays(self) -> List[Overlay]:
+    return self.debug_panel.overlays() + self.editor_panel.overlays() + self.profiler_panel.overlays()
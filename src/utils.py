@@ -1,21 +1,62 @@
 import pygame
 import os
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum, auto
-from typing import Optional, Tuple
-from dataclasses import dataclass
+from typing import Dict, Optional, Tuple, Iterable, Union
+from dataclasses import dataclass, asdict
 
 
 
 BASE_PATH = '../assets/'
 BASE_PIXEL_SCALE = 2
 
+# LOW_RES=1: draw the world at the art's own resolution into a NATIVE_SIZE surface, scaled up to the window once per frame
+LOW_RES = int(os.getenv("LOW_RES", 0))
+NATIVE_SIZE = (640, 360)
+# LOW_RES window = NATIVE_SIZE * WINDOW_SCALE, 0 keeps 1280x720 and uses the largest integer scale that fits
+WINDOW_SCALE = int(os.getenv("WINDOW_SCALE", 0))
+# art is drawn at ART_SCALE, world coordinates (rects, speeds, tile_size) stay in BASE_PIXEL_SCALE'd px either way
+ART_SCALE = 1 if LOW_RES else BASE_PIXEL_SCALE
+# world px -> render target px
+RENDER_SCALE = ART_SCALE / BASE_PIXEL_SCALE
+
 MAP_TO_JSON = { 
   'dev' : BASE_PATH + 'maps/map_data.json'
 }
 
+# binary maps, written on save and preferred over the json when present
+MAP_TO_BIN = { 
+  'dev' : BASE_PATH + 'maps/map_data.mrsp'
+}
+
 # this doesnt work on windows. SAD!
 DEBUG = os.getenv("DEBUG", 0)
 
+# step DynamicEntities through the vectorized PhysicsWorld instead of per entity update_physics
+BATCH_PHYSICS = int(os.getenv("BATCH_PHYSICS", 0))
+# resolve DynamicEntities straight against the boundary grid (swept, sub-stepped) instead of the merged colliders
+TILE_COLLISION = int(os.getenv("TILE_COLLISION", 0))
+
+# simulation runs in fixed ticks, one tick is one animation game frame
+FIXED_DT = 1 / 60
+# longest frame we try to catch up on, anything past this is dropped (breakpoints, window drags)
+MAX_FRAME_TIME = 0.25
+# 0 = uncapped
+FPS_CAP = int(os.getenv("FPS_CAP", 0))
+VSYNC = int(os.getenv("VSYNC", 0))
+# only push the parts of the screen that changed, see render.py
+DIRTY_RECTS = int(os.getenv("DIRTY_RECTS", 0))
+# keep only the map chunks around the camera loaded (binary maps only), radius in 32 tile storage chunks
+STREAM_WORLD = int(os.getenv("STREAM_WORLD", 0))
+STREAM_RADIUS = int(os.getenv("STREAM_RADIUS", 2))
+# threads decoding / scaling images for AssetCache.prefetch
+ASSET_WORKERS = int(os.getenv("ASSET_WORKERS", min(4, os.cpu_count() or 1)))
+# tiles + animation frames come out of the packed texture atlas (atlas.py) instead of one surface per image / sheet
+TEXTURE_ATLAS = int(os.getenv("TEXTURE_ATLAS", 0))
+
 class GameState(Enum): PLAYING = auto(); PAUSED = auto(); MAP_EDITOR = auto(); INIT = auto();
 class AssetType(Enum): TileRend = auto(); EntityRend = auto(); 
 
@@ -29,14 +70,154 @@ class Camera:
   def __init__(self, width, height): 
     self.width, self.height = width, height
     self.scroll = pygame.math.Vector2(0,0)
+    self.prev_scroll = pygame.math.Vector2(0,0)
+
+  # scroll between the last two simulation ticks, alpha = leftover fraction of a tick
+  def interpolated_scroll(self, alpha: float) -> pygame.Vector2:
+    return self.prev_scroll.lerp(self.scroll, alpha)
   
   def center_camera_on_target(self, target: pygame.Surface): 
     self.scroll.x = target.rect.centerx - self.width // 2
     self.scroll.y = target.rect.centery - self.height // 2    
 
 
-# thinking about adding an explicit size to our image loader
+AssetKey = Tuple[str, int, Optional[Tuple[int, int]]]
+
+@dataclass
+class AssetStats:
+  hits: int = 0
+  misses: int = 0
+  evictions: int = 0
+  bytes: int = 0
+  # seconds spent decoding + scaling (summed over workers), converting on the main thread, and blocked on workers
+  decode_seconds: float = 0.0
+  convert_seconds: float = 0.0
+  wait_seconds: float = 0.0
+
+'''
+AssetCache: every decoded + scaled image in the process, keyed by (path, scale, size)
+
+- the same sheet asked for by N Animations / entities / TileMaps is decoded once
+- LRU evicts the least recently used surfaces once we go over max_bytes
+- surfaces are shared, copy before mutating one (set_alpha, fill, ...)
+- prefetch() decodes + scales on a thread pool (both release the GIL), get() then only waits for
+  that future and does convert_alpha, which needs the display and stays on the main thread
+'''
+
+# AssetCache.prefetch entry: "path", {"path": .., "scale": .., "size": [w, h]} or (path, scale, size) args for get()
+AssetEntry = Union[str, dict, tuple]
+
+class AssetCache:
+  def __init__(self, max_bytes: int = 256 * 1024 * 1024, workers: int = ASSET_WORKERS):
+    self.max_bytes = max_bytes
+    self.surfaces: OrderedDict[AssetKey, pygame.Surface] = OrderedDict()
+    self.stats = AssetStats()
+
+    self.workers = workers
+    self.pool: Optional[ThreadPoolExecutor] = None
+    # decodes in flight, key -> future of (unconverted surface, decode seconds)
+    self.pending: Dict[AssetKey, Future] = {}
+
+  @staticmethod
+  def key(path: str, scale: int = BASE_PIXEL_SCALE, size: Optional[Tuple[int, int]] = None) -> AssetKey:
+    # player sheets come in as '../assets/player/..', normalise so both spellings hit the same entry
+    return (os.path.normpath(BASE_PATH + path), scale, tuple(size) if size else None)
+
+  def get(self, path: str, scale: int = BASE_PIXEL_SCALE, size: Optional[Tuple[int, int]] = None) -> pygame.Surface:
+    key = self.key(path, scale, size)
+    surface = self.surfaces.get(key)
+    if surface is not None:
+      self.stats.hits += 1
+      self.surfaces.move_to_end(key)
+      return surface
+
+    self.stats.misses += 1
+    future = self.pending.pop(key, None)
+    # still queued behind other prefetches, quicker to decode it here than to wait our turn
+    if future is not None and future.cancel(): future = None
+    if future is not None:
+      t = time.perf_counter()
+      surface, decode_seconds = future.result()
+      self.stats.wait_seconds += time.perf_counter() - t
+    else: surface, decode_seconds = self.decode(key)
+    self.stats.decode_seconds += decode_seconds
+
+    t = time.perf_counter()
+    surface = surface.convert_alpha()
+    self.stats.convert_seconds += time.perf_counter() - t
+    self.put(key, surface)
+    return surface
+
+  # no display calls in here, runs on the pool
+  @staticmethod
+  def decode(key: AssetKey) -> Tuple[pygame.Surface, float]:
+    path, scale, size = key
+    t = time.perf_counter()
+    img = pygame.image.load(path)
+    surface = pygame.transform.scale(img, size if size else (round(img.get_width() * scale), round(img.get_height() * scale)))
+    return surface, time.perf_counter() - t
+
+  @staticmethod
+  def entry_args(entry: AssetEntry) -> tuple:
+    if isinstance(entry, str): return (entry,)
+    if isinstance(entry, dict): return (entry['path'], entry.get('scale', BASE_PIXEL_SCALE), entry.get('size'))
+    return tuple(entry)
+
+  # start decoding in the background, a later get() for the same key picks the result up
+  def prefetch(self, entries: Iterable[AssetEntry]):
+    for entry in entries:
+      key = self.key(*self.entry_args(entry))
+      if key in self.surfaces or key in self.pending: continue
+      if self.pool is None: self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="asset")
+      self.pending[key] = self.pool.submit(self.decode, key)
+
+  def put(self, key: AssetKey, surface: pygame.Surface):
+    if key in self.surfaces: self.stats.bytes -= self.surface_bytes(self.surfaces[key])
+    self.surfaces[key] = surface
+    self.surfaces.move_to_end(key)
+    self.stats.bytes += self.surface_bytes(surface)
+
+    # never evict the surface we just handed out
+    while self.stats.bytes > self.max_bytes and len(self.surfaces) > 1:
+      _, evicted = self.surfaces.popitem(last=False)
+      self.stats.bytes -= self.surface_bytes(evicted)
+      self.stats.evictions += 1
+
+  @staticmethod
+  def surface_bytes(surface: pygame.Surface) -> int: return surface.get_pitch() * surface.get_height()
+
+  # manifest: a json file or a list of entries, entry = "path" or {"path": .., "scale": .., "size": [w, h]}
+  # everything decodes in parallel, then gets converted in manifest order
+  def preload(self, manifest: Union[str, Iterable]):
+    if isinstance(manifest, str):
+      with open(manifest, 'r') as f: manifest = json.load(f)
+    args = [self.entry_args(entry) for entry in manifest]
+    self.prefetch(args)
+    for entry in args: self.get(*entry)
+
+  def clear(self):
+    self.surfaces.clear()
+    self.pending.clear()
+    self.stats.bytes = 0
+
+  def report(self) -> dict: return {**asdict(self.stats), 'entries': len(self.surfaces)}
+
+  def __contains__(self, key: AssetKey) -> bool: return key in self.surfaces
+
+  def __len__(self) -> int: return len(self.surfaces)
+
+ASSET_CACHE = AssetCache()
+
+# cache scale an image asked for at world scale is decoded at, the same thing unless LOW_RES
+def art_scale(pixel_scale=BASE_PIXEL_SCALE, scale: bool = True) -> float:
+  return (pixel_scale if scale else 1) * RENDER_SCALE
+
+# world size of a surface drawn at the render scale
+def world_size(surface: pygame.Surface) -> Tuple[float, float]:
+  return (surface.get_width() / RENDER_SCALE, surface.get_height() / RENDER_SCALE)
+
+# pixel_scale / size are world scale, LOW_RES hands back the surface at the art's own resolution
+# size scales straight to (w, h) instead of by pixel_scale
 def load_image(path:str, pixel_scale=BASE_PIXEL_SCALE, scale:bool=True, size:Optional[Tuple[int, int]]=None) -> pygame.Surface:
-  scale = pixel_scale if scale else 1
-  img = pygame.image.load(BASE_PATH + path).convert_alpha()
-  return pygame.transform.scale(img, (img.get_width() * scale, img.get_height() * scale))
\ No newline at end of file
+  if size: size = (round(size[0] * RENDER_SCALE), round(size[1] * RENDER_SCALE))
+  return ASSET_CACHE.get(path, art_scale(pixel_scale, scale), size)
\ No newline at end of file